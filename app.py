@@ -1,158 +1,308 @@
-import streamlit as st
-import os
-from src.generate_outline import load_outline_from_file, extract_outline_metadata, parse_outline
-from src.generate_parts import run_generate_parts_for_all
-from src.generate_contents import run_generate_contents_and_save_book
-
-# ─────────────────────────────────────────────────────────────────────────────
-# Session State Initialization
-# ─────────────────────────────────────────────────────────────────────────────
-if "preview_ready" not in st.session_state:
-    st.session_state.preview_ready = False
-
-if "preview_approved" not in st.session_state:
-    st.session_state.preview_approved = False
-
-if "run_full_after_preview" not in st.session_state:
-    st.session_state.run_full_after_preview = False
-
-# ─────────────────────────────────────────────────────────────────────────────
-# Page Setup
-# ─────────────────────────────────────────────────────────────────────────────
-st.set_page_config(page_title="📘 Book Generator", layout="centered")
-st.title("📘 AI Textbook Generator")
-
-# ─────────────────────────────────────────────────────────────────────────────
-# Supporting Document Upload (Optional)
-# ─────────────────────────────────────────────────────────────────────────────
-supporting_text = ""
-supporting_files = st.file_uploader(
-    "Upload optional supporting document(s)", type=["txt", "md", "pdf"], accept_multiple_files=True
-)
-
-if supporting_files:
-    st.markdown("✅ Support files uploaded:")
-    for f in supporting_files:
-        st.markdown(f"- {f.name}")
-        if f.type in ["text/plain", "text/markdown"]:
-            supporting_text += f.read().decode("utf-8") + "\n\n"
-        elif f.type == "application/pdf":
-            try:
-                import PyPDF2
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text = page.extract_text()
-                    if text:
-                        supporting_text += text + "\n"
-            except Exception as e:
-                st.warning(f"⚠️ Could not extract from {f.name}: {e}")
-
-# ─────────────────────────────────────────────────────────────────────────────
-# Outline Upload
-# ─────────────────────────────────────────────────────────────────────────────
-uploaded_file = st.file_uploader("Upload your outline.md", type=["md"])
-
-if uploaded_file:
-    os.makedirs("src", exist_ok=True)
-    with open("src/outline.md", "wb") as f:
-        f.write(uploaded_file.read())
-
-    raw_outline = load_outline_from_file("src/outline.md")
-    metadata = extract_outline_metadata(raw_outline)
-
-    # ─────────────────────────────────────────────────────────────────────────
-    # Display Metadata and TOC
-    # ─────────────────────────────────────────────────────────────────────────
-    st.subheader("📄 Book Metadata")
-    st.markdown(f"**Title:** {metadata['title']}")
-    st.markdown(f"**Audience:** {metadata['audience']}")
-    st.markdown(f"**Description:** {metadata['description']}")
-    st.markdown("**Objectives:**")
-    for obj in metadata["objectives"]:
-        st.markdown(f"- {obj}")
-
-    chapters, sections, items = parse_outline(raw_outline)
-
-    st.subheader("📚 Outline Preview")
-    for chap_idx, chapter in enumerate(chapters):
-        st.markdown(f"### Chapter {chap_idx + 1}: {chapter}")
-        for sec_idx, section in enumerate(sections[chap_idx]):
-            st.markdown(f"- **Section {chap_idx + 1}.{sec_idx + 1}**: {section}")
-            for item_idx, item in enumerate(items[chap_idx][sec_idx]):
-                st.markdown(f"    - {item}")
-
-    st.divider()
-
-    # ─────────────────────────────────────────────────────────────────────────
-    # Controls
-    # ─────────────────────────────────────────────────────────────────────────
-    preview_mode = st.checkbox("🔍 Preview Mode (generate only first part)", value=True)
-    output_dir = st.text_input("Output Directory", value="book_output")
-
-    # ─────────────────────────────────────────────────────────────────────────
-    # Preview Workflow
-    # ─────────────────────────────────────────────────────────────────────────
-    if preview_mode and not st.session_state.preview_approved:
-        if st.button("👀 Generate Preview"):
-            try:
-                run_generate_contents_and_save_book(
-                    output_dir=output_dir,
-                    debug=True,
-                    status_area=st.empty(),
-                    live_output_area=st.container(),
-                    extra_context=supporting_text
-                )
-                st.success("✅ Preview generated.")
-                st.session_state.preview_ready = True
-            except Exception as e:
-                st.error(f"❌ Preview failed: {e}")
-
-        if st.session_state.preview_ready:
-            if st.button("✅ Approve & Continue Full Book Generation"):
-                st.session_state.preview_approved = True
-                st.session_state.run_full_after_preview = True
-                st.experimental_rerun()
-
-    # ─────────────────────────────────────────────────────────────────────────
-    # Full Generation After Preview Approval
-    # ─────────────────────────────────────────────────────────────────────────
-    if st.session_state.run_full_after_preview:
-        st.session_state.run_full_after_preview = False  # reset flag
-        try:
-            run_generate_contents_and_save_book(
-                output_dir=output_dir,
-                debug=False,
-                status_area=st.empty(),     # show part progress
-                live_output_area=None,      # don't stream content
-                extra_context=supporting_text
-            )
-            st.success("✅ Full book generated after preview.")
-
-            book_path_docx = os.path.join(output_dir, f"{metadata['title']}.docx")
-            if os.path.exists(book_path_docx):
-                with open(book_path_docx, "rb") as docx_file:
-                    st.download_button("📥 Download DOCX", docx_file.read(), file_name=os.path.basename(book_path_docx))
-        except Exception as e:
-            st.error(f"❌ Full generation failed: {e}")
-
-    # ─────────────────────────────────────────────────────────────────────────
-    # Direct Full Generation (No Preview Mode)
-    # ─────────────────────────────────────────────────────────────────────────
-    if not preview_mode:
-        if st.button("🚀 Generate Full Book"):
-            try:
-                run_generate_contents_and_save_book(
-                    output_dir=output_dir,
-                    debug=False,
-                    status_area=st.empty(),     # show part names
-                    live_output_area=None,      # don't stream full content
-                    extra_context=supporting_text
-                )
-                st.success("✅ Full book generated.")
-
-                book_path_docx = os.path.join(output_dir, f"{metadata['title']}.docx")
-                if os.path.exists(book_path_docx):
-                    with open(book_path_docx, "rb") as docx_file:
-                        st.download_button("📥 Download DOCX", docx_file.read(), file_name=os.path.basename(book_path_docx))
-            except Exception as e:
-                st.error(f"❌ Full generation failed: {e}")
+import streamlit as st
+import html
+import io
+import os
+from src.outline import parse_outline_lines
+from src.documents import content_hash, extract_document_text
+from src.retrieval import SupportIndex
+from src.client import create_client, load_env, use_client
+from src.jobs import BookBusyError, JobManager
+from src.routing import MODEL_TIERS, ModelRouter
+from src.planner import format_duration, format_plan, plan_book
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Session State Initialization
+# ─────────────────────────────────────────────────────────────────────────────
+# Generation runs as background jobs; their IDs are also kept in the URL, so a browser
+# refresh finds the running jobs again.
+if "preview_job" not in st.session_state:
+    st.session_state.preview_job = st.query_params.get("preview_job")
+
+if "book_job" not in st.session_state:
+    st.session_state.book_job = st.query_params.get("book_job")
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Page Setup
+# ─────────────────────────────────────────────────────────────────────────────
+st.set_page_config(page_title="📘 Book Generator", layout="centered")
+st.title("📘 AI Textbook Generator")
+
+JOB_STATUS_ICONS = {"queued": "⏳", "running": "✍️", "done": "✅", "failed": "❌"}
+
+# The BOOK_* defaults shown in the controls may come from .env
+load_env()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Supporting Document Upload (Optional)
+# ─────────────────────────────────────────────────────────────────────────────
+@st.cache_data(show_spinner="Extracting supporting document...", max_entries=32)
+def extract_supporting_document(digest: str, mime_type: str, _data: bytes) -> str:
+    # Cached by the content hash (`_data` is excluded from Streamlit's argument hashing), so a
+    # document is parsed once per upload instead of on every rerun.
+    return extract_document_text(mime_type, _data)
+
+
+supporting_chunks = []
+supporting_files = st.file_uploader(
+    "Upload optional supporting document(s)", type=["txt", "md", "pdf"], accept_multiple_files=True
+)
+
+if supporting_files:
+    st.markdown("✅ Support files uploaded:")
+    for f in supporting_files:
+        st.markdown(f"- {f.name}")
+        data = f.getvalue()
+        try:
+            supporting_chunks.append(extract_supporting_document(content_hash(data), f.type, data))
+        except Exception as e:
+            st.warning(f"⚠️ Could not extract from {f.name}: {e}")
+supporting_text = "".join(supporting_chunks)
+
+
+@st.cache_resource(max_entries=4)
+def build_support_index(digest: str, _text: str) -> SupportIndex:
+    # One retrieval index per distinct upload, shared across reruns.
+    return SupportIndex(_text)
+
+
+@st.cache_resource(show_spinner=False)
+def shared_api_client():
+    # One pooled API client per server process, kept across reruns and sessions. It is created
+    # when the first run starts, so uploading and previewing an outline never loads the SDK.
+    return create_client()
+
+
+@st.cache_resource(show_spinner=False)
+def job_manager() -> JobManager:
+    # One worker pool per server process: every session submits to it, so several books
+    # generate at once up to BOOK_MAX_JOBS, sharing one API concurrency and RPM/TPM budget.
+    return JobManager.from_env()
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def read_output_file(path: str, mtime: float) -> bytes:
+    # Keyed by modification time, so polling a finished job does not re-read its DOCX.
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@st.cache_data(max_entries=8, show_spinner="Reading outline...")
+def parse_uploaded_outline(digest: str, _data: bytes) -> tuple[dict, tuple[int, int, int], str]:
+    # Parsed once per distinct upload, keyed by its hash: reruns reuse the metadata, the counts and
+    # the whole preview, built as one markdown string of collapsed <details> blocks (one per
+    # chapter), so the page sends a single element however large the outline is.
+    outline = parse_outline_lines(io.StringIO(_data.decode("utf-8")))
+    chapters, sections, items = outline.to_lists()
+    blocks = []
+    for chap_idx, chapter in enumerate(chapters):
+        lines = [f"<details><summary><b>Chapter {chap_idx + 1}: {html.escape(chapter)}</b></summary>", ""]
+        for sec_idx, section in enumerate(sections[chap_idx]):
+            lines.append(f"- **Section {chap_idx + 1}.{sec_idx + 1}**: {html.escape(section)}")
+            lines.extend(f"    - {html.escape(item)}" for item in items[chap_idx][sec_idx])
+        lines += ["", "</details>"]
+        blocks.append("\n".join(lines))
+    counts = (len(chapters), sum(map(len, sections)), len(outline))
+    return outline.metadata(), counts, "\n\n".join(blocks)
+
+
+support_index = build_support_index(content_hash(supporting_text.encode("utf-8")), supporting_text) if supporting_text else None
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Outline Upload
+# ─────────────────────────────────────────────────────────────────────────────
+uploaded_file = st.file_uploader("Upload your outline.md", type=["md"])
+
+if uploaded_file:
+    outline_data = uploaded_file.getvalue()
+    metadata, (chapter_count, section_count, item_count), preview_markdown = parse_uploaded_outline(content_hash(outline_data), outline_data)
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Display Metadata and TOC
+    # ─────────────────────────────────────────────────────────────────────────
+    st.subheader("📄 Book Metadata")
+    st.markdown(f"**Title:** {metadata['title']}")
+    st.markdown(f"**Audience:** {metadata['audience']}")
+    st.markdown(f"**Description:** {metadata['description']}")
+    st.markdown("**Objectives:**")
+    for obj in metadata["objectives"]:
+        st.markdown(f"- {obj}")
+
+    st.subheader("📚 Outline Preview")
+    st.caption(f"{chapter_count} chapters · {section_count} sections · {item_count} items")
+    st.markdown(preview_markdown, unsafe_allow_html=True)
+
+    st.divider()
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Controls
+    # ─────────────────────────────────────────────────────────────────────────
+    preview_mode = st.checkbox("🔍 Preview Mode (generate only first part)", value=True)
+    output_dir = st.text_input("Output Directory", value="book_output")
+    max_workers = st.number_input("Concurrent API Requests", min_value=1, max_value=32, value=4)
+    cache_mode = st.selectbox(
+        "Response Cache", ["use", "refresh", "bypass"],
+        help="use: reuse identical earlier responses · refresh: ignore stored responses but save new ones · bypass: no caching"
+    )
+    parts_group_by = st.selectbox(
+        "Part Lists per Request", ["item", "section", "chapter"],
+        help="item: one request per outline item · section / chapter: one structured request for all items of a section or chapter (far fewer calls and tokens)"
+    )
+    duplicates = st.selectbox(
+        "Duplicate Check", ["report", "rewrite", "off"],
+        help="report: list parts that repeat passages of other parts · rewrite: also rewrite the later part of each such pair · off: skip the check"
+    )
+    stream = st.checkbox("⚡ Stream text as it is generated", value=True)
+    resume = st.checkbox("♻️ Resume previous run", value=True, help="Reuse the parts already saved in the output directory's journal")
+    speculative = st.checkbox("🔀 Write an item's parts in parallel", value=False, help="Request all parts of an item at once and rewrite only the parts that repeat each other (faster, slightly more calls)")
+    incremental = st.checkbox("🧩 Incremental rebuild", value=False, help="After editing the outline, regenerate only the items that changed and reuse the rest of the previous build")
+
+    with st.expander("🧭 Models per Stage"):
+        # Defaults come from BOOK_<STAGE>_MODEL / _FALLBACK / _HEDGE_PERCENTILE, so .env settings show up here
+        env_routes = ModelRouter.from_env().routes
+        model_routes = {}
+        for stage, label in (("parts", "Part lists"), ("contents", "Part bodies")):
+            route = env_routes[stage]
+            models = list(MODEL_TIERS) + ([route.model] if route.tier == "custom" else [])
+            fallbacks = ["none"] + list(MODEL_TIERS) + ([route.fallback_model] if route.fallback_tier == "custom" else [])
+            hedges = ["off", "90", "95", "99"] + ([f"{route.hedge_percentile:g}"] if route.hedge_percentile and f"{route.hedge_percentile:g}" not in ("90", "95", "99") else [])
+            model_col, fallback_col, hedge_col = st.columns(3)
+            model = model_col.selectbox(
+                f"{label}: model", models, index=models.index(route.tier if route.tier != "custom" else route.model),
+                help="flagship: best quality · balanced: cheaper and faster · fast: cheapest and fastest"
+            )
+            fallback = fallback_col.selectbox(
+                f"{label}: fallback", fallbacks,
+                index=fallbacks.index(route.fallback_tier if route.fallback_tier not in (None, "custom") else route.fallback_model or "none"),
+                help="Model that takes over a request the main model rejects with a rate limit (or, with BOOK_<STAGE>_FALLBACK_AFTER, answers too slowly)"
+            )
+            hedge = hedge_col.selectbox(
+                f"{label}: hedge at percentile", hedges,
+                index=hedges.index(f"{route.hedge_percentile:g}" if route.hedge_percentile else "off"),
+                help="Sends a duplicate of a request that is still unanswered after this percentile of the stage's recent latencies; the first answer wins"
+            )
+            model_routes[stage] = {"model": model, "fallback": fallback, "hedge_percentile": hedge}
+
+    run_options = dict(
+        output_dir=output_dir,
+        max_workers=int(max_workers),
+        cache_mode=cache_mode,
+        resume=resume,
+        stream=stream,
+        parts_group_by=parts_group_by,
+        incremental=incremental,
+        speculative=speculative,
+        duplicates=duplicates,
+        model_routes=model_routes
+    )
+
+    with st.expander("🧮 Estimate Calls, Cost and Time"):
+        st.caption(f"A dry run with the options above: no request is sent. Latencies are calibrated with the reports of earlier runs in {output_dir}.")
+        if st.button("Estimate"):
+            with st.spinner("Rendering the prompts..."):
+                plan = plan_book(
+                    outline=parse_outline_lines(io.StringIO(outline_data.decode("utf-8"))), max_workers=int(max_workers), debug=preview_mode,
+                    parts_group_by=parts_group_by, speculative=speculative, extra_context=supporting_text, support_index=support_index,
+                    model_routes=model_routes, history=[output_dir]
+                )
+            calls_col, cost_col, time_col = st.columns(3)
+            calls_col.metric("API calls", f"{plan['total']['calls']:,}")
+            cost_col.metric("Cost", "-" if plan["total"]["cost_usd"] is None else f"${plan['total']['cost_usd']:,.2f}")
+            time_col.metric("Wall time", format_duration(plan["total"]["wall_time_s"]))
+            st.code(format_plan(plan))
+
+    def submit_book_job(debug: bool) -> str | None:
+        use_client(shared_api_client())
+        try:
+            return job_manager().submit(
+                outline_data.decode("utf-8"), extra_context=supporting_text, support_index=support_index, debug=debug, **run_options
+            )
+        except BookBusyError as e:
+            # Another session started this book between the page render and the click
+            st.error(f"⚠️ {e}")
+            return None
+
+    def book_busy() -> bool:
+        # A preview and a full run of one book share its partial file and journal, so only one
+        # job per book runs at a time, whichever session started it.
+        active = job_manager().active_job(output_dir, metadata["title"])
+        if active is not None:
+            kind = "preview" if active["options"].get("debug") else "full book"
+            st.caption(f"⏳ A {kind} job (`{active['id']}`) is {active['status']} for this book in {output_dir}; new runs are disabled until it ends.")
+        return active is not None
+
+    @st.fragment(run_every=2)
+    def show_job(job_id: str, label: str, show_live: bool) -> None:
+        # Polls the job every two seconds without rerunning the rest of the page.
+        job = job_manager().get(job_id)
+        if job is None:
+            st.warning(f"⚠️ {label}: job {job_id} is unknown to this server.")
+            return
+
+        st.markdown(f"**{label}** · job `{job_id}` · {JOB_STATUS_ICONS[job['status']]} {job['status']}")
+        if job["status"] == "running":
+            if job["progress"]:
+                st.markdown(job["progress"])
+            if show_live and job["live_title"]:
+                st.markdown(job["live_title"])
+                st.markdown(job["live_text"])
+        elif job["status"] == "done":
+            st.success(f"✅ {label} generated.")
+            book_path_docx = os.path.join(job["options"]["output_dir"], f"{job['book'][1]}.docx")
+            if os.path.exists(book_path_docx):
+                st.download_button(
+                    "📥 Download DOCX", read_output_file(book_path_docx, os.path.getmtime(book_path_docx)),
+                    file_name=os.path.basename(book_path_docx), key=f"download-{job_id}"
+                )
+        elif job["status"] == "failed":
+            st.error(f"❌ {label} failed: {job['error']}\n\nCompleted parts are kept in the journal; run again with *Resume previous run* to continue.")
+
+        if job["log"]:
+            with st.expander("Log"):
+                st.code(job["log"])
+
+        if label == "Preview" and job["status"] == "done" and not st.session_state.book_job:
+            if st.button("✅ Approve & Continue Full Book Generation", disabled=book_busy()):
+                book_job = submit_book_job(debug=False)
+                if book_job:
+                    st.session_state.book_job = st.query_params["book_job"] = book_job
+                    st.rerun()
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Preview Workflow
+    # ─────────────────────────────────────────────────────────────────────────
+    if preview_mode and not st.session_state.preview_job:
+        if st.button("👀 Generate Preview", disabled=book_busy()):
+            preview_job = submit_book_job(debug=True)
+            if preview_job:
+                st.session_state.preview_job = st.query_params["preview_job"] = preview_job
+
+    if st.session_state.preview_job:
+        show_job(st.session_state.preview_job, "Preview", show_live=True)
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Direct Full Generation (No Preview Mode)
+    # ─────────────────────────────────────────────────────────────────────────
+    if not preview_mode and not st.session_state.book_job:
+        if st.button("🚀 Generate Full Book", disabled=book_busy()):
+            book_job = submit_book_job(debug=False)
+            if book_job:
+                st.session_state.book_job = st.query_params["book_job"] = book_job
+
+    if st.session_state.book_job:
+        show_job(st.session_state.book_job, "Full book", show_live=False)
+
+    if st.session_state.preview_job or st.session_state.book_job:
+        if st.button("🆕 Start Over"):
+            st.session_state.preview_job = st.session_state.book_job = None
+            st.query_params.clear()
+            st.rerun()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Jobs on this server
+# ─────────────────────────────────────────────────────────────────────────────
+all_jobs = job_manager().jobs()
+if all_jobs:
+    with st.expander(f"🗂️ Jobs on this server ({sum(job['status'] in ('queued', 'running') for job in all_jobs)} active)"):
+        for job in all_jobs[:20]:
+            kind = "preview" if job["options"].get("debug") else "book"
+            st.markdown(f"{JOB_STATUS_ICONS[job['status']]} `{job['id']}` · {kind} · {job['status']} · {job['options'].get('output_dir', '')}")
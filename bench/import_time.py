@@ -0,0 +1,109 @@
+"""
+Cold-start benchmark: how long importing the modules app.py needs takes, which heavy
+third-party packages that import pulls in, and how many TCP connections a short book run
+opens against the local mock server (fewer connections than requests means keep-alive
+connections are being reused across requests and stages).
+
+    python -m bench.import_time --repeat 7 --items 20 --workers 4
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.run_bench import server_stats, start_mock_server
+from bench.synthetic_outline import make_outline
+
+# Everything app.py imports at startup
+APP_MODULES = ["src.generate_outline", "src.outline", "src.generate_parts", "src.generate_contents", "src.documents", "src.retrieval", "src.client", "src.jobs", "src.routing", "src.planner"]
+HEAVY_MODULES = ["openai", "pypandoc", "tqdm", "yaspin", "dotenv"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(modules: list[str], repeat: int) -> dict:
+    """Imports `modules` in `repeat` fresh interpreters; returns the median time and the heavy modules loaded."""
+    script = IMPORT_SCRIPT.format(modules=modules, heavy=HEAVY_MODULES)
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "mock-key"))
+    samples, loaded = [], []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True, env=env).stdout
+        result = json.loads(output)
+        samples.append(result["seconds"])
+        loaded = result["loaded"]
+    return {"median_s": statistics.median(samples), "min_s": min(samples), "heavy_loaded": loaded}
+
+
+def measure_connections(args) -> dict:
+    """Builds a small book (part lists, then contents) and counts requests and connections."""
+    process, base_url = start_mock_server(args)
+    os.environ["OPENAI_API_ENDPOINT"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    try:
+        from src.generate_contents import run_generate_contents_and_save_book
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            outline_path = os.path.join(work_dir, "outline.md")
+            with open(outline_path, "w", encoding="utf-8") as f:
+                f.write(make_outline(args.items))
+            before = server_stats(base_url)
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_generate_contents_and_save_book(
+                    output_dir=os.path.join(work_dir, "book"),
+                    max_workers=args.workers,
+                    cache_mode="bypass",
+                    outline_path=outline_path
+                )
+            wall_time = time.perf_counter() - started
+            after = server_stats(base_url)
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {
+        "requests": after["requests"] - before["requests"],
+        "connections": after["connections"] - before["connections"],
+        "wall_time_s": wall_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and API connection reuse")
+    parser.add_argument("--repeat", type=int, default=7, help="fresh interpreters to time the import in")
+    parser.add_argument("--items", type=int, default=20, help="outline size for the connection count")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--output", help="also save the results as JSON")
+    args = parser.parse_args()
+    # start_mock_server takes the run_bench options; only latency is of interest here.
+    args.jitter, args.rate_limit_rate, args.error_rate, args.retry_after, args.body_words = 0.0, 0.0, 0.0, 0.1, 200
+
+    imports = measure_import(APP_MODULES, args.repeat)
+    print(f"import   median={imports['median_s']:.3f}s min={imports['min_s']:.3f}s heavy modules loaded: {', '.join(imports['heavy_loaded']) or 'none'}")
+
+    connections = measure_connections(args)
+    print(f"network  requests={connections['requests']} connections={connections['connections']} wall={connections['wall_time_s']:.2f}s (workers={args.workers})")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "import": imports, "network": connections}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Local stand-in for an OpenAI-compatible chat completions API.
+
+Returns canned bullet lists for parts requests (JSON for structured-output ones) and ~1000-word
+bodies for content requests, with configurable latency, jitter, stalled requests and injected 429/500 errors. Point the book generator at it
+with OPENAI_API_ENDPOINT=http://127.0.0.1:<port>/v1.
+
+    python -m bench.mock_server --port 8765 --latency 0.5 --jitter 0.2 --rate-limit-rate 0.05
+    python -m bench.mock_server --port 8765 --latency 0.5 --stall-rate 0.03 --stall-latency 20   # a long latency tail
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "data model system design pattern function value state process memory network request "
+    "response cache thread queue latency example principle concept method structure layer "
+    "interface module test error signal stream buffer index graph tree node record field "
+    "learner practice analogy case study approach result insight detail context framework"
+).split()
+
+
+def _prompt_text(body: dict) -> str:
+    return "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def canned_parts(rng: random.Random) -> str:
+    count = rng.randint(4, 6)
+    return "\n".join(f"- Part {n + 1}: {' '.join(rng.choice(WORDS) for _ in range(3)).title()}" for n in range(count))
+
+
+def canned_grouped_parts(rng: random.Random, response_format: dict) -> str:
+    """JSON answer for a structured parts request: canned parts for every id the schema allows."""
+    schema = response_format["json_schema"]["schema"]
+    item_ids = schema["properties"]["items"]["items"]["properties"]["id"].get("enum", [])
+    entries = [{"id": item_id, "parts": [line[2:] for line in canned_parts(rng).splitlines()]} for item_id in item_ids]
+    return json.dumps({"items": entries})
+
+
+def canned_body(rng: random.Random, words: int) -> str:
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        length = min(remaining, rng.randint(60, 120))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        paragraphs.append(sentence[0].upper() + sentence[1:] + ".")
+        remaining -= length
+    return "### " + " ".join(rng.choice(WORDS) for _ in range(4)).title() + "\n\n" + "\n\n".join(paragraphs)
+
+
+class MockConfig:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, rate_limit_rate: float = 0.0, error_rate: float = 0.0, retry_after: float = 1.0, body_words: int = 1000, seed: int = 0, stall_rate: float = 0.0, stall_latency: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.body_words = body_words
+        self.seed = seed
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: MockConfig):
+        super().__init__(address, MockOpenAIHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.stats = {"connections": 0, "requests": 0, "ok": 0, "rate_limited": 0, "errors": 0, "streamed": 0, "stalled": 0, "cancelled": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0}
+        self.seen_prefixes = set()
+
+    def cached_prefix_tokens(self, body: dict) -> int:
+        """
+        Emulates provider prompt caching: a leading system message seen before is reported as
+        cached, in 128-token increments once it reaches 1024 tokens.
+        """
+        messages = body.get("messages") or []
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = str(messages[0].get("content", ""))
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self.lock:
+            seen = digest in self.seen_prefixes
+            self.seen_prefixes.add(digest)
+        tokens = _estimate_tokens(prefix)
+        return tokens // 128 * 128 if seen and tokens >= 1024 else 0
+
+    def count(self, **increments) -> None:
+        with self.lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection pooling behaves as with the real API
+    disable_nagle_algorithm = True  # headers and body are separate writes; avoid the delayed-ACK stall
+
+    def setup(self):
+        super().setup()
+        self.server.count(connections=1)  # one handler per TCP connection
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        server = self.server
+        config = server.config
+        server.count(requests=1)
+        with server.lock:
+            roll = server.rng.random()
+            delay = max(0.0, config.latency + server.rng.uniform(-config.jitter, config.jitter))
+            stalled = server.rng.random() < config.stall_rate
+        if stalled:
+            # Waits before answering at all, like a request stuck behind a slow replica
+            server.count(stalled=1)
+            time.sleep(config.stall_latency)
+
+        if roll < config.rate_limit_rate:
+            server.count(rate_limited=1)
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}}, {"Retry-After": f"{config.retry_after:g}"})
+            return
+        if roll < config.rate_limit_rate + config.error_rate:
+            time.sleep(delay / 2)
+            server.count(errors=1)
+            self._send_json(500, {"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+            return
+
+        prompt = _prompt_text(body)
+        # Seed by prompt so identical requests get identical answers, like a cache-friendly model.
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        if (body.get("response_format") or {}).get("type") == "json_schema":
+            content = canned_grouped_parts(rng, body["response_format"])
+        elif "list of parts" in prompt.lower():
+            content = canned_parts(rng)
+        else:
+            content = canned_body(rng, config.body_words)
+
+        usage = {"prompt_tokens": _estimate_tokens(prompt), "completion_tokens": _estimate_tokens(content)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        cached_tokens = server.cached_prefix_tokens(body)
+        usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+        server.count(ok=1, prompt_tokens=usage["prompt_tokens"], cached_prompt_tokens=cached_tokens, completion_tokens=usage["completion_tokens"])
+
+        model = body.get("model", "mock-model")
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        if body.get("stream"):
+            server.count(streamed=1)
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            try:
+                self._stream(completion_id, model, content, delay, usage if include_usage else None)
+            except (BrokenPipeError, ConnectionResetError):
+                server.count(cancelled=1)  # the client closed the stream, e.g. a hedge that lost
+            return
+
+        time.sleep(delay)
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id: str, model: str, content: str, delay: float, usage: dict | None) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(choices: list, **extra) -> None:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": choices, **extra}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        # A fifth of the latency goes to the first token, the rest is spread over the body.
+        pieces = [content[i:i + 40] for i in range(0, len(content), 40)]
+        time.sleep(delay * 0.2)
+        per_piece = delay * 0.8 / max(1, len(pieces))
+        for piece in pieces:
+            send([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+            time.sleep(per_piece)
+        send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if usage is not None:
+            send([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, config: MockConfig | None = None) -> MockOpenAIServer:
+    """Starts the mock server in a background thread and returns it (port 0 picks a free port)."""
+    server = MockOpenAIServer((host, port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform latency jitter (+/- seconds)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="fraction of requests that stall before answering")
+    parser.add_argument("--stall-latency", type=float, default=10.0, help="seconds a stalled request waits")
+    parser.add_argument("--body-words", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate, retry_after=args.retry_after, body_words=args.body_words, seed=args.seed,
+        stall_rate=args.stall_rate, stall_latency=args.stall_latency
+    )
+    server = MockOpenAIServer((args.host, args.port), config)
+    print(f"Mock OpenAI server listening on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Offline benchmark of the parts and contents pipelines against the local mock server.
+
+Measures end-to-end wall time, API calls per second and peak Python memory for each
+outline size and worker count, and optionally compares the results with a previous run:
+
+    python -m bench.run_bench --sizes 10,100,1000 --workers 1,8 --latency 0.05
+    python -m bench.run_bench --sizes 10,100 --baseline bench_results.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+from bench.synthetic_outline import make_outline
+
+
+def start_mock_server(args) -> tuple[subprocess.Popen, str]:
+    command = [
+        sys.executable, "-m", "bench.mock_server", "--port", "0",
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--rate-limit-rate", str(args.rate_limit_rate), "--error-rate", str(args.error_rate),
+        "--retry-after", str(args.retry_after), "--body-words", str(args.body_words),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    banner = process.stdout.readline()
+    base_url = banner.strip().rsplit(" ", 1)[-1]
+    if not base_url.startswith("http"):
+        process.kill()
+        raise RuntimeError(f"Mock server failed to start: {banner!r}")
+    return process, base_url
+
+
+def server_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(base_url.removesuffix("/v1") + "/stats") as response:
+        return json.load(response)
+
+
+def run_case(stage: str, outline_path: str, workers: int, base_url: str) -> dict:
+    # Imported lazily: the shared client reads OPENAI_API_ENDPOINT when it is first created.
+    from src.generate_outline import load_outline_from_file, parse_outline, extract_outline_metadata
+    from src.generate_parts import run_generate_parts_for_all
+    from src.generate_contents import run_generate_contents_and_save_book
+
+    before = server_stats(base_url)
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if stage.startswith("parts"):
+            raw_outline = load_outline_from_file(outline_path)
+            metadata = extract_outline_metadata(raw_outline)
+            chapters, sections, items = parse_outline(raw_outline)
+            run_generate_parts_for_all(
+                title=metadata["title"],
+                description=metadata["description"],
+                audience=metadata["audience"],
+                chapters=chapters,
+                sections=sections,
+                items=items,
+                max_workers=workers,
+                # "parts-section" / "parts-chapter" ask for a whole section or chapter per request
+                group_by=stage.partition("-")[2] or "item"
+            )
+        else:
+            with tempfile.TemporaryDirectory() as output_dir:
+                run_generate_contents_and_save_book(
+                    output_dir=output_dir,
+                    max_workers=workers,
+                    cache_mode="bypass",
+                    outline_path=outline_path
+                )
+
+    wall_time = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    after = server_stats(base_url)
+    calls = after["requests"] - before["requests"]
+    return {
+        "wall_time_s": wall_time,
+        "calls": calls,
+        "calls_per_s": calls / wall_time if wall_time else 0.0,
+        "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+        # Prompt tokens the mock reports as served from the provider's prefix cache
+        "cached_prompt_tokens": after["cached_prompt_tokens"] - before["cached_prompt_tokens"],
+        "rate_limited": after["rate_limited"] - before["rate_limited"],
+        "server_errors": after["errors"] - before["errors"],
+        "peak_memory_mb": peak_memory / (1024 * 1024),
+    }
+
+
+def compare_with_baseline(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["stage"], r["items"], r["workers"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["stage"], result["items"], result["workers"]))
+        if previous is None:
+            continue
+        for metric in ("wall_time_s", "peak_memory_mb"):
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['stage']} items={result['items']} workers={result['workers']}: "
+                    f"{metric} {previous[metric]:.2f} → {result[metric]:.2f}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the book pipelines against a local mock API")
+    parser.add_argument("--sizes", default="10,100", help="comma-separated outline sizes in items (10 to 5000)")
+    parser.add_argument("--workers", default="1,8", help="comma-separated worker counts")
+    parser.add_argument("--stages", default="parts,contents", help="comma-separated stages: parts, parts-section, parts-chapter, contents")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--body-words", type=int, default=1000)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    process, base_url = start_mock_server(args)
+    os.environ["OPENAI_API_ENDPOINT"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock-key")
+    os.environ.setdefault("TQDM_DISABLE", "1")
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as outlines_dir:
+            for size in (int(s) for s in args.sizes.split(",")):
+                outline_path = os.path.join(outlines_dir, f"outline_{size}.md")
+                with open(outline_path, "w", encoding="utf-8") as f:
+                    f.write(make_outline(size))
+
+                for stage in args.stages.split(","):
+                    for workers in (int(w) for w in args.workers.split(",")):
+                        result = {"stage": stage, "items": size, "workers": workers}
+                        result.update(run_case(stage, outline_path, workers, base_url))
+                        results.append(result)
+                        print(
+                            f"{stage:<13} items={size:<5} workers={workers:<3} "
+                            f"wall={result['wall_time_s']:8.2f}s calls={result['calls']:<6} prompt_tok={result['prompt_tokens']:<8} cached_tok={result['cached_prompt_tokens']:<8} "
+                            f"calls/s={result['calls_per_s']:7.1f} peak_mem={result['peak_memory_mb']:7.1f}MB",
+                            flush=True
+                        )
+    finally:
+        process.terminate()
+        process.wait()
+
+    # Compare before saving, so --baseline and --output may name the same file.
+    regressions = compare_with_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "baseline")}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"config": config, "results": results}, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    for line in regressions:
+        print(f"⚠️ Regression: {line}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
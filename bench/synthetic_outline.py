@@ -0,0 +1,60 @@
+"""
+Generates synthetic outline.md files of a given size for benchmarks.
+
+    python -m bench.synthetic_outline --items 1000 --output /tmp/outline_1000.md
+"""
+import argparse
+import random
+
+TOPICS = (
+    "Caching", "Concurrency", "Indexing", "Streaming", "Scheduling", "Profiling", "Serialization",
+    "Networking", "Storage", "Testing", "Observability", "Compilation", "Parsing", "Security",
+)
+
+
+def make_outline(n_items: int, sections_per_chapter: int = 4, items_per_section: int = 5, seed: int = 0) -> str:
+    """Returns an outline in the format parse_outline expects, with exactly `n_items` items."""
+    rng = random.Random(seed)
+    lines = [
+        f"## Title: Synthetic Benchmark Book ({n_items} items)",
+        "## Audience: Software engineers",
+        "## Description: A generated outline used to benchmark the book generation pipeline.",
+        "## Learning Objectives:",
+        "- Measure throughput",
+        "- Catch performance regressions",
+        "",
+    ]
+
+    remaining = n_items
+    chapter = 0
+    while remaining > 0:
+        chapter += 1
+        lines.append(f"### Chapter {chapter}. {rng.choice(TOPICS)} in Practice")
+        for section in range(1, sections_per_chapter + 1):
+            if remaining <= 0:
+                break
+            lines.append(f"#### Section {chapter}.{section} {rng.choice(TOPICS)} Fundamentals")
+            for item in range(1, min(items_per_section, remaining) + 1):
+                lines.append(f"##### {chapter}.{section}.{item} {rng.choice(TOPICS)} Technique {item}")
+                remaining -= 1
+        lines.append("")
+
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic outline.md")
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--sections-per-chapter", type=int, default=4)
+    parser.add_argument("--items-per-section", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="outline.md")
+    args = parser.parse_args()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(make_outline(args.items, args.sections_per_chapter, args.items_per_section, args.seed))
+    print(f"Wrote {args.items} items to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
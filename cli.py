@@ -0,0 +1,146 @@
+"""
+Command-line builds of many books through a shared work queue.
+
+    python cli.py build outlines/ --queue queue.db --output-dir book_output --workers 8
+    python cli.py work --queue /shared/queue.db --workers 8      # on more machines
+    python cli.py status --queue queue.db
+    python cli.py plan outlines/ --workers 8 --rpm 500             # predict calls, cost and time
+
+`build` queues every *.md outline of the directory and works on the queue; `enqueue` only
+queues them. `work` joins an existing queue, so every process or machine that opens the
+same queue file shares the backlog. `plan` is a dry run: it sends no request and predicts
+each book's calls, tokens, cost and wall time, calibrated with the reports of past runs.
+"""
+import argparse
+import json
+import os
+import sys
+
+from src.telemetry import Telemetry
+from src.workqueue import WorkQueue, run_worker
+
+
+def enqueue_outlines(queue: WorkQueue, outline_dir: str, output_dir: str) -> None:
+    names = sorted(name for name in os.listdir(outline_dir) if name.endswith(".md"))
+    if not names:
+        print(f"⚠️ No .md outlines found in {outline_dir}")
+    for name in names:
+        with open(os.path.join(outline_dir, name), "r", encoding="utf-8") as f:
+            outline_text = f.read()
+        stem = os.path.splitext(name)[0]
+        book_id, added = queue.add_book(stem, outline_text, os.path.abspath(os.path.join(output_dir, stem)))
+        print(f"{'📥 Queued' if added else '↩️ Already queued'}: {name} (book {book_id})")
+
+
+def work(queue: WorkQueue, args) -> int:
+    telemetry = run_worker(queue, workers=args.workers, cache_mode=args.cache, poll_interval=args.poll_interval)
+    report = telemetry.report()
+    if report["total"]["calls"]:
+        print(Telemetry.format_table(report))
+    return print_status(queue)
+
+
+def print_status(queue: WorkQueue) -> int:
+    """Prints one line per book; returns 1 if any book failed."""
+    books = queue.progress()
+    for book in books:
+        tasks = book["tasks"]
+        done = tasks.get("done", 0)
+        total = sum(tasks.values())
+        line = f"{book['status']:<9} {book['name']:<40} {done}/{total} tasks"
+        if tasks.get("leased"):
+            line += f", {tasks['leased']} in progress"
+        if book["error"]:
+            line += f" — {book['error']}"
+        print(line)
+    return 1 if any(book["status"] == "failed" for book in books) else 0
+
+
+def plan(args) -> int:
+    from src.planner import format_duration, format_plan, plan_book
+
+    paths = []
+    for path in args.outlines:
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".md"))
+        else:
+            paths.append(path)
+    plans = []
+    for path in paths:
+        book_plan = plan_book(
+            path, max_workers=args.workers, debug=args.preview, parts_group_by=args.group_by, speculative=args.speculative,
+            requests_per_minute=args.rpm, tokens_per_minute=args.tpm, history=args.history
+        )
+        plans.append(book_plan)
+        if not args.json:
+            print(f"📐 {path}: {book_plan['title']}")
+            print(format_plan(book_plan))
+            print()
+    if args.json:
+        print(json.dumps(plans, indent=2))
+    elif len(plans) > 1:
+        costs = [book_plan["total"]["cost_usd"] for book_plan in plans]
+        print(
+            f"All {len(plans)} books: {sum(book_plan['total']['calls'] for book_plan in plans)} calls, "
+            f"${sum(cost for cost in costs if cost is not None):.2f}"
+            f", {format_duration(sum(book_plan['total']['wall_time_s'] for book_plan in plans))} one after another"
+        )
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build many books through a shared work queue")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_queue_options(subparser):
+        subparser.add_argument("--queue", default="book_queue.db", help="SQLite queue file; put it on shared storage to spread work over machines")
+
+    def add_work_options(subparser):
+        subparser.add_argument("--workers", type=int, default=8, help="concurrent tasks in this process")
+        subparser.add_argument("--cache", choices=["use", "refresh", "bypass"], default=None, help="response cache mode (BOOK_CACHE_MODE by default)")
+        subparser.add_argument("--poll-interval", type=float, default=5.0, help="seconds between looks at the queue while waiting for other workers")
+
+    build = subparsers.add_parser("build", help="queue a directory of outlines and work on the queue")
+    build.add_argument("outline_dir")
+    build.add_argument("--output-dir", default="book_output", help="books go to <output-dir>/<outline name>/")
+    add_queue_options(build)
+    add_work_options(build)
+
+    enqueue = subparsers.add_parser("enqueue", help="queue a directory of outlines")
+    enqueue.add_argument("outline_dir")
+    enqueue.add_argument("--output-dir", default="book_output", help="books go to <output-dir>/<outline name>/")
+    add_queue_options(enqueue)
+
+    worker = subparsers.add_parser("work", help="work on the queue until no book is left building")
+    add_queue_options(worker)
+    add_work_options(worker)
+
+    status = subparsers.add_parser("status", help="show the progress of every queued book")
+    add_queue_options(status)
+
+    planner = subparsers.add_parser("plan", help="predict calls, tokens, cost and wall time without sending a request")
+    planner.add_argument("outlines", nargs="+", help="outline files or directories of them")
+    planner.add_argument("--workers", type=int, default=8, help="concurrent requests")
+    planner.add_argument("--rpm", type=float, default=None, help="requests per minute limit (BOOK_RPM_LIMIT by default)")
+    planner.add_argument("--tpm", type=float, default=None, help="tokens per minute limit (BOOK_TPM_LIMIT by default)")
+    planner.add_argument("--group-by", choices=["item", "section", "chapter"], default="item", help="part lists per request")
+    planner.add_argument("--speculative", action="store_true", help="write each item's parts in parallel")
+    planner.add_argument("--preview", action="store_true", help="plan a preview run (first item only)")
+    planner.add_argument("--history", nargs="*", default=["book_output"], help="run reports, or directories with them, to calibrate latencies")
+    planner.add_argument("--json", action="store_true", help="print the plans as JSON")
+
+    args = parser.parse_args()
+    if args.command == "plan":
+        sys.exit(plan(args))
+    queue = WorkQueue(args.queue)
+
+    if args.command in ("build", "enqueue"):
+        enqueue_outlines(queue, args.outline_dir, args.output_dir)
+    if args.command in ("build", "work"):
+        sys.exit(work(queue, args))
+    if args.command == "status":
+        sys.exit(print_status(queue))
+
+
+if __name__ == "__main__":
+    main()
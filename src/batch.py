@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Callable
+
+from src.cache import ResponseCache
+from src.routing import BATCH_PRICE_FACTOR, price_usd
+from src.telemetry import CallRecord, Telemetry
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS_PER_BATCH = 50_000
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class OpenAIBatchBackend:
+    """Submits JSONL request files through the OpenAI Batch API."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> list[str]:
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(line for line in self.client.files.content(file_id).text.splitlines() if line.strip())
+        return lines
+
+
+def canned_completion(body: dict) -> dict:
+    """Offline answer for LocalBatchBackend: a bullet list for parts requests, a short body otherwise."""
+    prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    if "list of parts" in prompt.lower():
+        content = "\n".join(f"- Part {n} ({digest})" for n in range(1, 5))
+    else:
+        content = f"Offline batch content {digest}.\n\n" + "Lorem ipsum dolor sit amet. " * 40
+    return {
+        "id": f"chatcmpl-local-{digest}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "local"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4, "total_tokens": (len(prompt) + len(content)) // 4},
+    }
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for the Batch API, for testing the batch mode offline.
+
+    Every submitted batch becomes a directory under `root` holding its input, a status file and,
+    once polled, an output file in the Batch API's result format. Requests are answered by
+    `responder` (canned completions by default; pass e.g. a function forwarding to a mock server).
+    """
+
+    def __init__(self, root: str, responder: Callable[[dict], dict] | None = None):
+        self.root = root
+        self.responder = responder or canned_completion
+
+    def _dir(self, batch_id: str) -> str:
+        return os.path.join(self.root, batch_id)
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        os.makedirs(self._dir(batch_id), exist_ok=True)
+        shutil.copyfile(input_path, os.path.join(self._dir(batch_id), "input.jsonl"))
+        with open(os.path.join(self._dir(batch_id), "status"), "w", encoding="utf-8") as f:
+            f.write("validating")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        status_path = os.path.join(self._dir(batch_id), "status")
+        with open(status_path, "r", encoding="utf-8") as f:
+            status = f.read().strip()
+        if status in TERMINAL_STATUSES:
+            return status
+
+        with open(os.path.join(self._dir(batch_id), "input.jsonl"), "r", encoding="utf-8") as f_in, \
+                open(os.path.join(self._dir(batch_id), "output.jsonl"), "w", encoding="utf-8") as f_out:
+            for line in f_in:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    output = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": self.responder(request["body"])}
+                    error = None
+                except Exception as e:
+                    output = None
+                    error = {"code": "local_error", "message": str(e)}
+                f_out.write(json.dumps({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"], "response": output, "error": error}) + "\n")
+
+        with open(status_path, "w", encoding="utf-8") as f:
+            f.write("completed")
+        return "completed"
+
+    def results(self, batch_id: str) -> list[str]:
+        with open(os.path.join(self._dir(batch_id), "output.jsonl"), "r", encoding="utf-8") as f:
+            return [line for line in f if line.strip()]
+
+
+def make_batch_backend(kind: str, client, root: str):
+    if kind == "openai":
+        return OpenAIBatchBackend(client)
+    if kind == "local":
+        return LocalBatchBackend(root)
+    raise ValueError(f"Unknown batch backend {kind!r}, expected 'openai' or 'local'.")
+
+
+def parse_batch_results(lines: list[str]) -> dict[str, dict]:
+    """Maps custom_id to {"content", "usage"} for every successful request in the result lines."""
+    results = {}
+    for line in lines:
+        record = json.loads(line)
+        response = record.get("response")
+        if record.get("error") or not response or response.get("status_code") != 200:
+            continue
+        body = response["body"]
+        usage = body.get("usage") or {}
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+        results[record["custom_id"]] = {
+            "content": body["choices"][0]["message"]["content"],
+            "usage": [usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), cached_tokens],
+        }
+    return results
+
+
+def run_batch(backend, requests: dict[str, dict], workdir: str, name: str, poll_interval: float = 30.0, on_status: Callable[[str], None] | None = None) -> dict[str, dict]:
+    """
+    Writes `requests` (custom_id -> request body) as JSONL batch files of at most
+    MAX_REQUESTS_PER_BATCH lines, submits them, polls until every batch is finished and
+    returns the parsed results by custom_id. Failed requests are simply absent.
+
+    Submitted batch ids are remembered in `<workdir>/<name>.batches.json` together with a
+    digest of the requests, so a restarted run re-attaches to its batches instead of paying
+    for them twice.
+    """
+    if not requests:
+        return {}
+    os.makedirs(workdir, exist_ok=True)
+
+    custom_ids = list(requests)
+    digest = hashlib.sha256(json.dumps([custom_ids, [requests[c] for c in custom_ids]], sort_keys=True).encode("utf-8")).hexdigest()
+    state_path = os.path.join(workdir, f"{name}.batches.json")
+
+    batch_ids = None
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("digest") == digest:
+            batch_ids = state["batch_ids"]
+
+    if batch_ids is None:
+        batch_ids = []
+        for chunk_idx, start in enumerate(range(0, len(custom_ids), MAX_REQUESTS_PER_BATCH)):
+            input_path = os.path.join(workdir, f"{name}_{chunk_idx + 1}.jsonl")
+            with open(input_path, "w", encoding="utf-8") as f:
+                for custom_id in custom_ids[start:start + MAX_REQUESTS_PER_BATCH]:
+                    f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": requests[custom_id]}, ensure_ascii=False) + "\n")
+            batch_ids.append(backend.submit(input_path))
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"digest": digest, "batch_ids": batch_ids}, f)
+
+    pending = list(batch_ids)
+    while pending:
+        statuses = {batch_id: backend.status(batch_id) for batch_id in pending}
+        pending = [batch_id for batch_id, status in statuses.items() if status not in TERMINAL_STATUSES]
+        if on_status:
+            on_status(f"{name}: {len(batch_ids) - len(pending)}/{len(batch_ids)} batches finished")
+        if pending:
+            time.sleep(poll_interval)
+
+    results = {}
+    for batch_id in batch_ids:
+        results.update(parse_batch_results(backend.results(batch_id)))
+    return results
+
+
+def run_cached_batch(backend, requests: dict[str, dict], coords: dict[str, tuple[int, ...]], stage: str, workdir: str, name: str, cache: ResponseCache | None = None, telemetry: Telemetry | None = None, poll_interval: float = 30.0, on_status: Callable[[str], None] | None = None) -> dict[str, str]:
+    """
+    Like run_batch, but answers requests found in `cache` without submitting them, stores the
+    new responses in it, and records every result in `telemetry` under "<stage>-batch".
+    Returns custom_id -> content for the requests that succeeded.
+    """
+    contents = {}
+    keys = {}
+    to_submit = {}
+    for custom_id, request in requests.items():
+        if cache is not None:
+            keys[custom_id] = cache.make_key(request)
+            cached = cache.get(keys[custom_id])
+            if cached is not None:
+                contents[custom_id] = cached["content"]
+                if telemetry:
+                    prompt_tokens, completion_tokens = cached.get("usage", (0, 0))[:2]
+                    telemetry.record(CallRecord(stage=f"{stage}-batch", latency_s=0.0, cached=True, model=request["model"], prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, coord=coords[custom_id]))
+                continue
+        to_submit[custom_id] = request
+
+    started = time.perf_counter()
+    results = run_batch(backend, to_submit, workdir, name, poll_interval=poll_interval, on_status=on_status)
+    turnaround = time.perf_counter() - started
+
+    for custom_id, result in results.items():
+        contents[custom_id] = result["content"]
+        prompt_tokens, completion_tokens, cached_prompt_tokens = result["usage"]
+        if telemetry:
+            cost_usd = price_usd(to_submit[custom_id]["model"], prompt_tokens, cached_prompt_tokens, completion_tokens)
+            telemetry.record(CallRecord(
+                stage=f"{stage}-batch", latency_s=turnaround, model=to_submit[custom_id]["model"],
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_prompt_tokens=cached_prompt_tokens,
+                cost_usd=None if cost_usd is None else cost_usd * BATCH_PRICE_FACTOR, coord=coords[custom_id]
+            ))
+        if cache is not None:
+            cache.put(keys[custom_id], {"request": to_submit[custom_id], "content": result["content"], "usage": [prompt_tokens, completion_tokens]})
+    return contents
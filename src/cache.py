@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+CACHE_MODES = ("use", "refresh", "bypass")
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache for LLM responses.
+
+    Entries are stored as one JSON file per request under `cache_dir`, named by the SHA-256
+    of the canonical request (model, temperature, messages, ...). The least recently used
+    entries are evicted once the directory grows past `max_bytes`.
+
+    Modes:
+    - "use":     read from and write to the cache (default)
+    - "refresh": ignore existing entries but store the fresh responses
+    - "bypass":  neither read nor write
+    """
+
+    def __init__(self, cache_dir: str = ".llm_cache", max_bytes: int = 512 * 1024 * 1024, mode: str = "use"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {CACHE_MODES}.")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    @classmethod
+    def from_env(cls, mode: str | None = None) -> "ResponseCache":
+        return cls(
+            cache_dir=os.getenv("BOOK_CACHE_DIR", ".llm_cache"),
+            max_bytes=int(float(os.getenv("BOOK_CACHE_MAX_MB", "512")) * 1024 * 1024),
+            mode=mode or os.getenv("BOOK_CACHE_MODE", "use"),
+        )
+
+    @staticmethod
+    def make_key(request: dict) -> str:
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> dict | None:
+        if self.mode != "use":
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            # Touch the entry so eviction sees it as recently used.
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        if self.mode == "bypass":
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+        # Write to a temporary file first so a crash never leaves a truncated entry behind.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            previous_size = os.path.getsize(path)
+        except OSError:
+            previous_size = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.writes += 1
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(data) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        # Drop least recently used entries until we are 10% below the limit, so that
+        # eviction does not run on every write once the cache is full.
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in sorted(self._entries()):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,52 @@
+import os
+import threading
+
+_client = None
+_lock = threading.Lock()
+
+
+def load_env() -> None:
+    """Reads a `.env` file into the environment, for the API key and the BOOK_* settings."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+def create_client():
+    """
+    Builds an OpenAI client from OPENAI_API_KEY and OPENAI_API_ENDPOINT (a `.env` file is read
+    first). The SDK is imported here rather than at module level, as it takes most of a second.
+    Retries are left to src.rate_limit.RateLimiter.
+    """
+    from openai import OpenAI
+
+    load_env()
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set.")
+
+    return OpenAI(
+        api_key=openai_api_key,
+        base_url=os.getenv("OPENAI_API_ENDPOINT"),
+        max_retries=0
+    )
+
+
+def get_client():
+    """
+    The client shared by every stage, created on first use. Sharing it shares one HTTP
+    connection pool, so connections opened for the part lists are reused for the contents.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def use_client(client) -> None:
+    """Makes `client` the shared one, e.g. a client the Streamlit app keeps across reruns."""
+    global _client
+    with _lock:
+        _client = client
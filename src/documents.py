@@ -0,0 +1,53 @@
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Below this many pages the cost of starting worker processes outweighs the parallel speed-up.
+MIN_PAGES_FOR_POOL = 24
+PAGES_PER_TASK = 16
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _extract_page_range(pdf_bytes: bytes, start: int, stop: int) -> list[str]:
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    texts = []
+    for page_number in range(start, stop):
+        text = reader.pages[page_number].extract_text()
+        if text:
+            texts.append(text + "\n")
+    return texts
+
+
+def extract_pdf_text(pdf_bytes: bytes, max_workers: int | None = None) -> str:
+    """
+    Extracts the text of every page, one line break after each non-empty page.
+    Large PDFs are split into page ranges that are extracted in a process pool.
+    """
+    import PyPDF2
+
+    page_count = len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+    if page_count < MIN_PAGES_FOR_POOL:
+        return "".join(_extract_page_range(pdf_bytes, 0, page_count))
+
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK)]
+    max_workers = max_workers or min(len(ranges), os.cpu_count() or 1)
+    # "spawn" keeps the workers independent of the threads of the calling process (e.g. Streamlit's).
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_extract_page_range, pdf_bytes, start, stop) for start, stop in ranges]
+        return "".join(text for future in futures for text in future.result())
+
+
+def extract_document_text(mime_type: str, data: bytes) -> str:
+    """Returns the text of one supporting document, in the form it is appended to the supporting text."""
+    if mime_type in ["text/plain", "text/markdown"]:
+        return data.decode("utf-8") + "\n\n"
+    if mime_type == "application/pdf":
+        return extract_pdf_text(data)
+    return ""
@@ -0,0 +1,164 @@
+"""
+Book-wide near-duplicate detection over the part bodies, with MinHash and LSH.
+
+Every part is cut into overlapping windows of about a paragraph, so an analogy or code
+example reused in another chapter is found even when the rest of the two parts differs.
+Each window gets a MinHash signature of its word shingles, and the LSH index only compares
+windows that agree on a whole band of their signatures, so the work grows about linearly
+with the number of parts instead of with the number of part pairs.
+"""
+import re
+
+import numpy as np
+
+from src.retrieval import STOPWORDS
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['_-][a-z0-9]+)*", re.IGNORECASE)
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+# Shingle hashes per batch when computing signatures, to bound memory (~50 MB at 128 permutations)
+_BATCH_SHINGLES = 50_000
+
+
+def _content_tokens(text: str) -> list[str]:
+    """The content words of `text`, as retrieval.tokenize finds them."""
+    return [token for token in map(str.lower, TOKEN_PATTERN.findall(text)) if token not in STOPWORDS and len(token) > 1]
+
+
+def _content_spans(text: str) -> list[tuple[int, int]]:
+    """Where each of `_content_tokens(text)` is in `text`."""
+    return [match.span() for match in TOKEN_PATTERN.finditer(text) if match.group().lower() not in STOPWORDS and len(match.group()) > 1]
+
+
+def shingle_hashes(token_ids: np.ndarray, size: int = 3) -> np.ndarray:
+    """32-bit hash of every run of `size` consecutive token ids, in text order."""
+    count = len(token_ids) - size + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    combined = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        combined = combined * _MIX + token_ids[offset:offset + count]
+    return (combined ^ (combined >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+
+
+def _permutations(num_perm: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    # Multiply-shift hashing: (a * h + b) >> 32 is a universal family for 32-bit h
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_blocks(shingles: np.ndarray, starts: np.ndarray, num_perm: int = 128, seed: int = 1) -> np.ndarray:
+    """
+    MinHash signature, (len(starts), num_perm) uint32, of each block of `shingles`;
+    block k runs from starts[k] to starts[k + 1] and none may be empty.
+    """
+    a, b = _permutations(num_perm, seed)
+    signatures = np.empty((len(starts), num_perm), dtype=np.uint32)
+    ends = np.append(starts[1:], len(shingles))
+    first = 0
+    while first < len(starts):
+        # As many blocks as fit in one batch, at least one
+        last = int(np.searchsorted(ends, starts[first] + _BATCH_SHINGLES, side="right"))
+        last = max(last, first + 1)
+        batch = shingles[starts[first]:ends[last - 1]]
+        # One row per permutation keeps the reduction over contiguous memory
+        permuted = np.multiply.outer(a, batch)
+        permuted += b[:, None]
+        permuted >>= np.uint64(32)
+        signatures[first:last] = np.minimum.reduceat(permuted, starts[first:last] - starts[first], axis=1).T
+        first = last
+    return signatures
+
+
+def lsh_candidates(signatures: np.ndarray, bands: int) -> set[tuple[int, int]]:
+    """Pairs of rows that agree on every value of at least one band of their signatures."""
+    rows_per_band = signatures.shape[1] // bands
+    candidates = set()
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * rows_per_band))).ravel()
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        shared = np.flatnonzero(counts[inverse] > 1)
+        if not len(shared):
+            continue
+        order = shared[np.argsort(inverse[shared], kind="stable")]
+        for group in np.split(order, np.flatnonzero(np.diff(inverse[order])) + 1):
+            for x in range(len(group)):
+                for y in range(x + 1, len(group)):
+                    candidates.add((int(group[x]), int(group[y])))
+    return candidates
+
+
+def find_duplicate_parts(contents: dict[tuple[int, int, int, int], tuple[str, str]], threshold: float = 0.5, window_tokens: int = 50, shingle_size: int = 3, num_perm: int = 128, bands: int = 32) -> list[dict]:
+    """
+    Near-duplicate pairs among the part bodies in `contents` ((chap, sec, item, part) ->
+    (part title, text)), most similar first. A pair is reported when a window of one part
+    and a window of the other have an estimated Jaccard similarity of at least `threshold`.
+
+    Windows hold `window_tokens` content words (~100 words of text) and overlap by half.
+    With 32 bands of 4 rows, windows at 0.5 similarity become candidates ~87% of the time,
+    those at 0.7 more than 99% of the time.
+    """
+    stride = window_tokens // 2
+    coords = sorted(contents)
+    vocabulary = {}
+    shingle_arrays, block_starts, block_count = [], [], 0
+    windows = []  # (part index, first block, second block, first token, end token)
+    offset = 0
+    for index, coord in enumerate(coords):
+        tokens = _content_tokens(contents[coord][1])
+        token_ids = np.array([vocabulary.setdefault(token, len(vocabulary)) for token in tokens], dtype=np.uint64)
+        shingles = shingle_hashes(token_ids, shingle_size)
+        if not len(shingles):
+            continue
+        # Blocks of `stride` shingles; each window is two neighbouring blocks
+        starts = np.arange(0, len(shingles), stride)
+        shingle_arrays.append(shingles)
+        block_starts.append(starts + offset)
+        offset += len(shingles)
+        for k in range(max(1, len(starts) - 1)):
+            second = min(k + 1, len(starts) - 1)
+            windows.append((index, block_count + k, block_count + second, k * stride, min(len(tokens), (k + 2) * stride + shingle_size - 1)))
+        block_count += len(starts)
+    if not windows:
+        return []
+
+    block_signatures = minhash_blocks(np.concatenate(shingle_arrays), np.concatenate(block_starts), num_perm)
+    window_array = np.array([window[1:3] for window in windows])
+    signatures = np.minimum(block_signatures[window_array[:, 0]], block_signatures[window_array[:, 1]])
+
+    def passage(window) -> str:
+        index, _, _, first_token, end_token = window
+        text = contents[coords[index]][1]
+        spans = _content_spans(text)
+        return text[spans[first_token][0]:spans[end_token - 1][1]]
+
+    pairs = {}
+    for x, y in lsh_candidates(signatures, bands):
+        if windows[x][0] == windows[y][0]:
+            continue
+        similarity = float(np.mean(signatures[x] == signatures[y]))
+        if similarity < threshold:
+            continue
+        # Book order: the first part of the pair is the one the reader meets first
+        if windows[x][0] > windows[y][0]:
+            x, y = y, x
+        pair = pairs.setdefault((windows[x][0], windows[y][0]), {"similarity": 0.0, "windows": 0})
+        pair["windows"] += 1
+        if similarity > pair["similarity"]:
+            pair.update(similarity=similarity, first_window=windows[x], second_window=windows[y])
+
+    duplicates = []
+    for (first, second), pair in pairs.items():
+        duplicates.append({
+            "first": {"coord": list(coords[first]), "title": contents[coords[first]][0]},
+            "second": {"coord": list(coords[second]), "title": contents[coords[second]][0]},
+            "similarity": round(pair["similarity"], 3),
+            "matching_windows": pair["windows"],
+            "passage": passage(pair["first_window"]),
+            "repeated": passage(pair["second_window"]),
+        })
+    duplicates.sort(key=lambda pair: (-pair["similarity"], pair["first"]["coord"], pair["second"]["coord"]))
+    return duplicates
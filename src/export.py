@@ -0,0 +1,227 @@
+import hashlib
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pypandoc
+
+from src.jobs import inherit_job_output
+
+# Parts of a pandoc DOCX that differ between shards and are merged; everything else
+# (styles, theme, settings, fonts, properties) is identical and taken from the first shard.
+DOCUMENT = "word/document.xml"
+FOOTNOTES = "word/footnotes.xml"
+NUMBERING = "word/numbering.xml"
+CONTENT_TYPES = "[Content_Types].xml"
+DOCUMENT_RELS = "word/_rels/document.xml.rels"
+FOOTNOTES_RELS = "word/_rels/footnotes.xml.rels"
+MERGED_PARTS = {DOCUMENT, FOOTNOTES, NUMBERING, CONTENT_TYPES, DOCUMENT_RELS, FOOTNOTES_RELS}
+
+ID_PATTERN = re.compile(r'(<w:(?:bookmarkStart|bookmarkEnd|footnoteReference|footnote)\b[^>]*?\sw:id=")(\d+)(")')
+DOC_PR_PATTERN = re.compile(r'(<wp:docPr\b[^>]*?\sid=")(\d+)(")')
+NUM_ID_PATTERN = re.compile(r'(<w:numId w:val="|<w:num w:numId=")(\d+)(")')
+ABSTRACT_NUM_ID_PATTERN = re.compile(r'(<w:abstractNumId w:val="|<w:abstractNum w:abstractNumId=")(\d+)(")')
+NSID_PATTERN = re.compile(r'<w:nsid w:val="[0-9A-Fa-f]+"')
+REL_ID_PATTERN = re.compile(r'(\sr:(?:id|embed|link)=")([^"]+)(")')
+BOOKMARK_NAME_PATTERN = re.compile(r'(<w:bookmarkStart\b[^>]*?\sw:name=")([^"]*)(")')
+ANCHOR_PATTERN = re.compile(r'(<w:hyperlink\b[^>]*?\sw:anchor=")([^"]*)(")')
+RELATIONSHIP_PATTERN = re.compile(r"<Relationship\b[^>]*/>")
+DEFAULT_TYPE_PATTERN = re.compile(r'<Default Extension="([^"]+)" ContentType="([^"]+)"\s*/>')
+FOOTNOTE_PATTERN = re.compile(r'<w:footnote\b(?![^>]*w:type=")[^>]*>.*?</w:footnote>', re.S)
+ABSTRACT_NUM_PATTERN = re.compile(r"<w:abstractNum\b.*?</w:abstractNum>", re.S)
+NUM_PATTERN = re.compile(r"<w:num\b[^>]*>.*?</w:num>", re.S)
+NUMBERING_PATTERN = re.compile(ABSTRACT_NUM_PATTERN.pattern + "|" + NUM_PATTERN.pattern, re.S)
+SHARD_REL_PATTERN = re.compile(r'<Relationship\b[^>]*Type="[^"]*(?:/hyperlink|/image)"[^>]*/>')
+BODY_START = "<w:body>"
+SECT_PR = "<w:sectPr"
+
+# Relationships of a shard that point at per-shard content and so are renamed and merged.
+SHARD_REL_TYPES = ("/hyperlink", "/image")
+
+
+def split_shards(data: bytes, offsets: list[int]) -> list[bytes]:
+    """Cuts the book at the given byte offsets (chapter starts): front matter, then one shard per chapter."""
+    bounds = [0] + [offset for offset in offsets if 0 < offset < len(data)] + [len(data)]
+    return [data[start:stop] for start, stop in zip(bounds, bounds[1:])]
+
+
+def _convert_shard(markdown: bytes, docx_path: str) -> None:
+    tmp_path = docx_path + ".tmp"
+    pypandoc.convert_text(markdown.decode("utf-8"), "docx", format="markdown", outputfile=tmp_path)
+    os.replace(tmp_path, docx_path)
+
+
+def _renumber(pattern: re.Pattern, text: str, mapping: dict, next_id: list[int]) -> str:
+    """Replaces the numbers captured by `pattern` with fresh ones, consistently within one shard."""
+    def replace(match: re.Match) -> str:
+        old = match.group(2)
+        if old not in mapping:
+            mapping[old] = str(next_id[0])
+            next_id[0] += 1
+        return match.group(1) + mapping[old] + match.group(3)
+    return pattern.sub(replace, text)
+
+
+class _DocxMerger:
+    """
+    Appends pandoc DOCX packages into one. Each shard's body is streamed into the merged
+    document.xml as it is read; its footnotes, list definitions, hyperlinks and images are
+    given IDs that are unique across the book, and bookmark names clashing with an earlier
+    shard get a "-N" suffix like pandoc gives them within a document.
+    """
+
+    def __init__(self, base: zipfile.ZipFile, out: zipfile.ZipFile):
+        self.base = base
+        self.out = out
+        self.next_id = [1]            # bookmarks, footnotes
+        self.next_drawing_id = [1]
+        self.next_num_id = [1]
+        self.next_abstract_num_id = [1]
+        self.bookmark_names: set[str] = set()
+        self.footnotes: list[str] = []
+        self.abstract_nums: list[str] = []
+        self.nums: list[str] = []
+        self.relationships: dict[str, list[str]] = {DOCUMENT_RELS: [], FOOTNOTES_RELS: []}
+        self.content_types: dict[str, str] = {}
+        self.media: list[tuple[str, str, str]] = []  # (shard docx, name in shard, merged name)
+
+    def _unique_bookmark(self, name: str) -> str:
+        unique, n = name, 0
+        while unique in self.bookmark_names:
+            n += 1
+            unique = f"{name}-{n}"
+        self.bookmark_names.add(unique)
+        return unique
+
+    def _relink(self, shard: int, zf: zipfile.ZipFile, docx_path: str, rels_part: str, rel_ids: dict) -> None:
+        if rels_part not in zf.namelist():
+            return
+        for relationship in RELATIONSHIP_PATTERN.findall(zf.read(rels_part).decode("utf-8")):
+            rel_type = re.search(r'Type="([^"]+)"', relationship).group(1)
+            if not rel_type.endswith(SHARD_REL_TYPES):
+                continue
+            old_id = re.search(r'Id="([^"]+)"', relationship).group(1)
+            new_id = rel_ids.setdefault(old_id, f"s{shard}{old_id}")
+            relationship = relationship.replace(f'Id="{old_id}"', f'Id="{new_id}"')
+            if rel_type.endswith("/image") and "TargetMode" not in relationship:
+                target = re.search(r'Target="([^"]+)"', relationship).group(1)
+                merged_target = f"media/s{shard}-{os.path.basename(target)}"
+                relationship = relationship.replace(f'Target="{target}"', f'Target="{merged_target}"')
+                if rels_part == DOCUMENT_RELS:
+                    self.media.append((docx_path, "word/" + target, "word/" + merged_target))
+            self.relationships[rels_part].append(relationship)
+
+    def add_shard(self, shard: int, docx_path: str, body_out) -> None:
+        with zipfile.ZipFile(docx_path) as zf:
+            rel_ids = {}
+            self._relink(shard, zf, docx_path, DOCUMENT_RELS, rel_ids)
+            self._relink(shard, zf, docx_path, FOOTNOTES_RELS, rel_ids)
+            for extension, content_type in DEFAULT_TYPE_PATTERN.findall(zf.read(CONTENT_TYPES).decode("utf-8")):
+                self.content_types.setdefault(extension, content_type)
+
+            def remap(text: str) -> str:
+                text = _renumber(ID_PATTERN, text, ids, self.next_id)
+                text = _renumber(DOC_PR_PATTERN, text, {}, self.next_drawing_id)
+                text = _renumber(NUM_ID_PATTERN, text, num_ids, self.next_num_id)
+                return REL_ID_PATTERN.sub(lambda m: m.group(1) + rel_ids.get(m.group(2), m.group(2)) + m.group(3), text)
+
+            ids, num_ids, bookmarks = {}, {}, {}
+            document = zf.read(DOCUMENT).decode("utf-8")
+            body = document[document.index(BODY_START) + len(BODY_START):document.rindex(SECT_PR)]
+
+            def rename_bookmark(match: re.Match) -> str:
+                bookmarks[match.group(2)] = self._unique_bookmark(match.group(2))
+                return match.group(1) + bookmarks[match.group(2)] + match.group(3)
+
+            body = BOOKMARK_NAME_PATTERN.sub(rename_bookmark, body)
+            body = ANCHOR_PATTERN.sub(lambda m: m.group(1) + bookmarks.get(m.group(2), m.group(2)) + m.group(3), body)
+            body_out.write(remap(body).encode("utf-8"))
+
+            if FOOTNOTES in zf.namelist():
+                self.footnotes.extend(remap(footnote) for footnote in FOOTNOTE_PATTERN.findall(zf.read(FOOTNOTES).decode("utf-8")))
+            if NUMBERING in zf.namelist():
+                numbering = zf.read(NUMBERING).decode("utf-8")
+                abstract_ids = {}
+                for abstract_num in ABSTRACT_NUM_PATTERN.findall(numbering):
+                    abstract_num = _renumber(ABSTRACT_NUM_ID_PATTERN, abstract_num, abstract_ids, self.next_abstract_num_id)
+                    # Word treats list definitions with the same nsid as one list.
+                    new_id = int(ABSTRACT_NUM_ID_PATTERN.search(abstract_num).group(2))
+                    self.abstract_nums.append(NSID_PATTERN.sub(f'<w:nsid w:val="{new_id:08X}"', abstract_num, count=1))
+                for num in NUM_PATTERN.findall(numbering):
+                    num = _renumber(NUM_ID_PATTERN, num, num_ids, self.next_num_id)
+                    self.nums.append(_renumber(ABSTRACT_NUM_ID_PATTERN, num, abstract_ids, self.next_abstract_num_id))
+
+    def write_parts(self) -> None:
+        """Writes every part but document.xml: the first shard's, with the merged entries in place of its own."""
+        def insert(part: str, pattern: re.Pattern, closing_tag: str, entries: list[str]) -> None:
+            text = pattern.sub("", self.base.read(part).decode("utf-8"))
+            if closing_tag not in text:
+                # An empty part is written as a self-closing root element.
+                text = re.sub(r"\s*/>\s*$", ">" + closing_tag, text)
+            at = text.rindex(closing_tag)
+            self.out.writestr(part, text[:at] + "".join(entries) + text[at:])
+
+        names = self.base.namelist()
+        for name in names:
+            if name not in MERGED_PARTS:
+                self.out.writestr(self.base.getinfo(name), self.base.read(name))
+        if FOOTNOTES in names:
+            insert(FOOTNOTES, FOOTNOTE_PATTERN, "</w:footnotes>", self.footnotes)
+        if NUMBERING in names:
+            # All list definitions go before the list instances, as the schema requires.
+            insert(NUMBERING, NUMBERING_PATTERN, "</w:numbering>", self.abstract_nums + self.nums)
+        for rels_part, relationships in self.relationships.items():
+            if rels_part in names:
+                insert(rels_part, SHARD_REL_PATTERN, "</Relationships>", relationships)
+        content_types = self.base.read(CONTENT_TYPES).decode("utf-8")
+        known = set(DEFAULT_TYPE_PATTERN.findall(content_types))
+        extra = [f'<Default Extension="{extension}" ContentType="{content_type}" />' for extension, content_type in self.content_types.items() if (extension, content_type) not in known]
+        at = content_types.rindex("</Types>")
+        self.out.writestr(CONTENT_TYPES, content_types[:at] + "".join(extra) + content_types[at:])
+        for docx_path, name, merged_name in self.media:
+            with zipfile.ZipFile(docx_path) as zf:
+                self.out.writestr(merged_name, zf.read(name))
+
+
+def export_docx(book_path_md: str, docx_path: str, shard_offsets: list[int], cache_dir: str, max_workers: int | None = None) -> dict:
+    """
+    Converts the book to DOCX one chapter shard at a time.
+
+    Every shard is converted by its own pandoc process, in parallel, and the result is cached
+    under `cache_dir` by the hash of the shard's markdown (and the pandoc version), so an
+    export after a one-chapter change only converts that chapter again. The shard documents
+    are then merged into `docx_path`; cached shards the book no longer uses are removed.
+    Returns shard counts.
+    """
+    with open(book_path_md, "rb") as f:
+        shards = split_shards(f.read(), shard_offsets)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    version = pypandoc.get_pandoc_version()
+    keys = [hashlib.sha256(version.encode("utf-8") + b"\0" + shard).hexdigest() for shard in shards]
+    paths = [os.path.join(cache_dir, f"{key}.docx") for key in keys]
+
+    missing = {path: shard for shard, path in zip(shards, paths) if not os.path.exists(path)}
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers or min(len(missing), os.cpu_count() or 1), initializer=inherit_job_output()) as executor:
+            list(executor.map(_convert_shard, missing.values(), missing.keys()))
+
+    tmp_path = docx_path + ".tmp"
+    with zipfile.ZipFile(paths[0]) as base, zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as out:
+        merger = _DocxMerger(base, out)
+        document = base.read(DOCUMENT).decode("utf-8")
+        with out.open(DOCUMENT, "w") as body_out:
+            body_out.write(document[:document.index(BODY_START) + len(BODY_START)].encode("utf-8"))
+            for shard, path in enumerate(paths):
+                merger.add_shard(shard, path, body_out)
+            body_out.write(document[document.rindex(SECT_PR):].encode("utf-8"))
+        merger.write_parts()
+    os.replace(tmp_path, docx_path)
+
+    current = {os.path.basename(path) for path in paths}
+    for name in os.listdir(cache_dir):
+        if name.endswith(".docx") and name not in current:
+            os.remove(os.path.join(cache_dir, name))
+
+    return {"shards": len(shards), "converted": len(missing), "reused": len(shards) - len(missing)}
@@ -1,248 +1,680 @@
-import os
-from dotenv import load_dotenv
-from openai import OpenAI
-from src.generate_outline import load_outline_from_file, parse_outline, extract_outline_metadata
-from src.generate_parts import run_generate_parts_for_all
-from tqdm import tqdm
-from yaspin import yaspin
-import textwrap
-import pypandoc
-
-load_dotenv()
-
-openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_endpoint = os.getenv("OPENAI_API_ENDPOINT")
-
-if not openai_api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set.")
-
-client = OpenAI(
-    api_key=openai_api_key,
-    base_url=openai_endpoint
-)
-
-
-def generate_contents(title: str, description: str, audience: str, selectedChapter: int, selectedSection: int, selectedItem: int, selectedPart: int, part_title: str, previous_parts_titles: list[str], previous_parts_contents: list[str], chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], extra_context: str = "") -> str:
-    import textwrap
-    
-    # 1) Build a short “context” block listing what prior parts covered
-    context_block = ""
-    if previous_parts_titles:
-        context_block += "### Previously written parts for this item:\n"
-        for idx, (ptitle, pcontent) in enumerate(zip(previous_parts_titles, previous_parts_contents)):
-            context_block += f"{idx+1}. {ptitle} (summary):\n"
-            # Include first ~50 words of each earlier part as a summary
-            snippet = " ".join(pcontent.strip().split()[:50])
-            context_block += f"\"{snippet}...\"\n\n"
-        context_block += "\n"
-    
-
-    # 2) Instruct the model not to overlap
-    prompt = f"""
-    You are a **textbook learning author**, tasked with generating detailed textbook content for a professional-quality book titled *“{title}"*
-    
-    Your role is to:
-    - Design and write engaging, structured, and comprehensive textbook sections.
-    - Tailor the material to the following audience: **{audience}**
-    Use a tone that is clear, professional, engaging, and moderately technical—balancing academic rigor with accessibility.
-    
-
-    Book title: {title}
-    Book description: {description}
-
-    We are currently in:
-    Chapter {selectedChapter + 1}. {chapters[selectedChapter]}
-    Section {selectedSection + 1}. {sections[selectedChapter][selectedSection]}
-    Item {selectedItem + 1}. {items[selectedChapter][selectedSection][selectedItem]}
-
-    Now write the content for:
-    Part {selectedPart + 1}. {part_title}
-
-    {textwrap.dedent(context_block)}
-
-    **Instructions for this part:**
-    - Produce **at least 1000 words** of clear, structured, and pedagogically sound textbook content. Use paragraphs and subheadings as needed.
-    - Focus **only** on “{part_title}.”  — do not include material from future parts.
-    - **Do not repeat** analogies, examples, or definitions already used—introduce fresh perspectives or deepen the previous ones.
-    - Use a consistent tone and writing style appropriate for educational materials:  
-        - Clear and professional, with **technical depth and gentle scaffolding**  
-        - Include **metaphors, analogies, practical examples**, and **case studies** as needed  
-        - When using code, keep it readable and properly explained  
-    - Maintain a consistent voice and structure across parts.
-
-    Begin now:
-    """
-
-    if extra_context:
-        prompt += f"\n\n### Additional Context Provided by User:\n{textwrap.dedent(extra_context[:2000])}..."
-
-
-    response = client.chat.completions.create(
-        model="gpt-4.1-2025-04-14",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7
-    )
-    return response.choices[0].message.content
-
-
-def run_generate_contents_and_save_book(output_dir: str = "book_output", debug: bool = False, status_area=None, live_output_area=None, extra_context: str = ""):
-
-    with yaspin(text="Generating the Outline...", color="yellow") as spinner:
-        try:
-            raw_outline = load_outline_from_file("src/outline.md")
-            metadata = extract_outline_metadata(raw_outline)
-            book_title = metadata["title"]
-            book_description = metadata["description"]
-            audience = metadata["audience"]
-            spinner.ok("✔")
-        except Exception as e:
-            spinner.fail("✘")
-            print(f"Error generating outline: {e}")
-            return
-        
-    chapters, sections, items = parse_outline(raw_outline)
-    
-    if debug:
-        chapters = chapters[:1]                 # Only Chapter 1
-        sections = [sections[0][:1]]
-        items = [[[items[0][0][0]]]]            # Only one item with one part
-
-        chapter_items = items[0]
-        items = []
-        for section_items in chapter_items:
-            half_count = max(1, len(section_items) // 2)
-            items.append(section_items[:half_count])
-        items = [items]
-
-
-    parts = run_generate_parts_for_all(
-        title=book_title,
-        description=book_description,
-        audience=audience,
-        chapters=chapters,
-        sections=sections,
-        items=items
-    )
-    
-    total_parts = 0
-    for c in range(len(chapters)):
-        for s in range(len(sections[c])):
-            for i in range(len(items[c][s])):
-                total_parts += len(parts[c][s][i])
-
-    # 1) Prepare output directory and file handle
-    os.makedirs(output_dir, exist_ok=True)
-    book_path_md = os.path.join(output_dir, f"{book_title}.md")
-    book_path_docx = os.path.join(output_dir, f"{book_title}.docx")
-
-
-    with open(book_path_md, "w", encoding="utf-8") as f:
-        # ──────────────────────────────────────────────────────────────────────
-        # A) Title Page
-        # ──────────────────────────────────────────────────────────────────────
-        f.write("=" * 80 + "\n")
-        f.write(f"{book_title.center(80)}\n")
-        if book_description:
-            import textwrap
-            wrapped_desc = textwrap.fill(book_description, width=80)
-            f.write(wrapped_desc.center(80) + "\n")
-        f.write("=" * 80 + "\n\n\n")
-
-        # ──────────────────────────────────────────────────────────────────────
-        # B) Table of Contents
-        # ──────────────────────────────────────────────────────────────────────
-        f.write("TABLE OF CONTENTS\n\n")
-
-        for chap_idx, chap_title in enumerate(chapters):
-            chap_number = chap_idx + 1
-            f.write(f"Chapter {chap_number}. {chap_title}\n")
-
-            for sec_idx, sec_title in enumerate(sections[chap_idx]):
-                sec_number = sec_idx + 1
-                f.write(f"    Section {sec_number}. {sec_title}\n")
-
-                for item_idx, item_title in enumerate(items[chap_idx][sec_idx]):
-                    item_number = item_idx + 1
-                    f.write(f"        Item {item_number}. {item_title}\n")
-
-                f.write("\n")  # blank line after each section
-            f.write("\n")  # blank line after each chapter
-
-        # ──────────────────────────────────────────────────────────────────────
-        # C) Main Content
-        # ──────────────────────────────────────────────────────────────────────
-        f.write("=" * 80 + "\n\n")
-
-        pbar = tqdm(total=total_parts, desc="Generating book contents", unit="part")
-        # Now generate-and-write each part’s content in the proper order
-        for c, chap_title in enumerate(chapters):
-            f.write(f"CHAPTER {c+1}. {chap_title}\n\n")
-            for s, sec_title in enumerate(sections[c]):
-                f.write(f"SECTION {s+1}. {sec_title}\n\n")
-                for i, item_title in enumerate(items[c][s]):
-                    f.write(f"ITEM {i+1}. {item_title}\n\n")
-
-                    previous_titles = []
-                    previous_contents = []
-
-                    for p, part_title in enumerate(parts[c][s][i]):
-                        if status_area:
-                            status_area.markdown(
-                                f"✍️ Generating **Chapter {c+1}**, Section {s+1}, Item {i+1}, Part {p+1}**: {part_title}..."
-    )
-                        f.write(f"PART {p+1}. {part_title}\n\n")
-                        
-                        content_text = generate_contents(
-                            title=book_title,
-                            description=book_description,
-                            audience=audience,
-                            selectedChapter=c,
-                            selectedSection=s,
-                            selectedItem=i,
-                            selectedPart=p,
-                            part_title=part_title,
-                            previous_parts_titles=previous_titles,
-                            previous_parts_contents=previous_contents,
-                            chapters=chapters,
-                            sections=sections,
-                            items=items
-                        )
-                        
-                        # ✅ DISPLAY the generated part live in the UI
-                        if live_output_area:
-                            live_output_area.markdown(f"#### 📘 Chapter {c+1}, Section {s+1}, Item {i+1}, Part {p+1}: *{part_title}*")
-                            live_output_area.markdown(content_text.strip())
-
-
-                        f.write(content_text.strip() + "\n\n")
-
-                        previous_titles.append(part_title)
-                        previous_contents.append(content_text)
-                        
-                        pbar.update(1)
-
-                    f.write("\n")  # blank line after all parts in this item
-
-                f.write("\n")  # blank line after all items in this section
-
-            f.write("\n\n")  # blank line after each chapter
-        
-        pbar.close()
-        
-    print(f"📚 All contents generated and saved into:\n    {book_path_md}")
-    
-    try:
-        output = pypandoc.convert_file(book_path_md, 'docx', outputfile=book_path_docx)
-        print(f"📄 Converted to DOCX: {book_path_docx}")
-    except Exception as e:
-        print(f"❌ Error converting to DOCX: {e}")
-
-    
-if __name__ == "__main__":
-    run_generate_contents_and_save_book(
-        output_dir=output_dir,
-        debug=preview,
-        status_area=status_placeholder,
-        live_output_area=live_output_area,
-        extra_context=supporting_text
-    )
+import os
+from src.client import get_client, load_env
+from src.outline import Outline, load_outline
+from src.generate_parts import run_generate_parts_for_all, batch_generate_parts_for_all
+from src.scheduler import ItemScheduler
+from src.cache import ResponseCache
+from src.llm import build_request, chat_completion
+from src.batch import make_batch_backend, run_cached_batch
+from src.telemetry import Telemetry
+from src.rate_limit import RateLimiter
+from src.routing import ModelRouter
+from src.retrieval import SupportIndex
+from src.overlap import find_overlaps
+from typing import Callable
+import time
+from src.journal import BookJournal, outline_fingerprint, read_journal, latest_journal
+from src.incremental import diff_outlines, carry_forward
+from src.jobs import inherit_job_output
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+import textwrap
+import json
+
+DUPLICATE_MODES = ("off", "report", "rewrite")
+
+
+def build_book_system_prompt(title: str, description: str, audience: str, extra_context: str = "") -> str:
+    """
+    Book-level preamble shared by every content request of a book. Keeping it byte-identical
+    and first lets the provider serve it from its prompt cache, so only the per-part suffix
+    is billed and processed at full price.
+    """
+    system_prompt = textwrap.dedent(f"""
+    You are a **textbook learning author**, tasked with generating detailed textbook content for a professional-quality book titled *“{title}"*
+
+    Your role is to:
+    - Design and write engaging, structured, and comprehensive textbook sections.
+    - Tailor the material to the following audience: **{audience}**
+    Use a tone that is clear, professional, engaging, and moderately technical—balancing academic rigor with accessibility.
+
+    Book title: {title}
+    Book description: {description}
+
+    **Instructions for every part:**
+    - Produce **at least 1000 words** of clear, structured, and pedagogically sound textbook content. Use paragraphs and subheadings as needed.
+    - Focus **only** on the requested part — do not include material from future parts.
+    - **Do not repeat** analogies, examples, or definitions already used—introduce fresh perspectives or deepen the previous ones.
+    - Use a consistent tone and writing style appropriate for educational materials:
+        - Clear and professional, with **technical depth and gentle scaffolding**
+        - Include **metaphors, analogies, practical examples**, and **case studies** as needed
+        - When using code, keep it readable and properly explained
+    - Maintain a consistent voice and structure across parts.
+    """).strip()
+
+    if extra_context:
+        system_prompt += f"\n\n### Additional Context Provided by User:\n{textwrap.dedent(extra_context[:2000])}..."
+    return system_prompt
+
+
+def build_contents_messages(title: str, description: str, audience: str, selectedChapter: int, selectedSection: int, selectedItem: int, selectedPart: int, part_title: str, previous_parts_titles: list[str], previous_parts_contents: list[str], chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], extra_context: str = "", support_index: SupportIndex | None = None, context_passages: int = 4, context_token_budget: int = 600, sibling_parts_titles: list[str] | None = None, avoid_passages: list[str] | None = None) -> list[dict]:
+    """
+    Renders a content request as the stable book-level system message followed by the
+    volatile per-part user message (position, previous parts, retrieved excerpts).
+
+    For speculative generation, `sibling_parts_titles` lists the item's other parts instead
+    of the text of the previous ones, so every part of the item can be requested at once.
+    `avoid_passages` quotes material from elsewhere in the book that the part must not repeat.
+    """
+    # 1) Build a short “context” block listing what prior parts covered
+    context_block = ""
+    if previous_parts_titles:
+        context_block += "### Previously written parts for this item:\n"
+        for idx, (ptitle, pcontent) in enumerate(zip(previous_parts_titles, previous_parts_contents)):
+            context_block += f"{idx+1}. {ptitle} (summary):\n"
+            # Include first ~50 words of each earlier part as a summary
+            snippet = " ".join(pcontent.strip().split()[:50])
+            context_block += f"\"{snippet}...\"\n\n"
+    if sibling_parts_titles:
+        context_block += "### Other parts of this item (written separately — leave their material to them):\n"
+        for ptitle in sibling_parts_titles:
+            context_block += f"- {ptitle}\n"
+    if avoid_passages:
+        context_block += "\n### Already covered elsewhere in the book — do not reuse these passages, analogies or examples:\n"
+        for passage in avoid_passages:
+            context_block += f"\"{' '.join(passage.split()[:120])}...\"\n\n"
+
+    # 2) Instruct the model not to overlap
+    user_prompt = textwrap.dedent(f"""
+    We are currently in:
+    Chapter {selectedChapter + 1}. {chapters[selectedChapter]}
+    Section {selectedSection + 1}. {sections[selectedChapter][selectedSection]}
+    Item {selectedItem + 1}. {items[selectedChapter][selectedSection][selectedItem]}
+
+    Now write the content for:
+    Part {selectedPart + 1}. {part_title}
+    """).strip()
+
+    if context_block:
+        user_prompt += "\n\n" + context_block.strip()
+
+    if support_index is not None:
+        # Only the passages relevant to this part, instead of the first 2000 characters of the upload
+        query = " ".join([chapters[selectedChapter], sections[selectedChapter][selectedSection], items[selectedChapter][selectedSection][selectedItem], part_title])
+        passages = support_index.query(query, k=context_passages, token_budget=context_token_budget)
+        if passages:
+            excerpts = "\n\n---\n\n".join(passages)
+            user_prompt += f"\n\n### Relevant Excerpts from Supporting Documents:\n{excerpts}"
+
+    user_prompt += f"\n\nFocus **only** on “{part_title}.” — do not include material from future parts.\n\nBegin now:"
+
+    # With an index the excerpts are per part; otherwise the raw upload belongs to the shared preamble.
+    system_prompt = build_book_system_prompt(title, description, audience, "" if support_index is not None else extra_context)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def generate_contents(title: str, description: str, audience: str, selectedChapter: int, selectedSection: int, selectedItem: int, selectedPart: int, part_title: str, previous_parts_titles: list[str], previous_parts_contents: list[str], chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], extra_context: str = "", cache: ResponseCache | None = None, on_token: Callable[[str], None] | None = None, telemetry: Telemetry | None = None, limiter: RateLimiter | None = None, support_index: SupportIndex | None = None, context_passages: int = 4, context_token_budget: int = 600, sibling_parts_titles: list[str] | None = None, avoid_passages: list[str] | None = None, stage: str = "contents", router: ModelRouter | None = None) -> str:
+    messages = build_contents_messages(
+        title=title,
+        description=description,
+        audience=audience,
+        selectedChapter=selectedChapter,
+        selectedSection=selectedSection,
+        selectedItem=selectedItem,
+        selectedPart=selectedPart,
+        part_title=part_title,
+        previous_parts_titles=previous_parts_titles,
+        previous_parts_contents=previous_parts_contents,
+        chapters=chapters,
+        sections=sections,
+        items=items,
+        extra_context=extra_context,
+        support_index=support_index,
+        context_passages=context_passages,
+        context_token_budget=context_token_budget,
+        sibling_parts_titles=sibling_parts_titles,
+        avoid_passages=avoid_passages
+    )
+
+    return chat_completion(
+        get_client(),
+        messages=messages,
+        cache=cache,
+        on_token=on_token,
+        telemetry=telemetry,
+        stage=stage,
+        coord=(selectedChapter, selectedSection, selectedItem, selectedPart),
+        limiter=limiter,
+        expected_completion_tokens=1500,
+        router=router
+    )
+
+
+def batch_generate_contents(title: str, description: str, audience: str, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], parts: dict, journal: BookJournal, backend, workdir: str, extra_context: str = "", support_index: SupportIndex | None = None, cache: ResponseCache | None = None, telemetry: Telemetry | None = None, router: ModelRouter | None = None, poll_interval: float = 30.0) -> int:
+    """
+    Generates the part bodies through the Batch API in waves: wave p holds part p of every
+    item, whose request can only be rendered once parts 0..p-1 of that item are written.
+    Results go to the journal, from which the book is then assembled without further calls.
+    Returns the number of parts left without a body (failed requests, or parts after one);
+    the online pass generates those.
+    """
+    item_coords = Outline.from_lists(chapters, sections, items).item_coords()
+    request_options = router.request_options("contents") if router is not None else {}
+    wave_count = max((len(parts[c][s][i]) for c, s, i in item_coords), default=0)
+
+    for p in range(wave_count):
+        requests = {}
+        coords = {}
+        for c, s, i in item_coords:
+            part_titles = parts[c][s][i]
+            if p >= len(part_titles) or journal.get_content((c, s, i, p), part_titles[p]) is not None:
+                continue
+            previous_contents = [journal.get_content((c, s, i, q), part_titles[q]) for q in range(p)]
+            if None in previous_contents:
+                continue  # an earlier part of this item failed; the online pass takes over
+            custom_id = f"contents-{c}-{s}-{i}-{p}"
+            requests[custom_id] = build_request(build_contents_messages(
+                title=title,
+                description=description,
+                audience=audience,
+                selectedChapter=c,
+                selectedSection=s,
+                selectedItem=i,
+                selectedPart=p,
+                part_title=part_titles[p],
+                previous_parts_titles=part_titles[:p],
+                previous_parts_contents=previous_contents,
+                chapters=chapters,
+                sections=sections,
+                items=items,
+                extra_context=extra_context,
+                support_index=support_index
+            ), **request_options)
+            coords[custom_id] = (c, s, i, p)
+
+        results = run_cached_batch(backend, requests, coords, "contents", workdir, f"contents_wave_{p + 1}", cache=cache, telemetry=telemetry, poll_interval=poll_interval, on_status=print)
+        for custom_id, content_text in results.items():
+            c, s, i, p = coords[custom_id]
+            journal.record_content((c, s, i, p), parts[c][s][i][p], content_text)
+
+    return sum(
+        1
+        for c, s, i in item_coords
+        for p, part_title in enumerate(parts[c][s][i])
+        if journal.get_content((c, s, i, p), part_title) is None
+    )
+
+
+def write_book(f, outline: Outline, book_title: str, book_description: str, next_event: Callable[[], tuple[str, str]], status_area=None, live_output_area=None) -> list[int]:
+    """
+    Writes the title page, table of contents and every part of `outline` to `f`. The part
+    bodies are taken in book order from `next_event`, as ("token", text) events while a part
+    streams and one ("part", text) event once it is complete. Returns the offset of each
+    chapter, the shard boundaries for the DOCX export.
+    """
+    # ──────────────────────────────────────────────────────────────────────
+    # A) Title Page
+    # ──────────────────────────────────────────────────────────────────────
+    f.write("=" * 80 + "\n")
+    f.write(f"{book_title.center(80)}\n")
+    if book_description:
+        import textwrap
+        wrapped_desc = textwrap.fill(book_description, width=80)
+        f.write(wrapped_desc.center(80) + "\n")
+    f.write("=" * 80 + "\n\n\n")
+
+    # ──────────────────────────────────────────────────────────────────────
+    # B) Table of Contents
+    # ──────────────────────────────────────────────────────────────────────
+    f.write("TABLE OF CONTENTS\n\n")
+
+    for chapter in outline.chapters:
+        chap_number = chapter.coord[0] + 1
+        f.write(f"Chapter {chap_number}. {chapter.title}\n")
+
+        for section in chapter.sections:
+            sec_number = section.coord[1] + 1
+            f.write(f"    Section {sec_number}. {section.title}\n")
+
+            for item in section.items:
+                item_number = item.coord[2] + 1
+                f.write(f"        Item {item_number}. {item.title}\n")
+
+            f.write("\n")  # blank line after each section
+        f.write("\n")  # blank line after each chapter
+
+    # ──────────────────────────────────────────────────────────────────────
+    # C) Main Content
+    # ──────────────────────────────────────────────────────────────────────
+    f.write("=" * 80 + "\n\n")
+
+    chapter_offsets = []
+    for chapter in outline.chapters:
+        c = chapter.coord[0]
+        chapter_offsets.append(f.tell())  # shard boundaries for the DOCX export
+        f.write(f"CHAPTER {c+1}. {chapter.title}\n\n")
+        for section in chapter.sections:
+            s = section.coord[1]
+            f.write(f"SECTION {s+1}. {section.title}\n\n")
+            for item in section.items:
+                i = item.coord[2]
+                f.write(f"ITEM {i+1}. {item.title}\n\n")
+
+                for p, part_title in enumerate(item.parts):
+                    if status_area:
+                        status_area.markdown(
+                            f"✍️ Generating **Chapter {c+1}**, Section {s+1}, Item {i+1}, Part {p+1}**: {part_title}..."
+                        )
+                    f.write(f"PART {p+1}. {part_title}\n\n")
+
+                    # ✅ DISPLAY the generated part live in the UI
+                    live_placeholder = None
+                    if live_output_area:
+                        live_output_area.markdown(f"#### 📘 Chapter {c+1}, Section {s+1}, Item {i+1}, Part {p+1}: *{part_title}*")
+                        live_placeholder = live_output_area.empty()
+
+                    part_writer = StreamedPartWriter(f, live_placeholder)
+                    while True:
+                        kind, payload = next_event()
+                        if kind == "token":
+                            part_writer.feed(payload)
+                        else:
+                            part_writer.finish(payload)
+                            break
+
+                f.write("\n")  # blank line after all parts in this item
+
+            f.write("\n")  # blank line after all items in this section
+
+        f.write("\n\n")  # blank line after each chapter
+    return chapter_offsets
+
+
+def find_book_duplicates(outline: Outline, journal: BookJournal, report_path: str) -> list[dict]:
+    """Runs the near-duplicate check over every part body of the book and saves the pairs to `report_path`."""
+    from src.duplicates import find_duplicate_parts
+
+    contents = {}
+    for item in outline.items():
+        for p, part_title in enumerate(item.parts):
+            contents[item.coord + (p,)] = (part_title, journal.get_content(item.coord + (p,), part_title))
+    duplicate_pairs = find_duplicate_parts(contents)
+
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({"parts": len(contents), "pairs": duplicate_pairs}, f, ensure_ascii=False, indent=2)
+    print(f"🔎 {len(duplicate_pairs)} near-duplicate part pairs found in {len(contents)} parts; details in {report_path}")
+    for pair in duplicate_pairs[:5]:
+        first, second = pair["first"], pair["second"]
+        print(f"    {'.'.join(str(n + 1) for n in first['coord'])} {first['title']} ↔ {'.'.join(str(n + 1) for n in second['coord'])} {second['title']} ({pair['similarity']:.0%})")
+    return duplicate_pairs
+
+
+class StreamedPartWriter:
+    """
+    Writes one part body to the book file and the live view while its tokens arrive.
+    The file always receives exactly `content.strip() + "\n\n"`, as in the non-streaming path;
+    the live view and the file buffer are refreshed at most every `refresh_interval` seconds.
+    """
+
+    def __init__(self, f, live_placeholder=None, refresh_interval: float = 0.3):
+        self.f = f
+        self.live_placeholder = live_placeholder
+        self.refresh_interval = refresh_interval
+        self.started = False
+        self.pending_whitespace = ""
+        self.text = []
+        self.last_refresh = time.monotonic()
+
+    def feed(self, token: str) -> None:
+        self.text.append(token)
+        if not self.started:
+            token = token.lstrip()
+            if not token:
+                return
+            self.started = True
+
+        # Trailing whitespace is held back until more text follows, so the end of the part
+        # is stripped exactly as str.strip() would.
+        body = token.rstrip()
+        if body:
+            self.f.write(self.pending_whitespace + body)
+            self.pending_whitespace = token[len(body):]
+        else:
+            self.pending_whitespace += token
+
+        now = time.monotonic()
+        if now - self.last_refresh >= self.refresh_interval:
+            self.last_refresh = now
+            self.f.flush()
+            if self.live_placeholder:
+                self.live_placeholder.markdown("".join(self.text).strip() + " ▌")
+
+    def finish(self, content_text: str) -> None:
+        if not self.text:
+            self.feed(content_text)
+        self.f.write("\n\n")
+        self.f.flush()
+        if self.live_placeholder:
+            self.live_placeholder.markdown(content_text.strip())
+
+
+def run_generate_contents_and_save_book(output_dir: str = "book_output", debug: bool = False, status_area=None, live_output_area=None, extra_context: str = "", max_workers: int = 1, cache_mode: str | None = None, resume: bool = False, stream: bool = False, outline_path: str = "src/outline.md", support_index: SupportIndex | None = None, batch: str | None = None, batch_poll_interval: float = 30.0, parts_group_by: str = "item", incremental: bool = False, limiter: RateLimiter | None = None, speculative: bool = False, duplicates: str = "report", model_routes: dict[str, dict] | None = None):
+    # Imported here so that importing this module (e.g. for a Streamlit page) stays cheap.
+    from tqdm import tqdm
+    from yaspin import yaspin
+    from src.export import export_docx
+
+    if duplicates not in DUPLICATE_MODES:
+        raise ValueError(f"Unknown duplicates mode {duplicates!r}, expected one of {DUPLICATE_MODES}.")
+    # BOOK_* settings may come from .env, which is otherwise only read once the client is created
+    load_env()
+
+    with yaspin(text="Generating the Outline...", color="yellow") as spinner:
+        try:
+            outline = load_outline(outline_path)
+            book_title = outline.title
+            book_description = outline.description
+            audience = outline.audience
+            spinner.ok("✔")
+        except Exception as e:
+            spinner.fail("✘")
+            print(f"Error generating outline: {e}")
+            return
+
+    if debug:
+        outline = outline.preview()             # Only the first item of Chapter 1, Section 1
+
+    # Title lists for the prompt builders and the journal fingerprint
+    chapters, sections, items = outline.to_lists()
+
+
+    cache = ResponseCache.from_env(mode=cache_mode)
+    telemetry = Telemetry()
+    # One limiter for both stages, so together they stay under the provider's RPM/TPM limits;
+    # background jobs pass one shared by all the books they generate
+    if limiter is None:
+        limiter = RateLimiter.from_env(max_concurrency=max_workers)
+    # Model, max_tokens, concurrency cap and fallback per stage (BOOK_<STAGE>_* or `model_routes`)
+    router = ModelRouter.from_env(model_routes)
+    # The supporting documents are indexed once; each part then pulls in only its top passages
+    if support_index is None and extra_context:
+        support_index = SupportIndex(extra_context)
+
+    # Every finished part list and part body goes to the journal, so a run that dies
+    # halfway can be resumed and only pays for the remaining API calls.
+    os.makedirs(output_dir, exist_ok=True)
+    journal_path = os.path.join(output_dir, f"{book_title}.journal.jsonl")
+    fingerprint = outline_fingerprint(book_title, book_description, audience, chapters, sections, items)
+
+    # Incremental build: diff the outline against the one of the previous build (kept in its
+    # journal) and carry over the part lists and bodies of every item that is still there.
+    carried = None
+    if incremental:
+        # A retitled book writes a new journal, so fall back to the latest one in the directory
+        previous_path = journal_path if os.path.exists(journal_path) else latest_journal(output_dir)
+        if previous_path:
+            header, previous_parts, previous_contents = read_journal(previous_path)
+            if header and header["fingerprint"] == fingerprint:
+                resume = True
+            elif header and "outline" in header:
+                diff = diff_outlines(Outline.from_snapshot(header["outline"]), outline)
+                print(f"🧩 Incremental build: {diff.summary()}")
+                carried = carry_forward(diff, previous_parts, previous_contents)
+            else:
+                print("⚠️ The previous build's journal has no outline snapshot; rebuilding everything")
+
+    with BookJournal(journal_path, fingerprint, resume=resume, snapshot=outline.snapshot()) as journal:
+        if carried is not None:
+            journal.carry_over(*carried)
+        if journal.parts:
+            print(f"♻️ Resuming from journal: {len(journal.parts)} part lists and {len(journal.contents)} part bodies already done")
+
+        # Batch mode ("openai" or "local"): the requests are submitted as Batch API jobs at a lower
+        # price and higher throughput; whatever a batch fails to deliver is generated online below.
+        batch_backend = None
+        if batch:
+            batch_backend = make_batch_backend(batch, get_client(), os.path.join(output_dir, "batches"))
+            with telemetry.phase("parts-batch"):
+                missing = batch_generate_parts_for_all(
+                    title=book_title,
+                    description=book_description,
+                    audience=audience,
+                    chapters=chapters,
+                    sections=sections,
+                    items=items,
+                    backend=batch_backend,
+                    workdir=os.path.join(output_dir, "batches"),
+                    cache=cache,
+                    telemetry=telemetry,
+                    router=router,
+                    completed=journal.parts,
+                    on_complete=journal.record_parts,
+                    poll_interval=batch_poll_interval
+                )
+            if missing:
+                print(f"⚠️ {missing} part lists missing from the batch results; generating them online")
+
+        with telemetry.phase("parts"):
+            parts = run_generate_parts_for_all(
+                title=book_title,
+                description=book_description,
+                audience=audience,
+                chapters=chapters,
+                sections=sections,
+                items=items,
+                max_workers=max_workers,
+                cache=cache,
+                telemetry=telemetry,
+                limiter=limiter,
+                router=router,
+                completed=journal.parts,
+                on_complete=journal.record_parts,
+                group_by=parts_group_by
+            )
+    
+        outline.attach_parts(parts)
+        total_parts = sum(len(item.parts) for item in outline.items())
+
+        if batch_backend is not None:
+            with telemetry.phase("contents-batch"):
+                missing = batch_generate_contents(
+                    title=book_title,
+                    description=book_description,
+                    audience=audience,
+                    chapters=chapters,
+                    sections=sections,
+                    items=items,
+                    parts=parts,
+                    journal=journal,
+                    backend=batch_backend,
+                    workdir=os.path.join(output_dir, "batches"),
+                    extra_context=extra_context,
+                    support_index=support_index,
+                    cache=cache,
+                    telemetry=telemetry,
+                    router=router,
+                    poll_interval=batch_poll_interval
+                )
+            if missing:
+                print(f"⚠️ {missing} part bodies missing from the batch results; generating them online")
+
+        # 1) Prepare output file handle; the book is written to a temporary file and only
+        #    replaces the previous .md once it is complete
+        book_path_md = os.path.join(output_dir, f"{book_title}.md")
+        book_path_docx = os.path.join(output_dir, f"{book_title}.docx")
+        partial_path_md = book_path_md + ".partial"
+
+
+        with telemetry.phase("contents"), open(partial_path_md, "w", encoding="utf-8") as f:
+            pbar = tqdm(total=total_parts, desc="Generating book contents", unit="part")
+
+            def generate_part(c, s, i, p, part_title, previous_titles=(), previous_contents=(), on_token=None, sibling_titles=None, avoid_passages=None, stage="contents"):
+                return generate_contents(
+                    title=book_title,
+                    description=book_description,
+                    audience=audience,
+                    selectedChapter=c,
+                    selectedSection=s,
+                    selectedItem=i,
+                    selectedPart=p,
+                    part_title=part_title,
+                    previous_parts_titles=list(previous_titles),
+                    previous_parts_contents=list(previous_contents),
+                    chapters=chapters,
+                    sections=sections,
+                    items=items,
+                    cache=cache,
+                    on_token=on_token,
+                    telemetry=telemetry,
+                    limiter=limiter,
+                    router=router,
+                    support_index=support_index,
+                    sibling_parts_titles=sibling_titles,
+                    avoid_passages=avoid_passages,
+                    stage=stage
+                )
+
+            # Speculative mode: all missing parts of an item are requested at once, each told only
+            # the titles of its siblings. Parts that still repeat each other's material are then
+            # rewritten one after another with the usual sequential context.
+            repaired_parts = []
+
+            def speculate_item_contents(c, s, i, part_titles):
+                contents = [journal.get_content((c, s, i, p), part_title) for p, part_title in enumerate(part_titles)]
+                speculated = [p for p, content_text in enumerate(contents) if content_text is None]
+                if not speculated:
+                    return contents
+
+                with ThreadPoolExecutor(max_workers=len(speculated), initializer=inherit_job_output()) as pool:
+                    futures = {
+                        p: pool.submit(generate_part, c, s, i, p, part_titles[p], sibling_titles=[t for q, t in enumerate(part_titles) if q != p])
+                        for p in speculated
+                    }
+                for p, future in futures.items():
+                    contents[p] = future.result()
+
+                # Of each overlapping pair, rewrite the later part (it would have seen the earlier
+                # one in a sequential run), unless it came from the journal
+                to_repair = set()
+                for a, b, _ in find_overlaps(contents):
+                    if b in speculated:
+                        to_repair.add(b)
+                    elif a in speculated:
+                        to_repair.add(a)
+                for p in sorted(to_repair):
+                    contents[p] = generate_part(
+                        c, s, i, p, part_titles[p], part_titles[:p], contents[:p], stage="contents-repair"
+                    )
+                    repaired_parts.append((c, s, i, p))
+
+                for p in speculated:
+                    journal.record_content((c, s, i, p), part_titles[p], contents[p])
+                return contents
+
+            # Parts of one item form a chain (each needs the earlier parts' text), but items are
+            # independent, so each item runs as one task and the scheduler replays the finished
+            # parts in book order.
+            def generate_item_contents(coord, emit):
+                c, s, i = coord
+                part_titles = outline.item(c, s, i).parts
+                if speculative:
+                    for content_text in speculate_item_contents(c, s, i, part_titles):
+                        pbar.update(1)
+                        emit(("part", content_text))
+                    return
+
+                previous_titles = []
+                previous_contents = []
+                on_token = (lambda token: emit(("token", token))) if stream else None
+                for p, part_title in enumerate(part_titles):
+                    content_text = journal.get_content((c, s, i, p), part_title)
+                    if content_text is None:
+                        content_text = generate_part(c, s, i, p, part_title, previous_titles, previous_contents, on_token=on_token)
+                        journal.record_content((c, s, i, p), part_title, content_text)
+                    previous_titles.append(part_title)
+                    previous_contents.append(content_text)
+                    pbar.update(1)
+                    emit(("part", content_text))
+
+            finished_parts = ItemScheduler(max_workers).run(outline.item_coords(), generate_item_contents)
+            with closing(finished_parts):
+                chapter_offsets = write_book(f, outline, book_title, book_description, lambda: next(finished_parts)[1], status_area, live_output_area)
+
+            pbar.close()
+
+        os.replace(partial_path_md, book_path_md)
+        print(f"📚 All contents generated and saved into:\n    {book_path_md}")
+        if speculative:
+            print(f"🔀 Speculative parts: {len(repaired_parts)} rewritten after the overlap check")
+
+        # Book-wide check for passages (analogies, examples, code) repeated across parts
+        if duplicates != "off":
+            with telemetry.phase("duplicates"):
+                duplicate_pairs = find_book_duplicates(outline, journal, os.path.join(output_dir, f"{book_title}.duplicates.json"))
+
+            if duplicate_pairs and duplicates == "rewrite":
+                # Rewrite the later part of each pair, quoting what it must not repeat, then
+                # write the book again from the journal
+                to_rewrite = {}
+                for pair in duplicate_pairs:
+                    # Pairs come most similar first; quote at most three distinct passages per part
+                    passages = to_rewrite.setdefault(tuple(pair["second"]["coord"]), [])
+                    if len(passages) < 3 and pair["passage"] not in passages:
+                        passages.append(pair["passage"])
+
+                # A rewritten part is context for the later parts of its item, so the flagged parts
+                # of one item are rewritten in part order; only different items run in parallel.
+                by_item = {}
+                for coord in sorted(to_rewrite):
+                    by_item.setdefault(coord[:3], []).append(coord)
+
+                def rewrite_item_parts(coords):
+                    for coord in coords:
+                        c, s, i, p = coord
+                        part_titles = outline.item(c, s, i).parts
+                        previous_contents = [journal.get_content((c, s, i, q), part_titles[q]) for q in range(p)]
+                        content_text = generate_part(
+                            c, s, i, p, part_titles[p], part_titles[:p], previous_contents, avoid_passages=to_rewrite[coord], stage="contents-dedup"
+                        )
+                        journal.record_content(coord, part_titles[p], content_text)
+
+                with telemetry.phase("duplicates-rewrite"):
+                    with ThreadPoolExecutor(max_workers=max_workers, initializer=inherit_job_output()) as pool:
+                        for future in [pool.submit(rewrite_item_parts, coords) for coords in by_item.values()]:
+                            future.result()
+
+                    book_events = (
+                        ("part", journal.get_content(item.coord + (p,), part_title))
+                        for item in outline.items()
+                        for p, part_title in enumerate(item.parts)
+                    )
+                    with open(partial_path_md, "w", encoding="utf-8") as f:
+                        chapter_offsets = write_book(f, outline, book_title, book_description, book_events.__next__)
+                    os.replace(partial_path_md, book_path_md)
+                print(f"♻️ Rewrote {len(to_rewrite)} parts that repeated material from earlier parts")
+
+    cache_stats = cache.stats()
+    print(f"💾 Response cache ({cache_stats['mode']}): {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['evictions']} evictions")
+    
+    try:
+        # Chapters are converted separately and cached, so only edited chapters are reconverted
+        with telemetry.phase("export"):
+            export_stats = export_docx(book_path_md, book_path_docx, chapter_offsets, os.path.join(output_dir, ".export_cache", book_title))
+        print(f"📄 Converted to DOCX: {book_path_docx} ({export_stats['converted']} of {export_stats['shards']} shards converted, {export_stats['reused']} reused)")
+    except Exception as e:
+        print(f"❌ Error converting to DOCX: {e}")
+
+    # Machine-readable run report: per-call records plus latency percentiles and token totals per stage
+    report_path = os.path.join(output_dir, f"{book_title}.report.json")
+    report = telemetry.write_report(report_path, cache=cache_stats, rate_limiter=limiter.stats(), routing=router.stats())
+    print(Telemetry.format_table(report))
+    print(f"📊 Run report saved to: {report_path}")
+    return report
+
+    
+if __name__ == "__main__":
+    # Builds src/outline.md into book_output/; see cli.py for building many books at once.
+    run_generate_contents_and_save_book()
@@ -1,140 +1,383 @@
-import os
-from dotenv import load_dotenv
-from openai import OpenAI
-from src.generate_outline import load_outline_from_file, parse_outline, extract_outline_metadata
-from tqdm import tqdm
-import re
-
-load_dotenv()
-
-openai_api_key = os.getenv("OPENAI_API_KEY")
-openai_endpoint = os.getenv("OPENAI_API_ENDPOINT")
-
-if not openai_api_key:
-    raise ValueError("OPENAI_API_KEY environment variable is not set.")
-
-client = OpenAI(
-    api_key=openai_api_key,
-    base_url=openai_endpoint
-)
-
-def generate_parts(title: str, description: str, audience: str, selectedChapter: int, chapters: list[str], selectedSection: int, sections: list[list[str]], selectedItem: int, items: list[list[list[str]]]) -> str:
-    prompt = f"""
-    You are a **textbook learning designer and author**, working on a book titled *"{title}"*.
-
-    ### Book Description
-    {description}
-
-    ### Current Focus
-    We are developing the structure for a subsection of the book:
-
-    - **Chapter {selectedChapter + 1}:** {chapters[selectedChapter]}
-    - **Section {selectedSection + 1}:** {sections[selectedChapter][selectedSection]}
-    - **Subsection {selectedItem + 1}:** {items[selectedChapter][selectedSection][selectedItem]}
-
-    ---
-
-    ### Task
-    Break down this subsection into a **clear, logical sequence of 4–6 parts**. These parts will become major subtopics or conceptual chunks that will later be developed into 1000-word textbook sections.
-
-    Each part should:
-    - Represent a distinct **concept, method, principle, or perspective**.
-    - Be phrased as a **concise, self-contained title** (not a full sentence).
-    - Progress in a **logical educational order** (intro → build-up → variations or use cases → advanced aspect → reflection or summary).
-
-    These parts will serve as learning blocks for: **{audience}**. Structure them to **scaffold knowledge gradually** and avoid overlap.
-
-    ---
-
-    ### Output Format
-    Return the list in plain text, with each part as a bullet point (using a hyphen “-”).
-
-    Example:
-    - Introduction to the Topic
-    - Key Concepts and Terminology
-    - Practical Applications
-    - Advanced Considerations
-    - Summary and Reflection
-
-    ---
-
-    Now generate the list of parts for:
-    **“{items[selectedChapter][selectedSection][selectedItem]}”**
-    """
-
-    
-    response = client.chat.completions.create(
-        model="gpt-4.1-2025-04-14",
-        messages=[
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.7
-    )
-    
-    return response.choices[0].message.content
-
-def parse_parts(raw_parts_text: str) -> list[str]:
-    result = []
-    for line in raw_parts_text.splitlines():
-        match = re.match(r"^-\s*(.*)$", line.strip())
-        if match:
-            result.append(match.group(1).strip())
-    return result
-
-
-def run_generate_parts_for_all(title: str, description: str, audience: str, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]]):
-
-    parts = {}
-    
-    total_parts = 0
-    for chap_idx in range(len(chapters)):
-        for sec_idx in range(len(sections[chap_idx])):
-            total_parts += len(items[chap_idx][sec_idx])
-    
-    with tqdm(total=total_parts, desc="Generating book parts", unit="part") as pbar:
-        for chap_idx, _ in enumerate(chapters):
-            parts[chap_idx] = {}
-            for sec_idx, _ in enumerate(sections[chap_idx]):
-                parts[chap_idx][sec_idx] = {}
-                for item_idx, _ in enumerate(items[chap_idx][sec_idx]):
-                    generated_text = generate_parts(
-                        title=title,
-                        description=description,
-                        audience=audience,
-                        selectedChapter=chap_idx,
-                        chapters=chapters,
-                        selectedSection=sec_idx,
-                        sections=sections,
-                        selectedItem=item_idx,
-                        items=items
-                    )
-                    parsed_list = parse_parts(generated_text)
-                    parts[chap_idx][sec_idx][item_idx] = parsed_list
-                    
-                    pbar.update(1)
-
-    return parts
-
-if __name__ == "__main__":
-    raw_outline = load_outline_from_file("outline.md")
-    metadata = extract_outline_metadata(raw_outline)
-    book_title = metadata["title"]
-    book_description = metadata["description"]
-    audience = metadata["audience"]
-    print("=== RAW OUTLINE ===")
-    print(raw_outline)
-
-    chapters, sections, items = parse_outline(raw_outline)
-
-    all_generated = run_generate_parts_for_all(
-        title=book_title,
-        description=book_description,
-        audience=audience,
-        chapters=chapters,
-        sections=sections,
-        items=items
-    )
-
-    print("\n=== SAMPLE generate_parts OUTPUT ===")
-    sample = all_generated[0][0][0]
+from src.client import get_client
+from src.generate_outline import load_outline_from_file, parse_outline, extract_outline_metadata
+from src.outline import Outline
+from src.cache import ResponseCache
+from src.llm import build_request, chat_completion
+from src.batch import run_cached_batch
+from src.telemetry import Telemetry
+from src.rate_limit import RateLimiter
+from src.routing import ModelRouter
+from src.jobs import inherit_job_output
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+import json
+import re
+import textwrap
+
+def build_parts_messages(title: str, description: str, audience: str, selectedChapter: int, chapters: list[str], selectedSection: int, sections: list[list[str]], selectedItem: int, items: list[list[list[str]]]) -> list[dict]:
+    """
+    Renders the parts request as a book-level system message, identical for every item of
+    the book so the provider can cache it as a shared prefix, followed by a short per-item
+    user message.
+    """
+    system_prompt = textwrap.dedent(f"""
+    You are a **textbook learning designer and author**, working on a book titled *"{title}"*.
+
+    ### Book Description
+    {description}
+
+    ### Task
+    You will be given one subsection of the book. Break it down into a **clear, logical sequence of 4–6 parts**. These parts will become major subtopics or conceptual chunks that will later be developed into 1000-word textbook sections.
+
+    Each part should:
+    - Represent a distinct **concept, method, principle, or perspective**.
+    - Be phrased as a **concise, self-contained title** (not a full sentence).
+    - Progress in a **logical educational order** (intro → build-up → variations or use cases → advanced aspect → reflection or summary).
+
+    These parts will serve as learning blocks for: **{audience}**. Structure them to **scaffold knowledge gradually** and avoid overlap.
+
+    ---
+
+    ### Output Format
+    Return the list in plain text, with each part as a bullet point (using a hyphen “-”).
+
+    Example:
+    - Introduction to the Topic
+    - Key Concepts and Terminology
+    - Practical Applications
+    - Advanced Considerations
+    - Summary and Reflection
+    """).strip()
+
+    user_prompt = textwrap.dedent(f"""
+    ### Current Focus
+    We are developing the structure for a subsection of the book:
+
+    - **Chapter {selectedChapter + 1}:** {chapters[selectedChapter]}
+    - **Section {selectedSection + 1}:** {sections[selectedChapter][selectedSection]}
+    - **Subsection {selectedItem + 1}:** {items[selectedChapter][selectedSection][selectedItem]}
+
+    Now generate the list of parts for:
+    **“{items[selectedChapter][selectedSection][selectedItem]}”**
+    """).strip()
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def generate_parts(title: str, description: str, audience: str, selectedChapter: int, chapters: list[str], selectedSection: int, sections: list[list[str]], selectedItem: int, items: list[list[list[str]]], cache: ResponseCache | None = None, telemetry: Telemetry | None = None, limiter: RateLimiter | None = None, router: ModelRouter | None = None) -> str:
+    messages = build_parts_messages(
+        title=title,
+        description=description,
+        audience=audience,
+        selectedChapter=selectedChapter,
+        chapters=chapters,
+        selectedSection=selectedSection,
+        sections=sections,
+        selectedItem=selectedItem,
+        items=items
+    )
+
+    return chat_completion(
+        get_client(),
+        messages=messages,
+        cache=cache,
+        telemetry=telemetry,
+        stage="parts",
+        coord=(selectedChapter, selectedSection, selectedItem),
+        limiter=limiter,
+        expected_completion_tokens=150,
+        router=router
+    )
+
+PARTS_GROUPINGS = ("item", "section", "chapter")
+# Answers with fewer or more parts than this are treated as malformed and retried per item.
+MIN_PARTS_PER_ITEM = 2
+MAX_PARTS_PER_ITEM = 12
+
+
+def item_id(coord: tuple[int, int, int]) -> str:
+    """1-based "chapter.section.item" label identifying an item in grouped requests."""
+    return ".".join(str(idx + 1) for idx in coord)
+
+
+def parts_group_schema(item_ids: list[str]) -> dict:
+    """Structured-output format for a grouped parts answer; ids are limited to the requested items."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "outline_parts",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "items": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "id": {"type": "string", "enum": item_ids},
+                                "parts": {"type": "array", "items": {"type": "string"}}
+                            },
+                            "required": ["id", "parts"],
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["items"],
+                "additionalProperties": False
+            }
+        }
+    }
+
+def build_grouped_parts_messages(title: str, description: str, audience: str, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], coords: list[tuple[int, int, int]]) -> list[dict]:
+    """
+    Renders one parts request for several items (a section or a chapter): the book preamble
+    is sent once instead of once per item, and the answer is a JSON object per item id.
+    """
+    system_prompt = textwrap.dedent(f"""
+    You are a **textbook learning designer and author**, working on a book titled *"{title}"*.
+
+    ### Book Description
+    {description}
+
+    ### Task
+    You will be given several subsections of the book. Break **each** of them down into a **clear, logical sequence of 4–6 parts**. These parts will become major subtopics or conceptual chunks that will later be developed into 1000-word textbook sections.
+
+    Each part should:
+    - Represent a distinct **concept, method, principle, or perspective**.
+    - Be phrased as a **concise, self-contained title** (not a full sentence).
+    - Progress in a **logical educational order** (intro → build-up → variations or use cases → advanced aspect → reflection or summary).
+
+    These parts will serve as learning blocks for: **{audience}**. Structure them to **scaffold knowledge gradually** and avoid overlap, within each subsection and between neighbouring subsections.
+
+    ---
+
+    ### Output Format
+    Return a JSON object with one entry in `items` per subsection, in the given order: its `id` exactly as given, and its `parts` as a list of part titles.
+    """).strip()
+
+    lines = []
+    current_chapter = current_section = None
+    for chap_idx, sec_idx, item_idx in coords:
+        if chap_idx != current_chapter:
+            lines.append(f"- **Chapter {chap_idx + 1}:** {chapters[chap_idx]}")
+            current_chapter, current_section = chap_idx, None
+        if sec_idx != current_section:
+            lines.append(f"  - **Section {sec_idx + 1}:** {sections[chap_idx][sec_idx]}")
+            current_section = sec_idx
+        lines.append(f"    - Subsection `{item_id((chap_idx, sec_idx, item_idx))}`: {items[chap_idx][sec_idx][item_idx]}")
+
+    user_prompt = "### Current Focus\nWe are developing the structure for these subsections of the book:\n\n" + "\n".join(lines)
+    user_prompt += f"\n\nNow generate the list of parts for each of the {len(coords)} subsections."
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def parse_grouped_parts(raw_json_text: str, expected: dict[str, tuple[int, int, int]]) -> dict[tuple[int, int, int], list[str]]:
+    """
+    Validates a grouped parts answer against the outline: entries for unknown or repeated ids,
+    and part lists that are not a list of MIN_PARTS_PER_ITEM..MAX_PARTS_PER_ITEM titles, are
+    dropped, so the caller can regenerate exactly those items.
+    """
+    try:
+        data = json.loads(raw_json_text)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    entries = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        return {}
+
+    result = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        coord = expected.get(entry.get("id"))
+        part_titles = entry.get("parts")
+        if coord is None or coord in result or not isinstance(part_titles, list):
+            continue
+        part_titles = [title.strip() for title in part_titles if isinstance(title, str) and title.strip()]
+        if MIN_PARTS_PER_ITEM <= len(part_titles) <= MAX_PARTS_PER_ITEM:
+            result[coord] = part_titles
+    return result
+
+def generate_parts_group(title: str, description: str, audience: str, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], coords: list[tuple[int, int, int]], cache: ResponseCache | None = None, telemetry: Telemetry | None = None, limiter: RateLimiter | None = None, router: ModelRouter | None = None) -> dict[tuple[int, int, int], list[str]]:
+    """Generates the part lists of several items in one structured-output request; returns the valid ones."""
+    expected = {item_id(coord): coord for coord in coords}
+    generated_json = chat_completion(
+        get_client(),
+        messages=build_grouped_parts_messages(title, description, audience, chapters, sections, items, coords),
+        cache=cache,
+        telemetry=telemetry,
+        stage="parts",
+        coord=coords[0][:2],
+        limiter=limiter,
+        expected_completion_tokens=80 * len(coords),
+        response_format=parts_group_schema(list(expected)),
+        router=router,
+        max_tokens_scale=len(coords)
+    )
+    return parse_grouped_parts(generated_json, expected)
+
+def group_item_coords(coords: list[tuple[int, int, int]], group_by: str, max_group_items: int) -> list[list[tuple[int, int, int]]]:
+    """Splits item coordinates into per-section or per-chapter groups of at most `max_group_items`."""
+    groups = {}
+    for coord in coords:
+        groups.setdefault(coord[:1] if group_by == "chapter" else coord[:2], []).append(coord)
+    return [
+        group[start:start + max_group_items]
+        for group in groups.values()
+        for start in range(0, len(group), max_group_items)
+    ]
+
+def parse_parts(raw_parts_text: str) -> list[str]:
+    result = []
+    for line in raw_parts_text.splitlines():
+        match = re.match(r"^-\s*(.*)$", line.strip())
+        if match:
+            result.append(match.group(1).strip())
+    return result
+
+
+def run_generate_parts_for_all(title: str, description: str, audience: str, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], max_workers: int = 1, cache: ResponseCache | None = None, telemetry: Telemetry | None = None, limiter: RateLimiter | None = None, router: ModelRouter | None = None, completed: dict | None = None, on_complete: Callable[[tuple[int, int, int], list[str]], None] | None = None, group_by: str = "item", max_group_items: int = 30):
+    """
+    Generates the part list of every item.
+    With max_workers > 1 the requests run concurrently in a thread pool;
+    the returned parts[chap][sec][item] dict is always built in outline order.
+    Items found in `completed` (keyed by (chap, sec, item)) are reused without an API call,
+    and `on_complete` is called with every newly generated part list.
+    With group_by="section" or "chapter" the items of a section or chapter (at most
+    `max_group_items` at a time) are asked for in one structured-output request; only items
+    missing or malformed in those answers are then generated one by one.
+    """
+    from tqdm import tqdm  # deferred: only a run needs it
+
+    if group_by not in PARTS_GROUPINGS:
+        raise ValueError(f"Unknown parts grouping {group_by!r}, expected one of {PARTS_GROUPINGS}.")
+
+    outline = Outline.from_lists(chapters, sections, items)
+    coords = []
+    for item in outline.items():
+        if completed and item.coord in completed:
+            item.parts = completed[item.coord]
+        else:
+            coords.append(item.coord)
+
+    def generate_item_parts(chap_idx: int, sec_idx: int, item_idx: int) -> list[str]:
+        generated_text = generate_parts(
+            title=title,
+            description=description,
+            audience=audience,
+            selectedChapter=chap_idx,
+            chapters=chapters,
+            selectedSection=sec_idx,
+            sections=sections,
+            selectedItem=item_idx,
+            items=items,
+            cache=cache,
+            telemetry=telemetry,
+            limiter=limiter,
+            router=router
+        )
+        return parse_parts(generated_text)
+
+    def store(coord: tuple[int, int, int], parsed_list: list[str]):
+        outline.item(*coord).parts = parsed_list
+        if on_complete:
+            on_complete(coord, parsed_list)
+
+    def generate_group_parts(group: list[tuple[int, int, int]]) -> dict[tuple[int, int, int], list[str]]:
+        return generate_parts_group(title, description, audience, chapters, sections, items, group, cache=cache, telemetry=telemetry, limiter=limiter, router=router)
+
+    def run_all(task: Callable, jobs: list, on_result: Callable) -> None:
+        if max_workers <= 1:
+            for job in jobs:
+                on_result(job, task(job))
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers, initializer=inherit_job_output()) as executor:
+                futures = {executor.submit(task, job): job for job in jobs}
+                for future in as_completed(futures):
+                    # Results land on the outline's item nodes, so completion
+                    # order never leaks into the returned dict.
+                    on_result(futures[future], future.result())
+
+    reused = len(outline) - len(coords)
+    with tqdm(total=reused + len(coords), initial=reused, desc="Generating book parts", unit="part") as pbar:
+        if group_by != "item" and coords:
+            def store_group(group, group_parts):
+                for coord, parsed_list in group_parts.items():
+                    store(coord, parsed_list)
+                pbar.update(len(group_parts))
+
+            run_all(generate_group_parts, group_item_coords(coords, group_by, max_group_items), store_group)
+            coords = [coord for coord in coords if outline.item(*coord).parts is None]
+            if coords:
+                print(f"⚠️ {len(coords)} items missing or malformed in the grouped answers; generating them one by one")
+
+        def store_item(coord, parsed_list):
+            store(coord, parsed_list)
+            pbar.update(1)
+
+        run_all(lambda coord: generate_item_parts(*coord), coords, store_item)
+
+    return outline.parts_tree()
+
+def batch_generate_parts_for_all(title: str, description: str, audience: str, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], backend, workdir: str, cache: ResponseCache | None = None, telemetry: Telemetry | None = None, router: ModelRouter | None = None, completed: dict | None = None, on_complete: Callable[[tuple[int, int, int], list[str]], None] | None = None, poll_interval: float = 30.0) -> int:
+    """
+    Submits the parts request of every item not in `completed` as one Batch API job and
+    passes each returned part list to `on_complete`. Returns the number of items the batch
+    did not produce; run_generate_parts_for_all picks those up online afterwards.
+    """
+    requests = {}
+    coords = {}
+    request_options = router.request_options("parts") if router is not None else {}
+    for item in Outline.from_lists(chapters, sections, items).items():
+        if completed and item.coord in completed:
+            continue
+        chap_idx, sec_idx, item_idx = item.coord
+        custom_id = f"parts-{chap_idx}-{sec_idx}-{item_idx}"
+        requests[custom_id] = build_request(build_parts_messages(
+            title=title,
+            description=description,
+            audience=audience,
+            selectedChapter=chap_idx,
+            chapters=chapters,
+            selectedSection=sec_idx,
+            sections=sections,
+            selectedItem=item_idx,
+            items=items
+        ), **request_options)
+        coords[custom_id] = item.coord
+
+    results = run_cached_batch(backend, requests, coords, "parts", workdir, "parts", cache=cache, telemetry=telemetry, poll_interval=poll_interval, on_status=print)
+    for custom_id, generated_text in results.items():
+        if on_complete:
+            on_complete(coords[custom_id], parse_parts(generated_text))
+    return len(requests) - len(results)
+
+if __name__ == "__main__":
+    raw_outline = load_outline_from_file("outline.md")
+    metadata = extract_outline_metadata(raw_outline)
+    book_title = metadata["title"]
+    book_description = metadata["description"]
+    audience = metadata["audience"]
+    print("=== RAW OUTLINE ===")
+    print(raw_outline)
+
+    chapters, sections, items = parse_outline(raw_outline)
+
+    all_generated = run_generate_parts_for_all(
+        title=book_title,
+        description=book_description,
+        audience=audience,
+        chapters=chapters,
+        sections=sections,
+        items=items
+    )
+
+    print("\n=== SAMPLE generate_parts OUTPUT ===")
+    sample = all_generated[0][0][0]
     print(f"Chapter 1, Section 1, Item 1 →\n{sample}")
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Request hedging: a call that is slower than most recent calls of its stage gets a second copy
+of its request, and whichever copy completes first is kept while the other is closed.
+
+Only the slowest few percent of calls are hedged, and the loser is dropped as soon as the
+winner completes, so the tail shrinks for a few percent more tokens.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, TypeVar
+
+from src.rate_limit import CallTimeout
+from src.telemetry import percentile
+
+T = TypeVar("T")
+
+# At most one hedge per ten calls of a stage, so a slow provider does not double the load
+MAX_HEDGE_RATIO = 0.1
+# Calls observed before the percentile is trusted
+MIN_SAMPLES = 20
+
+
+class AttemptCancelled(Exception):
+    """Raised inside an attempt that lost the race, or that is still running when the call ends."""
+
+
+class StreamProgress:
+    """Shared by the attempts of a call, which tick() it as each piece of their response arrives."""
+
+    def __init__(self):
+        self.last: float | None = None
+
+    def tick(self) -> None:
+        self.last = time.monotonic()
+
+    def started(self) -> bool:
+        return self.last is not None
+
+
+class LatencyTracker:
+    """Total latencies of the last `window` calls of a stage, and the hedges sent for its calls."""
+
+    def __init__(self, window: int = 200, min_samples: int = MIN_SAMPLES, max_hedge_ratio: float = MAX_HEDGE_RATIO):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def observe(self, latency_s: float) -> None:
+        with self._lock:
+            self.latencies.append(latency_s)
+            self.calls += 1
+
+    def hedge_after(self, q: float) -> float | None:
+        """The q-th percentile of recent latencies, or None while there are too few of them."""
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            return percentile(list(self.latencies), q)
+
+    def try_hedge(self) -> bool:
+        """Counts a hedge when the budget allows one more."""
+        with self._lock:
+            if self.hedges >= self.max_hedge_ratio * max(self.calls, self.min_samples):
+                return False
+            self.hedges += 1
+            return True
+
+    def record_hedge_won(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def stats(self, q: float | None = None) -> dict:
+        stats = {"calls": self.calls, "hedges": self.hedges, "hedge_wins": self.hedge_wins, "timeouts": self.timeouts}
+        if q is not None:
+            stats["hedge_after_s"] = self.hedge_after(q)
+        return stats
+
+
+def hedged_call(attempt: Callable[[threading.Event, StreamProgress], T], hedge_after: float | None = None, timeout: float | None = None, start_hedge: Callable[[], bool] | None = None, first_token_timeout: float | None = None) -> tuple[T, bool, bool]:
+    """
+    Runs `attempt(cancelled, progress)` in a thread and returns (its result, whether a hedge
+    was sent, whether the hedge won).
+
+    When no attempt has completed `hedge_after` seconds in, and `start_hedge()` (when given)
+    allows it, a second attempt runs alongside the first. The first attempt to return wins;
+    `cancelled` is set as the call returns, and the other attempt should then stop by raising
+    AttemptCancelled. An attempt ticks `progress` as each piece of its response arrives.
+    Raises CallTimeout when nothing has arrived after `first_token_timeout` seconds, or when
+    there is no result after `timeout` seconds. Once a response is arriving, `timeout` is
+    counted from its latest piece instead, so a long answer that keeps streaming is not cut off.
+    """
+    results = queue.Queue()
+    cancelled = threading.Event()
+    progress = StreamProgress()
+
+    def run(index: int) -> None:
+        try:
+            results.put((index, attempt(cancelled, progress), None))
+        except BaseException as e:
+            results.put((index, None, e))
+
+    def start(index: int) -> None:
+        threading.Thread(target=run, args=(index,), daemon=True).start()
+
+    started = time.monotonic()
+    start(0)
+    running = 1
+    hedge_considered = hedge_after is None
+    hedged = False
+    try:
+        while True:
+            deadlines = []
+            last = progress.last
+            if timeout is not None:
+                deadlines.append((started if last is None else last) + timeout)
+            if not hedge_considered:
+                deadlines.append(started + hedge_after)
+            if first_token_timeout is not None and last is None:
+                deadlines.append(started + first_token_timeout)
+            wait = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                index, result, error = results.get(timeout=wait)
+            except queue.Empty:
+                now = time.monotonic()
+                elapsed = now - started
+                last = progress.last
+                if timeout is not None and last is None and elapsed >= timeout:
+                    raise CallTimeout(f"no response within {timeout:g}s") from None
+                if timeout is not None and last is not None and now - last >= timeout:
+                    raise CallTimeout(f"stream stalled for {timeout:g}s") from None
+                if first_token_timeout is not None and elapsed >= first_token_timeout and last is None:
+                    raise CallTimeout(f"no first token within {first_token_timeout:g}s") from None
+                if hedge_considered or elapsed < hedge_after:
+                    continue
+                hedge_considered = True
+                if start_hedge is None or start_hedge():
+                    hedged = True
+                    start(1)
+                    running += 1
+                continue
+            running -= 1
+            if error is None:
+                return result, hedged, index == 1
+            # A failed attempt leaves the race to the other one while it still runs
+            if running:
+                continue
+            raise error
+    finally:
+        cancelled.set()
@@ -0,0 +1,123 @@
+import difflib
+
+from src.outline import Outline
+
+# Titles at least this similar count as the same node with a cosmetic edit (typo fix, casing).
+DEFAULT_SIMILARITY = 0.8
+
+
+def similar(a: str, b: str, threshold: float = DEFAULT_SIMILARITY) -> bool:
+    matcher = difflib.SequenceMatcher(None, a.lower(), b.lower())
+    # The quick upper bounds rule out most unrelated titles before the full comparison.
+    return matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold
+
+
+def _align(old_nodes: list, new_nodes: list, threshold: float) -> list[tuple[object, object, bool]]:
+    """
+    Pairs up the children of two matched parents in order: nodes with the same identity first,
+    then, within each replaced run, nodes at the same offset whose titles are similar. Returns
+    (old, new, renamed) triples.
+
+    Under matched parents a node's identity is its own part of the stable node ID (its title and
+    occurrence), so a cosmetic rename of a chapter does not unmatch everything below it.
+    """
+    matcher = difflib.SequenceMatcher(None, [(node.title, node.occurrence) for node in old_nodes], [(node.title, node.occurrence) for node in new_nodes], autojunk=False)
+    pairs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            pairs.extend((old_nodes[i1 + k], new_nodes[j1 + k], False) for k in range(i2 - i1))
+        elif tag == "replace":
+            for k in range(min(i2 - i1, j2 - j1)):
+                if similar(old_nodes[i1 + k].title, new_nodes[j1 + k].title, threshold):
+                    pairs.append((old_nodes[i1 + k], new_nodes[j1 + k], True))
+    return pairs
+
+
+class OutlineDiff:
+    """
+    Which items of the current outline are the same as an item of the previous build's outline.
+
+    `item_map` maps current (c, s, i) coordinates to the previous ones. Items whose title or
+    whose chapter or section title changed only cosmetically are in `renamed`, items found
+    under another section in `moved`; `added` and `removed` are what is left on either side.
+    """
+
+    __slots__ = ("item_map", "renamed", "moved", "added", "removed", "metadata_changed")
+
+    def __init__(self):
+        self.item_map: dict[tuple[int, int, int], tuple[int, int, int]] = {}
+        self.renamed: list[tuple[int, int, int]] = []
+        self.moved: list[tuple[int, int, int]] = []
+        self.added: list[tuple[int, int, int]] = []
+        self.removed: list[tuple[int, int, int]] = []
+        self.metadata_changed = False
+
+    def summary(self) -> str:
+        if self.metadata_changed:
+            return "book title, description or audience changed: nothing can be reused"
+        return (
+            f"{len(self.item_map)} items reused ({len(self.renamed)} renamed, {len(self.moved)} moved), "
+            f"{len(self.added)} new, {len(self.removed)} removed"
+        )
+
+
+def diff_outlines(previous: Outline, current: Outline, similarity: float = DEFAULT_SIMILARITY) -> OutlineDiff:
+    """
+    Matches the items of `current` to those of `previous`, chapter by chapter and section by
+    section, by node identity and, failing that, by cosmetic title similarity. Items still
+    unmatched are then matched by exact title anywhere in the book (moved items).
+
+    The book title, description and audience are part of every prompt, so when the
+    description or audience changed, or the title beyond a cosmetic edit, nothing matches.
+    """
+    diff = OutlineDiff()
+    if previous.description != current.description or previous.audience != current.audience or not similar(previous.title, current.title, similarity):
+        diff.metadata_changed = True
+        diff.added = current.item_coords()
+        diff.removed = previous.item_coords()
+        return diff
+
+    for old_chapter, new_chapter, chapter_renamed in _align(previous.chapters, current.chapters, similarity):
+        for old_section, new_section, section_renamed in _align(old_chapter.sections, new_chapter.sections, similarity):
+            for old_item, new_item, item_renamed in _align(old_section.items, new_section.items, similarity):
+                diff.item_map[new_item.coord] = old_item.coord
+                if chapter_renamed or section_renamed or item_renamed:
+                    diff.renamed.append(new_item.coord)
+
+    matched_old = set(diff.item_map.values())
+    unmatched_old = {}
+    for item in previous.items():
+        if item.coord not in matched_old:
+            unmatched_old.setdefault(item.title, []).append(item.coord)
+
+    for item in current.items():
+        if item.coord in diff.item_map:
+            continue
+        candidates = unmatched_old.get(item.title)
+        if candidates:
+            diff.item_map[item.coord] = candidates.pop(0)
+            diff.moved.append(item.coord)
+        else:
+            diff.added.append(item.coord)
+
+    diff.removed = [coord for coords in unmatched_old.values() for coord in coords]
+    return diff
+
+
+def carry_forward(diff: OutlineDiff, parts: dict, contents: dict) -> tuple[dict, dict]:
+    """
+    Re-keys the previous build's part lists (by (c, s, i)) and part bodies (by (c, s, i, p))
+    to the current outline's coordinates, keeping only those of matched items.
+    """
+    carried_parts = {}
+    carried_contents = {}
+    for new_coord, old_coord in diff.item_map.items():
+        part_titles = parts.get(old_coord)
+        if part_titles is None:
+            continue
+        carried_parts[new_coord] = part_titles
+        for p, part_title in enumerate(part_titles):
+            entry = contents.get(old_coord + (p,))
+            if entry is not None and entry[0] == part_title:
+                carried_contents[new_coord + (p,)] = entry
+    return carried_parts, carried_contents
@@ -0,0 +1,248 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from src.outline import parse_outline_lines
+from src.rate_limit import RateLimiter
+from src.telemetry import Telemetry
+
+LOG_CHARS = 20000  # tail of the printed output kept per job
+
+
+class BookBusyError(RuntimeError):
+    """Raised by JobManager.submit while another job is queued or running for the same book."""
+
+
+class JobArea:
+    """
+    Stand-in for the Streamlit elements run_generate_contents_and_save_book writes to:
+    `markdown` stores the text in one field of the job, which the page then polls.
+    """
+
+    def __init__(self, manager: "JobManager", job_id: str, field: str):
+        self.manager = manager
+        self.job_id = job_id
+        self.field = field
+
+    def markdown(self, text: str) -> None:
+        self.manager._update(self.job_id, **{self.field: text})
+
+    def empty(self) -> "JobArea":
+        return JobArea(self.manager, self.job_id, "live_text")
+
+
+class _JobOutput:
+    """
+    sys.stdout wrapper that also appends what a job's thread prints to that job's log. Worker
+    pools started by a job pass the log on to their threads with inherit_job_output().
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        target = getattr(self.local, "target", None)
+        if target is not None:
+            target(text)
+        return self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def inherit_job_output() -> Callable[[], None]:
+    """
+    An initializer for a worker pool created while a job runs, e.g.
+    `ThreadPoolExecutor(initializer=inherit_job_output())`: what the pool's threads print
+    then goes to the log of that job too. Outside a job it does nothing.
+    """
+    output = sys.stdout if isinstance(sys.stdout, _JobOutput) else None
+    target = getattr(output.local, "target", None) if output is not None else None
+
+    def initializer() -> None:
+        if target is not None:
+            output.local.target = target
+
+    return initializer
+
+
+class JobManager:
+    """
+    Runs book generations in the background, at most `max_jobs` at a time. A job is
+    "queued", "running", "done" or "failed".
+
+    Every job has an ID and a state file `<root>/<id>.json` (status, timestamps, options,
+    latest progress line, the part being written and the tail of its printed output), so
+    the state survives page reloads and server restarts. The outline and supporting text are
+    copied next to it when the job is submitted. Jobs still queued or running when the
+    server stopped are queued again on start, resuming from their book journal.
+
+    Two jobs for the same book (title and output directory) would write to the same partial
+    file and journal, so a second one is refused while the first is queued or running.
+
+    All jobs share one RateLimiter, which caps concurrent API requests across books
+    (BOOK_MAX_CONCURRENCY, `max_concurrency` by default) and the RPM/TPM budget.
+    """
+
+    def __init__(self, root: str = "jobs", max_jobs: int = 2, max_concurrency: int = 8, runner: Callable | None = None, save_interval: float = 1.0):
+        self.root = root
+        self.limiter = RateLimiter.from_env(max_concurrency=max_concurrency)
+        self.save_interval = save_interval
+        self._runner = runner
+        self._jobs: dict[str, dict] = {}
+        self._support_indexes = {}
+        self._saved_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="book-job")
+
+        if not isinstance(sys.stdout, _JobOutput):
+            sys.stdout = _JobOutput(sys.stdout)
+        self._output = sys.stdout
+
+        os.makedirs(root, exist_ok=True)
+        self._recover()
+
+    @classmethod
+    def from_env(cls, root: str = "jobs") -> "JobManager":
+        return cls(root, max_jobs=int(os.getenv("BOOK_MAX_JOBS", "2")))
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def _save(self, job_id: str, force: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._saved_at.get(job_id, 0.0) < self.save_interval:
+                return
+            self._saved_at[job_id] = now
+            data = json.dumps(self._jobs[job_id], ensure_ascii=False)
+        tmp_path = f"{self._path(job_id)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(job_id))
+
+    def _update(self, job_id: str, force: bool = False, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+        self._save(job_id, force)
+
+    def _log(self, job_id: str, text: str) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job["log"] = (job["log"] + text)[-LOG_CHARS:]
+        self._save(job_id)
+
+    def _recover(self) -> None:
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.root, name), "r", encoding="utf-8") as f:
+                    job = json.load(f)
+            except ValueError:
+                continue
+            self._jobs[job["id"]] = job
+            if job["status"] in ("queued", "running"):
+                # Interrupted by a restart: run it again, skipping what its journal already holds.
+                job["options"]["resume"] = True
+                self._update(job["id"], force=True, status="queued", restarts=job.get("restarts", 0) + 1)
+                self._executor.submit(self._run, job["id"])
+
+    def _active_job(self, book: list[str]) -> dict | None:
+        # Called with the lock held
+        return next((job for job in self._jobs.values() if job.get("book") == book and job["status"] in ("queued", "running")), None)
+
+    def active_job(self, output_dir: str, title: str) -> dict | None:
+        """The queued or running job that writes the book `title` to `output_dir`, if any."""
+        with self._lock:
+            job = self._active_job([os.path.abspath(output_dir), title])
+            return dict(job) if job is not None else None
+
+    def submit(self, outline_text: str, extra_context: str = "", support_index=None, **options) -> str:
+        """
+        Queues a run_generate_contents_and_save_book call for an outline and returns its job
+        ID. The outline is written to the job's own file, so concurrent submissions from
+        several sessions never share one. `options`
+        are its keyword arguments and must be JSON-serialisable; `support_index` is only kept
+        in memory (after a restart it is rebuilt from the supporting text). Raises
+        BookBusyError while another job for the same book is queued or running.
+        """
+        title = parse_outline_lines(outline_text.splitlines(), metadata_only=True).title
+        book = [os.path.abspath(options.get("output_dir", "book_output")), title]
+
+        job_id = uuid.uuid4().hex[:12]
+        job_outline_path = os.path.join(self.root, f"{job_id}.outline.md")
+        context_path = os.path.join(self.root, f"{job_id}.context.txt") if extra_context else None
+        job = {
+            "id": job_id, "status": "queued", "created": time.time(), "started": None, "finished": None,
+            "options": options, "book": book, "outline_path": job_outline_path, "context_path": context_path, "restarts": 0,
+            "progress": "", "live_title": "", "live_text": "", "log": "", "summary": None, "error": None,
+        }
+        # Checked and registered in one step, so two sessions cannot both start the same book
+        with self._lock:
+            active = self._active_job(book)
+            if active is not None:
+                raise BookBusyError(f"Job {active['id']} is already {active['status']} for \"{title}\" in {book[0]}.")
+            self._jobs[job_id] = job
+            self._support_indexes[job_id] = support_index
+
+        with open(job_outline_path, "w", encoding="utf-8", newline="") as f:
+            f.write(outline_text)
+        if context_path:
+            with open(context_path, "w", encoding="utf-8") as f:
+                f.write(extra_context)
+        self._save(job_id, force=True)
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def _run(self, job_id: str) -> None:
+        job = self.get(job_id)
+        self._update(job_id, force=True, status="running", started=time.time())
+        self._output.local.target = lambda text: self._log(job_id, text)
+        try:
+            runner = self._runner
+            if runner is None:
+                from src.generate_contents import run_generate_contents_and_save_book as runner
+            extra_context = ""
+            if job["context_path"]:
+                with open(job["context_path"], "r", encoding="utf-8") as f:
+                    extra_context = f.read()
+
+            report = runner(
+                outline_path=job["outline_path"],
+                status_area=JobArea(self, job_id, "progress"),
+                live_output_area=JobArea(self, job_id, "live_title"),
+                extra_context=extra_context,
+                support_index=self._support_indexes.pop(job_id, None),
+                limiter=self.limiter,
+                **job["options"]
+            )
+            if report is None:
+                raise RuntimeError("The outline could not be read.")
+            self._update(job_id, force=True, status="done", finished=time.time(), summary=Telemetry.format_table(report))
+        except Exception as e:
+            self._update(job_id, force=True, status="failed", finished=time.time(), error=str(e))
+        finally:
+            self._output.local.target = None
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def jobs(self) -> list[dict]:
+        """All known jobs, newest first."""
+        with self._lock:
+            return sorted((dict(job) for job in self._jobs.values()), key=lambda job: job["created"], reverse=True)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def outline_fingerprint(title: str, description: str, audience: str, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]]) -> str:
+    """Hashes everything the journaled coordinates and prompts depend on."""
+    payload = json.dumps([title, description, audience, chapters, sections, items], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _read_records(path: str):
+    """Yields (record, end offset) for every intact line; a crash can leave a truncated last line."""
+    offset = 0
+    with open(path, "rb") as f:
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                return
+            try:
+                record = json.loads(raw_line)
+            except ValueError:
+                return
+            offset += len(raw_line)
+            yield record, offset
+
+
+def read_journal(path: str) -> tuple[dict | None, dict, dict]:
+    """Reads a journal without changing it: its header record, part lists and part bodies."""
+    header, parts, contents = None, {}, {}
+    for record, _ in _read_records(path):
+        if record["type"] == "header":
+            header = record
+        elif record["type"] == "parts":
+            parts[tuple(record["coord"])] = record["parts"]
+        elif record["type"] == "content":
+            contents[tuple(record["coord"])] = (record["title"], record["text"])
+    return header, parts, contents
+
+
+def _header_fingerprint(path: str) -> str | None:
+    """The fingerprint in a journal's header, or None when there is no readable journal at `path`."""
+    if not os.path.exists(path):
+        return None
+    for record, _ in _read_records(path):
+        return record.get("fingerprint") if record["type"] == "header" else None
+    return None
+
+
+def _set_aside_path(path: str, fingerprint: str) -> str:
+    """Where the journal at `path` is kept while a run for another outline uses `path`."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{fingerprint[:12]}{ext}"
+
+
+def latest_journal(directory: str) -> str | None:
+    """The most recently written journal in `directory`, if any."""
+    if not os.path.isdir(directory):
+        return None
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".journal.jsonl")]
+    return max(paths, key=os.path.getmtime, default=None)
+
+
+class BookJournal:
+    """
+    Append-only, fsync'd JSONL journal of the work completed for one book.
+
+    Every generated part list and part body is written as one line and flushed to disk
+    before the call returns, so a crash loses at most the request that was in flight.
+    A journal only applies to the outline it was started for. A journal at `path` that was
+    started for another outline (e.g. a preview of the same book) is never overwritten: it is
+    set aside under its fingerprint, and a resumed run takes back the one set aside for its own
+    outline, if any.
+    The header also keeps `snapshot` (the outline it was started for), which incremental
+    builds diff the next outline against.
+    """
+
+    def __init__(self, path: str, fingerprint: str, resume: bool = False, snapshot: dict | None = None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.parts = {}     # (chap, sec, item) -> list of part titles
+        self.contents = {}  # (chap, sec, item, part) -> (part title, text)
+        self._lock = threading.Lock()
+
+        existing = _header_fingerprint(path)
+        if existing is not None and existing != fingerprint:
+            os.replace(path, _set_aside_path(path, existing))
+            existing = None
+        if existing is None and resume and os.path.exists(_set_aside_path(path, fingerprint)):
+            os.replace(_set_aside_path(path, fingerprint), path)
+
+        if not (resume and self._load()):
+            self.parts.clear()
+            self.contents.clear()
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                header = {"type": "header", "fingerprint": fingerprint}
+                if snapshot is not None:
+                    header["outline"] = snapshot
+                f.write(json.dumps(header, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+
+        good_offset = 0
+        for record, good_offset in _read_records(self.path):
+            if record["type"] == "header":
+                if record["fingerprint"] != self.fingerprint:
+                    return False
+            elif record["type"] == "parts":
+                self.parts[tuple(record["coord"])] = record["parts"]
+            elif record["type"] == "content":
+                self.contents[tuple(record["coord"])] = (record["title"], record["text"])
+
+        if good_offset == 0:
+            return False
+        with open(self.path, "r+b") as f:
+            f.truncate(good_offset)
+        return True
+
+    def _append(self, *records: dict) -> None:
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def record_parts(self, coord: tuple[int, int, int], parts: list[str]) -> None:
+        self._append({"type": "parts", "coord": list(coord), "parts": parts})
+        self.parts[coord] = parts
+
+    def record_content(self, coord: tuple[int, int, int, int], part_title: str, text: str) -> None:
+        self._append({"type": "content", "coord": list(coord), "title": part_title, "text": text})
+        self.contents[coord] = (part_title, text)
+
+    def carry_over(self, parts: dict, contents: dict) -> None:
+        """Records part lists and bodies reused from a previous build, with a single fsync."""
+        self._append(
+            *({"type": "parts", "coord": list(coord), "parts": part_titles} for coord, part_titles in parts.items()),
+            *({"type": "content", "coord": list(coord), "title": title, "text": text} for coord, (title, text) in contents.items())
+        )
+        self.parts.update(parts)
+        self.contents.update(contents)
+
+    def get_content(self, coord: tuple[int, int, int, int], part_title: str) -> str | None:
+        """Returns the journaled body of a part, provided it was written for the same part title."""
+        entry = self.contents.get(coord)
+        if entry is None or entry[0] != part_title:
+            return None
+        return entry[1]
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "BookJournal":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
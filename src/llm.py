@@ -0,0 +1,224 @@
+import time
+from contextlib import nullcontext
+from typing import Callable
+from src.cache import ResponseCache
+from src.hedging import AttemptCancelled, hedged_call
+from src.telemetry import CallRecord, Telemetry
+from src.rate_limit import CallTimeout, RateLimiter, is_rate_limited, is_timeout
+from src.routing import DEFAULT_TEMPERATURE, DEFAULT_TIER, MODEL_TIERS, ModelRouter, price_usd
+
+DEFAULT_MODEL = MODEL_TIERS[DEFAULT_TIER]
+
+
+class _UseFallback(Exception):
+    """Raised inside a primary attempt that should move to the fallback model; never retried."""
+
+
+def _usage_tokens(usage) -> tuple[int, int, int]:
+    """Returns (prompt, completion, cached prompt) tokens; the last come from the provider's prompt cache."""
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_prompt_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached_prompt_tokens
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """Rough prompt size (~4 characters per token), good enough for rate budgeting."""
+    return sum(len(message["content"]) for message in messages) // 4 + 4 * len(messages)
+
+
+def build_request(messages: list[dict], model: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE, response_format: dict | None = None, max_tokens: int | None = None) -> dict:
+    """The request body sent to the API; also what the response cache and batch files are keyed on."""
+    request = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens is not None:
+        request["max_tokens"] = max_tokens
+    if response_format is not None:
+        request["response_format"] = response_format
+    return request
+
+
+def chat_completion(client, messages: list[dict], model: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATURE, cache: ResponseCache | None = None, on_token: Callable[[str], None] | None = None, telemetry: Telemetry | None = None, stage: str = "", coord: tuple[int, ...] | None = None, limiter: RateLimiter | None = None, expected_completion_tokens: int = 1000, response_format: dict | None = None, router: ModelRouter | None = None, max_tokens_scale: int = 1) -> str:
+    """
+    Sends a chat completion request and returns the text of the first choice.
+    Identical requests are answered from `cache` when one is given.
+    With `on_token` the response is streamed and every text delta is passed to it as it arrives;
+    cached responses are not replayed through it.
+    Requests go through `limiter`, which budgets them and retries transient failures.
+    Every call is recorded in `telemetry` under `stage` and the outline `coord` it belongs to.
+    `response_format` (e.g. a JSON schema) is passed through to the API unchanged.
+    With `router`, the stage's route replaces `model` and `temperature`, sets `max_tokens`
+    (times `max_tokens_scale`, for requests that answer for several items), caps the stage's
+    requests in flight and may move a throttled or slow request to a fallback model, hedge a
+    request that runs longer than most, or give up on one after the stage's hard timeout.
+    """
+    route = router.route(stage) if router is not None else None
+    tier = route.tier if route is not None else ""
+    if route is not None:
+        request = build_request(messages, response_format=response_format, **router.request_options(stage, max_tokens_scale))
+    else:
+        request = build_request(messages, model, temperature, response_format)
+    model = request["model"]
+    started = time.perf_counter()
+
+    key = None
+    if cache is not None:
+        key = cache.make_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            if telemetry:
+                prompt_tokens, completion_tokens = cached.get("usage", (0, 0))[:2]
+                telemetry.record(CallRecord(
+                    stage=stage, latency_s=time.perf_counter() - started, cached=True, model=model, tier=tier,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, coord=coord
+                ))
+            return cached["content"]
+
+    ttft = None
+    chunks = []
+    tracker = router.latency_tracker(stage) if router is not None else None
+    hedged = hedge_won = False
+    timeouts = 0
+
+    def send(request: dict):
+        nonlocal ttft
+        if on_token is None:
+            response = client.chat.completions.create(**request)
+            return response.choices[0].message.content, response.usage
+
+        usage = None
+        for chunk in client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True}):
+            # With include_usage the final chunk carries the usage and no choices.
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                chunks.append(delta)
+                on_token(delta)
+        return "".join(chunks), usage
+
+    def send_watched(request: dict, first_token_timeout: float | None = None):
+        """
+        Like send, but streamed and watched: raced against a duplicate when slow, given up when
+        the stage's timeout passes without new text and, with `first_token_timeout`, when no
+        text arrives in time.
+        """
+        nonlocal ttft, hedged, hedge_won, timeouts
+        options = {} if route.timeout_s is None else {"timeout": route.timeout_s}
+        hedge_after = router.hedge_after(stage) if tracker is not None else None
+        # Either copy of a hedged request may win, so its text is passed on only once the winner
+        # has completed; without a hedge it streams through as it arrives
+        live = on_token is not None and hedge_after is None
+
+        def attempt(cancelled, progress):
+            # Always streamed, so the first token can be timed and a losing copy closed early
+            stream = client.chat.completions.create(**request, **options, stream=True, stream_options={"include_usage": True})
+            usage = None
+            parts = []
+            first_token_s = None
+            try:
+                for chunk in stream:
+                    if cancelled.is_set():
+                        raise AttemptCancelled()
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if first_token_s is None:
+                        first_token_s = time.perf_counter() - started
+                    progress.tick()
+                    parts.append(delta)
+                    if live:
+                        chunks.append(delta)
+                        on_token(delta)
+            finally:
+                stream.close()
+            return "".join(parts), usage, first_token_s
+
+        def start_hedge() -> bool:
+            if not tracker.try_hedge():
+                return False
+            if limiter is not None:
+                limiter.reserve(estimated_tokens)
+            return True
+
+        attempt_started = time.perf_counter()
+        try:
+            (content, usage, ttft), was_hedged, won = hedged_call(attempt, hedge_after, route.timeout_s, start_hedge, first_token_timeout)
+        except CallTimeout:
+            timeouts += 1
+            if tracker is not None:
+                tracker.record_timeout()
+            raise
+        if tracker is not None:
+            tracker.observe(time.perf_counter() - attempt_started)
+        hedged = hedged or was_hedged
+        if won:
+            hedge_won = True
+            tracker.record_hedge_won()
+        if on_token is not None and not live and content:
+            chunks.append(content)
+            on_token(content)
+        return content, usage
+
+    def send_once(request: dict, first_token_timeout: float | None = None):
+        if tracker is None and first_token_timeout is None:
+            return send(request)
+        return send_watched(request, first_token_timeout)
+
+    def call(request: dict) -> tuple[tuple[str, object], int]:
+        if limiter is None:
+            return send_once(request), 1
+        # Tokens already handed to on_token cannot be taken back, so a stream is only
+        # retried when it failed before producing any text.
+        return limiter.call(lambda: send_once(request), estimated_tokens=estimated_tokens, retry_if=lambda: not chunks)
+
+    def send_or_fall_back(request: dict) -> tuple[str, object]:
+        # `fallback_after_s` is a time-to-first-token budget for the primary model
+        try:
+            return send_once(request, route.fallback_after_s)
+        except Exception as e:
+            if not chunks and (is_rate_limited(e) or is_timeout(e)):
+                if limiter is not None and is_rate_limited(e):
+                    # The limiter never sees this error, yet the provider still asks to slow down
+                    limiter.record_throttled(e)
+                raise _UseFallback() from e
+            raise
+
+    estimated_tokens = estimate_tokens(messages) + expected_completion_tokens
+    fallback = False
+    with router.slot(stage) if router is not None else nullcontext():
+        if route is None or route.fallback_model is None:
+            (content, usage), attempts = call(request)
+        else:
+            try:
+                if limiter is None:
+                    (content, usage), attempts = send_or_fall_back(request), 1
+                else:
+                    (content, usage), attempts = limiter.call(lambda: send_or_fall_back(request), estimated_tokens=estimated_tokens, retry_if=lambda: not chunks)
+            except _UseFallback:
+                fallback = True
+                router.record_fallback(stage)
+                request = dict(request, model=route.fallback_model)
+                model, tier = route.fallback_model, route.fallback_tier
+                (content, usage), attempts = call(request)
+                attempts += 1
+
+    prompt_tokens, completion_tokens, cached_prompt_tokens = _usage_tokens(usage)
+    if limiter is not None:
+        limiter.record_usage(estimated_tokens, prompt_tokens + completion_tokens)
+    if telemetry:
+        telemetry.record(CallRecord(
+            stage=stage, latency_s=time.perf_counter() - started, ttft_s=ttft, streamed=on_token is not None,
+            model=model, tier=tier, fallback=fallback, hedged=hedged, hedge_won=hedge_won, timeouts=timeouts, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            cached_prompt_tokens=cached_prompt_tokens, cost_usd=price_usd(model, prompt_tokens, cached_prompt_tokens, completion_tokens), coord=coord, attempts=attempts
+        ))
+    if cache is not None:
+        # Stored under the request as first built, so a repeat is answered without the detour
+        cache.put(key, {"request": request, "content": content, "usage": [prompt_tokens, completion_tokens]})
+    return content
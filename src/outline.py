@@ -0,0 +1,310 @@
+import hashlib
+import re
+from typing import Iterable, Iterator
+
+CHAPTER_PATTERN = re.compile(r"^### Chapter\s+(\d+)\.\s+(.*)")
+SECTION_PATTERN = re.compile(r"^#### Section\s+(\d+\.\d+)\s+(.*)")
+ITEM_PATTERN = re.compile(r"^#####\s+(\d+\.\d+\.\d+)\s+(.*)")
+METADATA_PATTERN = re.compile(r"## (Title|Audience|Description|Learning Objectives):\s*(.*)")
+
+
+def node_id(parent_id: str, title: str, occurrence: int = 1) -> str:
+    """
+    Stable ID of a node, derived from its parent's ID and its own title rather than its
+    position, so it survives insertions and moves of other nodes. `occurrence` tells apart
+    siblings with the same title.
+    """
+    key = f"{parent_id}\x1f{title}\x1f{occurrence}" if occurrence > 1 else f"{parent_id}\x1f{title}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+class Node:
+    """Base of the outline nodes; `id` is computed on first use, as most runs never need it."""
+
+    __slots__ = ("parent", "coord", "number", "title", "occurrence", "_id")
+
+    def __init__(self, parent, coord: tuple[int, ...], number: str, title: str, occurrence: int = 1):
+        self.parent = parent
+        self.coord = coord
+        self.number = number
+        self.title = title
+        self.occurrence = occurrence
+        self._id = None
+
+    @property
+    def id(self) -> str:
+        if self._id is None:
+            self._id = node_id(self.parent.id if self.parent is not None else "", self.title, self.occurrence)
+        return self._id
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.number} {self.title!r})"
+
+
+# The subclasses set every slot themselves instead of calling Node.__init__: a large outline
+# creates tens of thousands of items and the extra call is a noticeable share of parse time.
+
+class Item(Node):
+    __slots__ = ("parts",)
+
+    def __init__(self, parent, coord: tuple[int, int, int], number: str, title: str, occurrence: int = 1):
+        self.parent = parent
+        self.coord = coord
+        self.number = number
+        self.title = title
+        self.occurrence = occurrence
+        self._id = None
+        self.parts: list[str] | None = None
+
+
+class Section(Node):
+    __slots__ = ("items", "_title_counts")
+
+    def __init__(self, parent, coord: tuple[int, int], number: str, title: str, occurrence: int = 1):
+        self.parent = parent
+        self.coord = coord
+        self.number = number
+        self.title = title
+        self.occurrence = occurrence
+        self._id = None
+        self.items: list[Item] = []
+        self._title_counts: dict[str, int] = {}
+
+
+class Chapter(Node):
+    __slots__ = ("sections", "_title_counts")
+
+    def __init__(self, parent, coord: tuple[int], number: str, title: str, occurrence: int = 1):
+        self.parent = parent
+        self.coord = coord
+        self.number = number
+        self.title = title
+        self.occurrence = occurrence
+        self._id = None
+        self.sections: list[Section] = []
+        self._title_counts: dict[str, int] = {}
+
+
+class Outline:
+    """
+    The book outline as a tree of Chapter → Section → Item nodes.
+
+    Nodes are addressed by their 0-based coordinate (c,), (c, s) or (c, s, i) — plain list
+    indexing, so O(1) — or by their stable `id`. `to_lists` / `from_lists` convert to and from
+    the (chapters, sections, items) lists of parse_outline, and `parts_tree` / `attach_parts` to
+    and from the parts[c][s][i] dict of run_generate_parts_for_all.
+    """
+
+    __slots__ = ("title", "description", "audience", "objectives", "chapters", "_title_counts", "_last_section", "_by_id", "_item_count")
+
+    def __init__(self, title: str = "Untitled Book", description: str = "No description provided.", audience: str = "Unspecified", objectives: list[str] | None = None):
+        self.title = title
+        self.description = description
+        self.audience = audience
+        self.objectives = objectives or []
+        self.chapters: list[Chapter] = []
+        self._title_counts: dict[str, int] = {}
+        self._last_section: Section | None = None
+        self._by_id: dict[str, Node] | None = None
+        self._item_count = 0
+
+    def add_chapter(self, title: str, number: str = "") -> Chapter:
+        c = len(self.chapters)
+        occurrence = self._title_counts[title] = self._title_counts.get(title, 0) + 1
+        chapter = Chapter(None, (c,), number or str(c + 1), title, occurrence)
+        self.chapters.append(chapter)
+        self._last_section = None
+        self._by_id = None
+        return chapter
+
+    def add_section(self, title: str, number: str = "") -> Section:
+        if not self.chapters:
+            raise ValueError("Section found before a chapter.")
+        chapter = self.chapters[-1]
+        c, s = chapter.coord[0], len(chapter.sections)
+        occurrence = chapter._title_counts[title] = chapter._title_counts.get(title, 0) + 1
+        section = Section(chapter, (c, s), number or f"{c + 1}.{s + 1}", title, occurrence)
+        chapter.sections.append(section)
+        self._last_section = section
+        self._by_id = None
+        return section
+
+    def add_item(self, title: str, number: str = "") -> Item:
+        section = self._last_section
+        if section is None:
+            raise ValueError("Item found before a chapter or section.")
+        c, s = section.coord
+        i = len(section.items)
+        title_counts = section._title_counts
+        occurrence = title_counts[title] = title_counts.get(title, 0) + 1
+        item = Item(section, (c, s, i), number or f"{c + 1}.{s + 1}.{i + 1}", title, occurrence)
+        section.items.append(item)
+        self._item_count += 1
+        self._by_id = None
+        return item
+
+    def chapter(self, c: int) -> Chapter:
+        return self.chapters[c]
+
+    def section(self, c: int, s: int) -> Section:
+        return self.chapters[c].sections[s]
+
+    def item(self, c: int, s: int, i: int) -> Item:
+        return self.chapters[c].sections[s].items[i]
+
+    def node(self, coord: tuple[int, ...]) -> Node:
+        return (self.chapter, self.section, self.item)[len(coord) - 1](*coord)
+
+    def by_id(self, id: str) -> Node:
+        # The ID index is built on the first lookup and kept until the tree changes.
+        if self._by_id is None:
+            self._by_id = {}
+            for chapter in self.chapters:
+                self._by_id[chapter.id] = chapter
+                for section in chapter.sections:
+                    self._by_id[section.id] = section
+                    for item in section.items:
+                        self._by_id[item.id] = item
+        return self._by_id[id]
+
+    def items(self) -> Iterator[Item]:
+        """All items in book order."""
+        for chapter in self.chapters:
+            for section in chapter.sections:
+                yield from section.items
+
+    def item_coords(self) -> list[tuple[int, int, int]]:
+        return [item.coord for item in self.items()]
+
+    def __len__(self) -> int:
+        return self._item_count
+
+    def metadata(self) -> dict:
+        return {"title": self.title, "description": self.description, "audience": self.audience, "objectives": self.objectives}
+
+    def preview(self) -> "Outline":
+        """The first item of the first section of the first chapter, for quick preview runs."""
+        preview = Outline(self.title, self.description, self.audience, self.objectives)
+        chapter = self.chapters[0]
+        preview.add_chapter(chapter.title, chapter.number)
+        section = chapter.sections[0]
+        preview.add_section(section.title, section.number)
+        item = section.items[0]
+        preview.add_item(item.title, item.number).parts = item.parts
+        return preview
+
+    def to_lists(self) -> tuple[list[str], list[list[str]], list[list[list[str]]]]:
+        chapters = [chapter.title for chapter in self.chapters]
+        sections = [[section.title for section in chapter.sections] for chapter in self.chapters]
+        items = [[[item.title for item in section.items] for section in chapter.sections] for chapter in self.chapters]
+        return chapters, sections, items
+
+    @classmethod
+    def from_lists(cls, chapters: list[str], sections: list[list[str]], items: list[list[list[str]]], **metadata) -> "Outline":
+        outline = cls(**metadata)
+        for c, chapter_title in enumerate(chapters):
+            outline.add_chapter(chapter_title)
+            for s, section_title in enumerate(sections[c]):
+                outline.add_section(section_title)
+                for item_title in items[c][s]:
+                    outline.add_item(item_title)
+        return outline
+
+    def snapshot(self) -> dict:
+        """JSON-serialisable copy of the metadata and titles, e.g. to diff a later outline against."""
+        chapters, sections, items = self.to_lists()
+        return {"title": self.title, "description": self.description, "audience": self.audience, "chapters": chapters, "sections": sections, "items": items}
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> "Outline":
+        return cls.from_lists(
+            snapshot["chapters"], snapshot["sections"], snapshot["items"],
+            title=snapshot["title"], description=snapshot["description"], audience=snapshot["audience"]
+        )
+
+    def parts_tree(self) -> dict:
+        """The parts[c][s][i] dict of part title lists (None where not generated yet)."""
+        return {
+            c: {s: {i: item.parts for i, item in enumerate(section.items)} for s, section in enumerate(chapter.sections)}
+            for c, chapter in enumerate(self.chapters)
+        }
+
+    def attach_parts(self, parts: dict) -> None:
+        for item in self.items():
+            c, s, i = item.coord
+            item.parts = parts[c][s][i]
+
+
+def parse_outline_lines(lines: Iterable[str], metadata_only: bool = False) -> Outline:
+    """
+    Builds the outline in a single pass over `lines`, which may be any iterable (e.g. an open
+    file), so very large outlines are never held in memory as one string.
+
+    The "## Title/Audience/Description/Learning Objectives:" blocks give the metadata, read
+    like extract_outline_metadata always has: a heading may be indented or follow other text
+    on its line, and its block runs until the next line starting with "##" (after any
+    indentation) or the next such heading. The title is the first non-blank text of its block,
+    so it may also sit on the line below the heading; audience and description count only when
+    a heading ends them. With `metadata_only` no tree is built and reading stops once all
+    four blocks are found.
+    """
+    outline = Outline()
+    found = {}
+    current_key = None
+    current_lines: list[str] = []
+
+    def close_block(terminated: bool) -> None:
+        if current_key is None or current_key in found:
+            return
+        if current_key == "Title":
+            title = next((line.strip() for line in current_lines if line.strip()), "")
+            if title or not terminated:
+                found["Title"] = title
+        elif current_key == "Learning Objectives":
+            found["Learning Objectives"] = [line.strip().lstrip("- ").strip() for line in current_lines if line.strip().startswith("-")]
+        elif terminated:
+            found[current_key] = "\n".join(current_lines).strip().replace("\n", " ")
+
+    for raw_line in lines:
+        metadata_match = METADATA_PATTERN.search(raw_line) if "## " in raw_line else None
+        if metadata_match or raw_line.lstrip().startswith("##"):
+            close_block(terminated=True)
+            current_key = None
+            if metadata_only and len(found) == 4:
+                break
+            if metadata_match:
+                current_key = metadata_match.group(1)
+                current_lines = [metadata_match.group(2).rstrip("\r\n")]
+        elif current_key is not None:
+            current_lines.append(raw_line.rstrip("\r\n"))
+
+        if metadata_only:
+            continue
+        line = raw_line.strip()
+        # Dispatch on the heading depth, so each line is tried against one pattern at most.
+        if line.startswith("#####"):
+            item_match = ITEM_PATTERN.match(line)
+            if item_match:
+                outline.add_item(item_match.group(2).strip(), item_match.group(1))
+        elif line.startswith("####"):
+            sec_match = SECTION_PATTERN.match(line)
+            if sec_match:
+                outline.add_section(sec_match.group(2).strip(), sec_match.group(1))
+        elif line.startswith("###"):
+            chap_match = CHAPTER_PATTERN.match(line)
+            if chap_match:
+                outline.add_chapter(chap_match.group(2).strip(), chap_match.group(1))
+
+    close_block(terminated=False)
+
+    outline.title = found.get("Title") or outline.title
+    outline.audience = found.get("Audience", outline.audience)
+    outline.description = found.get("Description", outline.description)
+    outline.objectives = found.get("Learning Objectives", [])
+    return outline
+
+
+def load_outline(filepath: str = "outline.md") -> Outline:
+    """Streams the outline file line by line into an Outline."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        return parse_outline_lines(f)
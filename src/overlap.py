@@ -0,0 +1,36 @@
+import os
+from itertools import combinations
+
+from src.retrieval import tokenize
+
+DEFAULT_OVERLAP_THRESHOLD = 0.15
+
+
+def shingles(text: str, size: int = 3) -> set[int]:
+    """Hashed runs of `size` consecutive content words (stopwords dropped, lowercased)."""
+    tokens = tokenize(text)
+    return {hash(tuple(tokens[k:k + size])) for k in range(len(tokens) - size + 1)}
+
+
+def containment(a: set[int], b: set[int]) -> float:
+    """Share of the smaller shingle set that also occurs in the other one."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def find_overlaps(texts: list[str], threshold: float | None = None, size: int = 3) -> list[tuple[int, int, float]]:
+    """
+    Returns `(earlier, later, score)` for every pair of texts whose shingle containment
+    reaches `threshold` (BOOK_OVERLAP_THRESHOLD, 0.15 by default), i.e. texts that repeat
+    each other's phrasing. Pure local work: a handful of ~1000-word parts takes milliseconds.
+    """
+    if threshold is None:
+        threshold = float(os.getenv("BOOK_OVERLAP_THRESHOLD", DEFAULT_OVERLAP_THRESHOLD))
+    shingle_sets = [shingles(text, size) for text in texts]
+    overlaps = []
+    for a, b in combinations(range(len(texts)), 2):
+        score = containment(shingle_sets[a], shingle_sets[b])
+        if score >= threshold:
+            overlaps.append((a, b, score))
+    return overlaps
@@ -0,0 +1,273 @@
+"""
+Dry-run planner: predicts the API calls, tokens, cost and wall time of a book before any
+request is sent.
+
+The outline is parsed and every request the run would make is rendered with the real prompt
+builders, with placeholder part titles and bodies standing in for what the model has not
+written yet, and sized with llm.estimate_tokens. Latencies, completion sizes and parts per
+item come from the `<title>.report.json` files of earlier runs when there are any, and
+otherwise from defaults typical of the flagship model.
+"""
+import glob
+import heapq
+import json
+import os
+
+from src.client import load_env
+from src.generate_contents import build_contents_messages
+from src.generate_parts import build_grouped_parts_messages, build_parts_messages, group_item_coords, PARTS_GROUPINGS
+from src.llm import estimate_tokens
+from src.outline import Outline, load_outline
+from src.retrieval import SupportIndex
+from src.routing import ModelRouter, price_usd
+
+# Used until past runs say otherwise
+DEFAULT_PARTS_PER_ITEM = 5
+DEFAULT_COMPLETION_TOKENS = {"parts": 80, "contents": 1400}  # parts: per item of a request
+DEFAULT_LATENCY = {"parts": (1.0, 0.02), "contents": (1.0, 0.017)}  # (seconds per call, seconds per completion token)
+
+# Stand-in for a part body the prompt quotes; only its first 50 words are used
+PLACEHOLDER_CONTENT = " ".join(["lorem ipsum dolor sit amet consectetur"] * 10)
+
+
+def fit_latency(samples: list[tuple[int, float]]) -> tuple[float, float] | None:
+    """
+    (seconds per call, seconds per completion token) fitted by least squares to
+    (completion tokens, latency) samples; proportional to the tokens when they barely vary.
+    """
+    if not samples:
+        return None
+    n = len(samples)
+    mean_tokens = sum(tokens for tokens, _ in samples) / n
+    mean_latency = sum(latency for _, latency in samples) / n
+    variance = sum((tokens - mean_tokens) ** 2 for tokens, _ in samples)
+    if n >= 5 and variance > 0:
+        slope = sum((tokens - mean_tokens) * (latency - mean_latency) for tokens, latency in samples) / variance
+        intercept = mean_latency - slope * mean_tokens
+        if slope > 0 and intercept >= 0:
+            return intercept, slope
+    return (0.0, mean_latency / mean_tokens) if mean_tokens else (mean_latency, 0.0)
+
+
+def load_history(paths: list[str]) -> dict:
+    """
+    Calibration from run reports (files, or directories searched for *.report.json):
+    latency model and completion tokens per stage, and parts per item.
+    """
+    report_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            report_paths.extend(sorted(glob.glob(os.path.join(path, "**", "*.report.json"), recursive=True)))
+        elif os.path.exists(path):
+            report_paths.append(path)
+
+    samples = {"parts": [], "contents": []}
+    item_completion_tokens = []
+    contents_completion_tokens = []
+    parts_per_item = []
+    reports = 0
+    for report_path in report_paths:
+        try:
+            with open(report_path, "r", encoding="utf-8") as f:
+                calls = json.load(f)["calls"]
+        except (OSError, ValueError, KeyError):
+            continue
+        reports += 1
+        item_parts = {}
+        for call in calls:
+            stage = call["stage"].split("-")[0]
+            # Batch turnaround says nothing about online latency
+            if call["cached"] or call["stage"].endswith("-batch") or stage not in samples:
+                continue
+            samples[stage].append((call["completion_tokens"], call["latency_s"]))
+            coord = tuple(call["coord"] or ())
+            if call["stage"] == "parts" and len(coord) == 3:
+                item_completion_tokens.append(call["completion_tokens"])
+            elif call["stage"] == "contents" and len(coord) == 4:
+                contents_completion_tokens.append(call["completion_tokens"])
+                item_parts[coord[:3]] = max(item_parts.get(coord[:3], 0), coord[3] + 1)
+        parts_per_item.extend(item_parts.values())
+
+    def mean(values: list[float], default: float) -> float:
+        return sum(values) / len(values) if values else default
+
+    return {
+        "reports": reports,
+        "calls": {stage: len(stage_samples) for stage, stage_samples in samples.items()},
+        "latency": {stage: fit_latency(stage_samples) or DEFAULT_LATENCY[stage] for stage, stage_samples in samples.items()},
+        "completion_tokens": {
+            "parts": mean(item_completion_tokens, DEFAULT_COMPLETION_TOKENS["parts"]),
+            "contents": mean(contents_completion_tokens, DEFAULT_COMPLETION_TOKENS["contents"]),
+        },
+        "parts_per_item": mean(parts_per_item, DEFAULT_PARTS_PER_ITEM),
+    }
+
+
+def _cached_prefix_tokens(messages: list[dict]) -> int:
+    # The provider caches a repeated prompt prefix of at least 1024 tokens, in 128-token steps
+    prefix_tokens = estimate_tokens(messages[:1])
+    return prefix_tokens // 128 * 128 if prefix_tokens >= 1024 else 0
+
+
+def _schedule(durations: list[float], workers: int) -> float:
+    """Wall time of running `durations` in order on `workers` parallel workers."""
+    free_at = [0.0] * max(1, min(workers, len(durations)))
+    for duration in durations:
+        heapq.heappush(free_at, heapq.heappop(free_at) + duration)
+    return max(free_at) if durations else 0.0
+
+
+def plan_book(outline_path: str = "src/outline.md", max_workers: int = 1, debug: bool = False, parts_group_by: str = "item", speculative: bool = False, extra_context: str = "", support_index: SupportIndex | None = None, model_routes: dict[str, dict] | None = None, requests_per_minute: float | None = None, tokens_per_minute: float | None = None, history: list[str] | None = None, max_group_items: int = 30, outline: Outline | None = None) -> dict:
+    """
+    Predicts what run_generate_contents_and_save_book would do with the same options, for
+    `max_workers` concurrent requests under the given (or BOOK_RPM_LIMIT / BOOK_TPM_LIMIT)
+    rate limits, calibrated with the run reports found in `history`. `outline`, when given,
+    is planned instead of reading `outline_path`.
+
+    Each item's parts are a chain of requests and items run `max_workers` at a time, so
+    wall time is the longer of that schedule and the time the rate limits allow for the
+    calls and tokens. Duplicate rewrites, retries and hedges are not included.
+    """
+    if parts_group_by not in PARTS_GROUPINGS:
+        raise ValueError(f"Unknown parts grouping {parts_group_by!r}, expected one of {PARTS_GROUPINGS}.")
+    # Rate limits and routes may come from .env, as for a run
+    load_env()
+    if requests_per_minute is None:
+        requests_per_minute = float(os.getenv("BOOK_RPM_LIMIT", "0"))
+    if tokens_per_minute is None:
+        tokens_per_minute = float(os.getenv("BOOK_TPM_LIMIT", "0"))
+    concurrency = min(max_workers, int(os.getenv("BOOK_MAX_CONCURRENCY", max_workers)))
+
+    if outline is None:
+        outline = load_outline(outline_path)
+    if debug:
+        outline = outline.preview()
+    chapters, sections, items = outline.to_lists()
+    if support_index is None and extra_context:
+        support_index = SupportIndex(extra_context)
+    calibration = load_history(history or [])
+    router = ModelRouter.from_env(model_routes)
+    parts_per_item = max(1, round(calibration["parts_per_item"]))
+
+    # Part lists: one request per item, or per group of items
+    coords = outline.item_coords()
+    parts_requests = []  # (messages, items answered)
+    if parts_group_by == "item":
+        for c, s, i in coords:
+            parts_requests.append((build_parts_messages(outline.title, outline.description, outline.audience, c, chapters, s, sections, i, items), 1))
+    else:
+        for group in group_item_coords(coords, parts_group_by, max_group_items):
+            parts_requests.append((build_grouped_parts_messages(outline.title, outline.description, outline.audience, chapters, sections, items, group), len(group)))
+
+    # Part bodies: each item's parts see the earlier parts (or, speculatively, the sibling titles)
+    contents_requests = []  # (messages, item index)
+    for index, (c, s, i) in enumerate(coords):
+        part_titles = [f"Part {p + 1} of {items[c][s][i]}" for p in range(parts_per_item)]
+        for p, part_title in enumerate(part_titles):
+            messages = build_contents_messages(
+                outline.title, outline.description, outline.audience, c, s, i, p, part_title,
+                [] if speculative else part_titles[:p], [] if speculative else [PLACEHOLDER_CONTENT] * p,
+                chapters, sections, items, extra_context=extra_context, support_index=support_index,
+                sibling_parts_titles=[t for q, t in enumerate(part_titles) if q != p] if speculative else None
+            )
+            contents_requests.append((messages, index))
+
+    stages = {}
+    for stage, requests in (("parts", parts_requests), ("contents", contents_requests)):
+        route = router.route(stage)
+        per_call_s, per_token_s = calibration["latency"][stage]
+        completion_tokens = []
+        prompt_tokens = cached_prompt_tokens = 0
+        for n, (messages, weight) in enumerate(requests):
+            expected = calibration["completion_tokens"][stage] * (weight if stage == "parts" else 1)
+            if route.max_tokens:
+                expected = min(expected, route.max_tokens * (weight if stage == "parts" else 1))
+            completion_tokens.append(expected)
+            prompt_tokens += estimate_tokens(messages)
+            # The first request of a stage writes its prefix to the provider's cache
+            cached_prompt_tokens += _cached_prefix_tokens(messages) if n else 0
+        latencies = [per_call_s + per_token_s * tokens for tokens in completion_tokens]
+
+        workers = min(concurrency, route.max_concurrency or concurrency)
+        if stage == "parts":
+            scheduled_s = _schedule(latencies, workers)
+        else:
+            # Items are the unit of work; their parts run one after another
+            item_durations = [0.0] * len(coords)
+            for (_, index), latency in zip(requests, latencies):
+                item_durations[index] = max(item_durations[index], latency) if speculative else item_durations[index] + latency
+            # Speculative parts run side by side, but still share the concurrent request slots
+            scheduled_s = max(_schedule(item_durations, workers), sum(latencies) / workers)
+        total_tokens = prompt_tokens + sum(completion_tokens)
+        rate_bound_s = max(
+            len(requests) * 60 / requests_per_minute if requests_per_minute else 0.0,
+            total_tokens * 60 / tokens_per_minute if tokens_per_minute else 0.0,
+        )
+        stages[stage] = {
+            "model": route.model,
+            "calls": len(requests),
+            "prompt_tokens": prompt_tokens,
+            "cached_prompt_tokens": cached_prompt_tokens,
+            "completion_tokens": round(sum(completion_tokens)),
+            "cost_usd": price_usd(route.model, prompt_tokens, cached_prompt_tokens, sum(completion_tokens)),
+            "latency_s": sum(latencies) / len(latencies) if latencies else None,
+            "wall_time_s": max(scheduled_s, rate_bound_s),
+            "rate_limited": rate_bound_s > scheduled_s,
+        }
+
+    costs = [stage["cost_usd"] for stage in stages.values()]
+    return {
+        "title": outline.title,
+        "items": len(coords),
+        "parts_per_item": parts_per_item,
+        "stages": stages,
+        "total": {
+            "calls": sum(stage["calls"] for stage in stages.values()),
+            "prompt_tokens": sum(stage["prompt_tokens"] for stage in stages.values()),
+            "cached_prompt_tokens": sum(stage["cached_prompt_tokens"] for stage in stages.values()),
+            "completion_tokens": sum(stage["completion_tokens"] for stage in stages.values()),
+            "cost_usd": None if None in costs else sum(costs),
+            "wall_time_s": sum(stage["wall_time_s"] for stage in stages.values()),
+        },
+        "assumptions": {
+            "concurrency": concurrency,
+            "requests_per_minute": requests_per_minute or None,
+            "tokens_per_minute": tokens_per_minute or None,
+            "parts_group_by": parts_group_by,
+            "speculative": speculative,
+            "calibration": {"reports": calibration["reports"], "calls": calibration["calls"]},
+            "latency_model": {stage: {"per_call_s": per_call_s, "per_token_s": per_token_s} for stage, (per_call_s, per_token_s) in calibration["latency"].items()},
+        },
+    }
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+
+def format_plan(plan: dict) -> str:
+    def fmt(value, spec=".2f"):
+        return "-" if value is None else format(value, spec)
+
+    header = f"{'stage':<10} {'model':<26} {'calls':>6} {'prompt tok':>11} {'compl tok':>10} {'cost $':>8} {'s/call':>7} {'wall time':>10}"
+    lines = [header, "-" * len(header)]
+    rows = [(name, stage["model"], stage) for name, stage in plan["stages"].items()] + [("total", "", plan["total"])]
+    for name, model, stage in rows:
+        lines.append(
+            f"{name:<10} {model:<26} {stage['calls']:>6} {stage['prompt_tokens']:>11} {stage['completion_tokens']:>10} "
+            f"{fmt(stage['cost_usd']):>8} {fmt(stage.get('latency_s'), '.1f'):>7} {format_duration(stage['wall_time_s']):>10}"
+        )
+    assumptions = plan["assumptions"]
+    calibration = assumptions["calibration"]
+    limits = ", ".join(f"{value:g} {name}" for name, value in (("RPM", assumptions["requests_per_minute"]), ("TPM", assumptions["tokens_per_minute"])) if value)
+    lines.append(
+        f"{plan['items']} item{'s' if plan['items'] != 1 else ''} × {plan['parts_per_item']} parts, {assumptions['concurrency']} concurrent requests"
+        + (f", {limits}" if limits else "")
+        + (f"; calibrated from {calibration['reports']} run report{'s' if calibration['reports'] != 1 else ''} ({calibration['calls']['contents']} content calls)" if calibration["reports"] else "; no past run reports, default latencies")
+    )
+    limited = [name for name, stage in plan["stages"].items() if stage["rate_limited"]]
+    if limited:
+        lines.append(f"Rate limits set the pace of: {', '.join(limited)}")
+    return "\n".join(lines)
@@ -0,0 +1,222 @@
+import os
+import random
+import threading
+import time
+from typing import Callable
+
+
+class TokenBucket:
+    """Continuously refilled budget of `per_minute` units; acquire() blocks until enough is available."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float) -> None:
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """Charges (positive) or refunds (negative) the difference between estimated and actual use."""
+        with self._lock:
+            self._refill()
+            self.available = min(self.capacity, self.available - amount)
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    Caps the number of requests in flight, with an AIMD limit: it is halved whenever the
+    provider throttles us and grows back by about one slot per `limit` successful calls.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttled(self) -> None:
+        with self._condition:
+            self.limit = max(1.0, self.limit / 2)
+
+
+def _retry_after_seconds(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class CallTimeout(TimeoutError):
+    """A call that did not finish within its stage's hard timeout (BOOK_<STAGE>_TIMEOUT)."""
+
+
+# The SDK is imported only once an error needs classifying; it is already loaded by then, as
+# the errors come from src.client's client.
+
+def is_retryable(error: Exception) -> bool:
+    import openai
+    return isinstance(error, (CallTimeout, openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError))
+
+
+def is_rate_limited(error: Exception) -> bool:
+    import openai
+    return isinstance(error, openai.RateLimitError)
+
+
+def is_timeout(error: Exception) -> bool:
+    import openai
+    return isinstance(error, (CallTimeout, openai.APITimeoutError))
+
+
+class RateLimiter:
+    """
+    Shared request/token budget and retry policy for every API call of a book run.
+
+    Before each attempt a call takes one request from the RPM bucket, its estimated tokens
+    from the TPM bucket and a slot from the adaptive concurrency limit. Rate-limit (429),
+    server (5xx) and connection errors are retried with the provider's Retry-After delay when
+    it sends one, or jittered exponential backoff otherwise. A 429 also pauses all callers
+    for the Retry-After period and halves the concurrency limit.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, max_concurrency: int = 8, max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrencyLimit(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled = 0
+        self.retries = 0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, max_concurrency: int = 8) -> "RateLimiter":
+        return cls(
+            requests_per_minute=float(os.getenv("BOOK_RPM_LIMIT", "0")),
+            tokens_per_minute=float(os.getenv("BOOK_TPM_LIMIT", "0")),
+            max_concurrency=int(os.getenv("BOOK_MAX_CONCURRENCY", max_concurrency)),
+            max_retries=int(os.getenv("BOOK_MAX_RETRIES", "6")),
+        )
+
+    def _wait_for_pause(self) -> None:
+        while True:
+            with self._lock:
+                wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after + random.uniform(0, 0.25 * self.base_delay))
+        # Full jitter: spread retries of many workers over the whole backoff window.
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn: Callable[[], object], estimated_tokens: int = 0, retry_if: Callable[[], bool] | None = None) -> tuple[object, int]:
+        """
+        Runs `fn` under the budget, retrying transient failures.
+        `retry_if`, when given, is consulted before each retry (e.g. a stream that already
+        delivered tokens cannot be retried). Returns the result and the number of attempts.
+        """
+        attempt = 0
+        while True:
+            self._wait_for_pause()
+            if self.requests:
+                self.requests.acquire(1)
+            if self.tokens and estimated_tokens:
+                self.tokens.acquire(estimated_tokens)
+
+            self.concurrency.acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries or (retry_if and not retry_if()):
+                    raise
+                delay = self._backoff(attempt, e)
+                with self._lock:
+                    self.retries += 1
+                if is_rate_limited(e):
+                    self._throttled(delay)
+            else:
+                self.concurrency.on_success()
+                return result, attempt + 1
+            finally:
+                self.concurrency.release()
+
+            attempt += 1
+            time.sleep(delay)
+
+    def _throttled(self, delay: float) -> None:
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self.concurrency.on_throttled()
+
+    def record_throttled(self, error: Exception) -> None:
+        """
+        Accounts for a rate-limit error that is not retried here (e.g. the request moves to a
+        fallback model): the concurrency limit is halved and new requests pause as for a retry.
+        """
+        self._throttled(self._backoff(0, error))
+
+    def reserve(self, estimated_tokens: int = 0) -> None:
+        """Takes one more request and its tokens from the budgets, for a hedge sent within a call."""
+        if self.requests:
+            self.requests.acquire(1)
+        if self.tokens and estimated_tokens:
+            self.tokens.acquire(estimated_tokens)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        if self.tokens and actual_tokens:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "concurrency_limit": self.concurrency.limit,
+            }
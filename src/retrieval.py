@@ -0,0 +1,83 @@
+import hashlib
+import heapq
+import math
+import re
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['_-][a-z0-9]+)*")
+WORD_PATTERN = re.compile(r"\S+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or that the their this to was were
+will with we you your our can not but also which these those than then there when where how what why
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+class SupportIndex:
+    """
+    BM25 index over overlapping word-window chunks of the supporting documents.
+
+    Built once per upload; `query` scores only the chunks that share a term with the query
+    (through the postings lists), so a lookup takes milliseconds even for large uploads.
+    """
+
+    def __init__(self, text: str, chunk_words: int = 180, overlap_words: int = 30, k1: float = 1.5, b: float = 0.75):
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        self.k1 = k1
+        self.b = b
+        self.chunks: list[str] = []
+        self.lengths: list[int] = []
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+
+        words = [(m.start(), m.end()) for m in WORD_PATTERN.finditer(text)]
+        step = max(1, chunk_words - overlap_words)
+        for start in range(0, len(words), step):
+            window = words[start:start + chunk_words]
+            chunk = text[window[0][0]:window[-1][1]]
+            chunk_id = len(self.chunks)
+            self.chunks.append(chunk)
+            term_counts = Counter(tokenize(chunk))
+            self.lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, []).append((chunk_id, count))
+            if start + chunk_words >= len(words):
+                break
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.idf = {
+            term: math.log(1 + (len(self.chunks) - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def query(self, query_text: str, k: int = 4, token_budget: int = 600) -> list[str]:
+        """Returns up to `k` of the most relevant chunks, best first, within roughly `token_budget` tokens."""
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query_text)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, count in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / self.average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+
+        passages = []
+        used_tokens = 0
+        for chunk_id in heapq.nlargest(k, scores, key=scores.get):
+            chunk = self.chunks[chunk_id]
+            chunk_tokens = len(chunk) // 4
+            if used_tokens + chunk_tokens > token_budget:
+                if passages:
+                    break
+                # Always return the best match, trimmed to the budget.
+                chunk = chunk[:token_budget * 4]
+                chunk_tokens = token_budget
+            passages.append(chunk)
+            used_tokens += chunk_tokens
+        return passages
@@ -0,0 +1,181 @@
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from src.hedging import LatencyTracker
+
+# Latency/cost tiers; a stage can name a tier or any model id the endpoint serves.
+MODEL_TIERS = {
+    "flagship": "gpt-4.1-2025-04-14",
+    "balanced": "gpt-4.1-mini-2025-04-14",
+    "fast": "gpt-4.1-nano-2025-04-14",
+}
+# USD per million tokens: (prompt, cached prompt, completion)
+MODEL_PRICES = {
+    "gpt-4.1-2025-04-14": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini-2025-04-14": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano-2025-04-14": (0.10, 0.025, 0.40),
+}
+# The Batch API bills half the price of the same request sent online
+BATCH_PRICE_FACTOR = 0.5
+DEFAULT_TIER = "flagship"
+DEFAULT_TEMPERATURE = 0.7
+ROUTED_STAGES = ("parts", "contents")
+
+
+def resolve_model(name: str) -> tuple[str, str]:
+    """(model id, tier) for a tier name or a model id; models outside the tiers are "custom"."""
+    if name in MODEL_TIERS:
+        return MODEL_TIERS[name], name
+    for tier, model in MODEL_TIERS.items():
+        if model == name:
+            return model, tier
+    return name, "custom"
+
+
+def price_usd(model: str, prompt_tokens: int, cached_prompt_tokens: int, completion_tokens: int) -> float | None:
+    """What the tokens of a request cost at the model's list price; None for a model without one."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    prompt_price, cached_price, completion_price = prices
+    return ((prompt_tokens - cached_prompt_tokens) * prompt_price + cached_prompt_tokens * cached_price + completion_tokens * completion_price) / 1_000_000
+
+
+@dataclass
+class StageRoute:
+    model: str = MODEL_TIERS[DEFAULT_TIER]
+    tier: str = DEFAULT_TIER
+    temperature: float = DEFAULT_TEMPERATURE
+    max_tokens: int | None = None
+    max_concurrency: int | None = None
+    fallback_model: str | None = None
+    fallback_tier: str | None = None
+    fallback_after_s: float | None = None
+    hedge_percentile: float | None = None
+    timeout_s: float | None = None
+
+    @classmethod
+    def from_settings(cls, model: str | None = None, temperature: str | float | None = None, max_tokens: str | int | None = None, max_concurrency: str | int | None = None, fallback: str | None = None, fallback_after_s: str | float | None = None, hedge_percentile: str | float | None = None, timeout_s: str | float | None = None) -> "StageRoute":
+        route = cls()
+        if model:
+            route.model, route.tier = resolve_model(model)
+        if temperature not in (None, ""):
+            route.temperature = float(temperature)
+        if max_tokens:
+            route.max_tokens = int(max_tokens)
+        if max_concurrency:
+            route.max_concurrency = int(max_concurrency)
+        if fallback and fallback != "none":
+            route.fallback_model, route.fallback_tier = resolve_model(fallback)
+        if fallback_after_s:
+            route.fallback_after_s = float(fallback_after_s)
+        if hedge_percentile and hedge_percentile != "off":
+            route.hedge_percentile = float(hedge_percentile)
+            if not 0 < route.hedge_percentile < 100:
+                raise ValueError(f"Hedge percentile must be between 0 and 100, got {hedge_percentile}")
+        if timeout_s:
+            route.timeout_s = float(timeout_s)
+        return route
+
+
+class ModelRouter:
+    """
+    Picks the model, temperature, `max_tokens`, concurrency cap and fallback model of each
+    stage. Derived stages ("contents-repair", "parts-batch", ...) follow their base stage.
+
+    With a fallback, a request the primary model answers with a 429, or does not start
+    answering within `fallback_after_s`, is sent to the fallback model instead of waiting.
+
+    With `hedge_percentile`, a request still unanswered after that percentile of the stage's
+    recent latencies gets a duplicate (see src.hedging); `timeout_s` bounds each attempt's wait for its response and then for each further piece of it.
+    """
+
+    def __init__(self, routes: dict[str, StageRoute] | None = None):
+        self.routes = routes or {}
+        self.fallbacks: dict[str, int] = {}
+        self._slots = {
+            stage: threading.BoundedSemaphore(route.max_concurrency)
+            for stage, route in self.routes.items() if route.max_concurrency
+        }
+        self._latencies = {stage: LatencyTracker() for stage, route in self.routes.items() if route.hedge_percentile or route.timeout_s}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, overrides: dict[str, dict] | None = None) -> "ModelRouter":
+        """
+        Reads BOOK_<STAGE>_MODEL (tier or model id), _TEMPERATURE, _MAX_TOKENS, _CONCURRENCY,
+        _FALLBACK (tier or model id, or "none"), _FALLBACK_AFTER (seconds), _HEDGE_PERCENTILE
+        (e.g. 95, or "off") and _TIMEOUT (seconds) for each stage;
+        `overrides` ({"parts": {"model": "fast"}, ...}) take precedence, e.g. from the app.
+        """
+        routes = {}
+        for stage in ROUTED_STAGES:
+            prefix = f"BOOK_{stage.upper()}_"
+            settings = {
+                "model": os.getenv(prefix + "MODEL"),
+                "temperature": os.getenv(prefix + "TEMPERATURE"),
+                "max_tokens": os.getenv(prefix + "MAX_TOKENS"),
+                "max_concurrency": os.getenv(prefix + "CONCURRENCY"),
+                "fallback": os.getenv(prefix + "FALLBACK"),
+                "fallback_after_s": os.getenv(prefix + "FALLBACK_AFTER"),
+                "hedge_percentile": os.getenv(prefix + "HEDGE_PERCENTILE"),
+                "timeout_s": os.getenv(prefix + "TIMEOUT"),
+            }
+            settings.update({key: value for key, value in ((overrides or {}).get(stage) or {}).items() if value is not None})
+            routes[stage] = StageRoute.from_settings(**settings)
+        return cls(routes)
+
+    def route(self, stage: str) -> StageRoute:
+        return self.routes.get(stage) or self.routes.get(stage.split("-")[0]) or StageRoute()
+
+    def request_options(self, stage: str, max_tokens_scale: int = 1) -> dict:
+        """Keyword arguments for llm.build_request, e.g. for batch files."""
+        route = self.route(stage)
+        return {
+            "model": route.model,
+            "temperature": route.temperature,
+            "max_tokens": route.max_tokens * max_tokens_scale if route.max_tokens else None,
+        }
+
+    @contextmanager
+    def slot(self, stage: str):
+        """Holds one of the stage's concurrent request slots, when the stage has a cap."""
+        semaphore = self._slots.get(stage) or self._slots.get(stage.split("-")[0])
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def latency_tracker(self, stage: str) -> LatencyTracker | None:
+        """The stage's latency history, when it hedges or has a timeout."""
+        return self._latencies.get(stage) or self._latencies.get(stage.split("-")[0])
+
+    def hedge_after(self, stage: str) -> float | None:
+        """Seconds after which a request of the stage is hedged, or None."""
+        route = self.route(stage)
+        tracker = self.latency_tracker(stage)
+        if tracker is None or not route.hedge_percentile:
+            return None
+        return tracker.hedge_after(route.hedge_percentile)
+
+    def record_fallback(self, stage: str) -> None:
+        with self._lock:
+            self.fallbacks[stage] = self.fallbacks.get(stage, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            fallbacks = dict(self.fallbacks)
+        return {
+            "routes": {
+                stage: {"model": route.model, "tier": route.tier, "max_tokens": route.max_tokens, "max_concurrency": route.max_concurrency, "fallback_model": route.fallback_model, "hedge_percentile": route.hedge_percentile, "timeout_s": route.timeout_s}
+                for stage, route in self.routes.items()
+            },
+            "fallbacks": fallbacks,
+            "hedging": {
+                stage: tracker.stats(self.routes[stage].hedge_percentile)
+                for stage, tracker in self._latencies.items()
+            },
+        }
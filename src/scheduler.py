@@ -0,0 +1,52 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Iterable, Iterator
+
+from src.jobs import inherit_job_output
+
+_DONE = object()
+
+
+class ItemScheduler:
+    """
+    Runs independent per-item tasks concurrently and replays their events in submission order.
+
+    Each task receives its key and an `emit` callback. Events emitted by a task are held in a
+    per-item reorder buffer until every earlier item has been fully replayed, so the consumer
+    sees exactly the sequence a serial run would produce.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max(1, int(max_workers))
+
+    def run(self, keys: Iterable[Hashable], task: Callable[[Hashable, Callable], None]) -> Iterator[tuple[Hashable, object]]:
+        keys = list(keys)
+        buffers = {key: queue.Queue() for key in keys}
+
+        def run_task(key):
+            buffer = buffers[key]
+            try:
+                task(key, buffer.put)
+            except BaseException as e:
+                buffer.put((_DONE, e))
+                raise
+            buffer.put((_DONE, None))
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, initializer=inherit_job_output())
+        try:
+            # The pool consumes its queue in FIFO order, so the item at the head of the book
+            # is always scheduled first and the consumer rarely waits on a later one.
+            for key in keys:
+                executor.submit(run_task, key)
+
+            for key in keys:
+                buffer = buffers[key]
+                while True:
+                    event = buffer.get()
+                    if isinstance(event, tuple) and len(event) == 2 and event[0] is _DONE:
+                        if event[1] is not None:
+                            raise event[1]
+                        break
+                    yield key, event
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
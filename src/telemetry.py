@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class CallRecord:
+    stage: str
+    latency_s: float
+    ttft_s: float | None = None
+    streamed: bool = False
+    cached: bool = False
+    model: str = ""
+    tier: str = ""
+    fallback: bool = False
+    hedged: bool = False
+    hedge_won: bool = False
+    timeouts: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    cost_usd: float | None = None
+    coord: tuple[int, ...] | None = None
+    attempts: int = 1
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Linearly interpolated percentile (q in 0..100) of `values`."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class Telemetry:
+    """Thread-safe collector of per-call and per-phase timings for one book run."""
+
+    def __init__(self):
+        self.records: list[CallRecord] = []
+        self.phases: dict[str, float] = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, record: CallRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measures the wall time of a pipeline phase (parts, contents, export, ...)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def _stage_summary(self, records: list[CallRecord], wall_time_s: float) -> dict:
+        api_calls = [r for r in records if not r.cached]
+        latencies = [r.latency_s for r in api_calls]
+        ttfts = [r.ttft_s for r in api_calls if r.ttft_s is not None]
+        prompt_tokens = sum(r.prompt_tokens for r in api_calls)
+        completion_tokens = sum(r.completion_tokens for r in api_calls)
+        cached_prompt_tokens = sum(r.cached_prompt_tokens for r in api_calls)
+        # Unknown when a model has no list price (see routing.MODEL_PRICES)
+        costs = [r.cost_usd for r in api_calls]
+        return {
+            "calls": len(api_calls),
+            "cached_calls": len(records) - len(api_calls),
+            "retries": sum(r.attempts - 1 for r in api_calls),
+            "fallbacks": sum(1 for r in api_calls if r.fallback),
+            "hedged": sum(1 for r in api_calls if r.hedged),
+            "hedge_wins": sum(1 for r in api_calls if r.hedge_won),
+            "timeouts": sum(r.timeouts for r in api_calls),
+            "tiers": dict(Counter(r.tier for r in api_calls if r.tier)),
+            "latency_s": {
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies) if latencies else None,
+            },
+            "ttft_s": {
+                "p50": percentile(ttfts, 50),
+                "p95": percentile(ttfts, 95),
+            },
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_prompt_tokens": cached_prompt_tokens,
+            "prompt_cache_hit_rate": cached_prompt_tokens / prompt_tokens if prompt_tokens else None,
+            "cost_usd": None if None in costs else sum(costs),
+            "calls_per_s": len(api_calls) / wall_time_s if wall_time_s else None,
+            "completion_tokens_per_s": completion_tokens / wall_time_s if wall_time_s else None,
+        }
+
+    def report(self) -> dict:
+        wall_time_s = time.perf_counter() - self.started
+        with self._lock:
+            records = list(self.records)
+            phases = dict(self.phases)
+
+        stages = {}
+        for stage in sorted({r.stage for r in records}):
+            stage_records = [r for r in records if r.stage == stage]
+            stages[stage] = self._stage_summary(stage_records, phases.get(stage, wall_time_s))
+
+        return {
+            "wall_time_s": wall_time_s,
+            "phases_s": phases,
+            "total": self._stage_summary(records, wall_time_s),
+            "stages": stages,
+            "calls": [asdict(r) for r in records],
+        }
+
+    def write_report(self, path: str, **extra) -> dict:
+        report = self.report()
+        report.update(extra)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    @staticmethod
+    def format_table(report: dict) -> str:
+        def fmt(value, spec=".2f"):
+            return "-" if value is None else format(value, spec)
+
+        header = f"{'stage':<14} {'calls':>6} {'reused':>6} {'retries':>7} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'ttft p50':>8} {'prompt tok':>10} {'pfx hit':>8} {'compl tok':>10} {'cost $':>8} {'calls/s':>7}"
+        lines = [header, "-" * len(header)]
+        rows = list(report["stages"].items()) + [("total", report["total"])]
+        for name, stage in rows:
+            lines.append(
+                f"{name:<14} {stage['calls']:>6} {stage['cached_calls']:>6} {stage['retries']:>7} "
+                f"{fmt(stage['latency_s']['p50']):>7} {fmt(stage['latency_s']['p95']):>7} {fmt(stage['latency_s']['p99']):>7} "
+                f"{fmt(stage['ttft_s']['p50']):>8} {stage['prompt_tokens']:>10} {fmt(stage['prompt_cache_hit_rate'], '.0%'):>8} {stage['completion_tokens']:>10} "
+                f"{fmt(stage.get('cost_usd'), '.4f'):>8} {fmt(stage['calls_per_s']):>7}"
+            )
+        phases = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in report["phases_s"].items())
+        lines.append(f"wall time {report['wall_time_s']:.1f}s" + (f" ({phases})" if phases else ""))
+        return "\n".join(lines)
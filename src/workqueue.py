@@ -0,0 +1,373 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from src.cache import ResponseCache
+from src.generate_contents import generate_contents, run_generate_contents_and_save_book
+from src.generate_parts import generate_parts, parse_parts
+from src.journal import BookJournal, outline_fingerprint
+from src.outline import parse_outline_lines
+from src.client import load_env
+from src.rate_limit import RateLimiter
+from src.routing import ModelRouter
+from src.telemetry import Telemetry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    outline TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    finished REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    book_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    item TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    title TEXT,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (book_id, kind, item, part)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (status, rank);
+"""
+
+# Claimed in this order: finishing books that are under way beats starting part lists.
+TASK_RANKS = {"assemble": 0, "content": 0, "parts": 1}
+
+
+def item_key(coord: tuple[int, int, int]) -> str:
+    return ".".join(str(n) for n in coord)
+
+
+def item_coord(key: str) -> tuple[int, int, int]:
+    c, s, i = (int(n) for n in key.split("."))
+    return c, s, i
+
+
+class WorkQueue:
+    """
+    SQLite-backed queue of the API work of many books, shared by every worker process that
+    opens the same file, on one machine or several (over shared storage with working file
+    locks; SQLite's WAL mode is not used, as it needs shared memory on one host).
+
+    Each book is a set of tasks: a "parts" task per item, a "content" task per part, created
+    once the part before it is done (each part's prompt needs the earlier parts' text), and
+    a final "assemble" task. A worker claims a task by leasing it for `lease_seconds`, and
+    renews the lease while the task runs; a lease that runs out (its worker died) makes the
+    task claimable again, so nothing is lost and nothing is generated twice while its worker
+    is alive. Results are stored in the queue.
+    """
+
+    # Tasks of a failed book are left alone until the book is added again.
+    BUILDING = "book_id IN (SELECT id FROM books WHERE status = 'building')"
+
+    def __init__(self, path: str, lease_seconds: float = 900.0, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads; every thread gets its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front, so two workers never claim the same task.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def add_book(self, name: str, outline_text: str, output_dir: str) -> tuple[str, bool]:
+        """
+        Queues a book, unless the same outline is already queued for the same output folder.
+        Re-adding a failed book retries its failed tasks. Returns (book id, newly added).
+        """
+        book_id = hashlib.sha256(f"{output_dir}\0{outline_text}".encode("utf-8")).hexdigest()[:16]
+        outline = parse_outline_lines(outline_text.splitlines())
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM books WHERE id = ?", (book_id,)).fetchone()
+            if row is not None:
+                if row["status"] == "failed":
+                    conn.execute("UPDATE tasks SET status = 'pending', attempts = 0, error = NULL WHERE book_id = ? AND status = 'failed'", (book_id,))
+                    conn.execute("UPDATE books SET status = 'building', error = NULL WHERE id = ?", (book_id,))
+                return book_id, False
+            conn.execute(
+                "INSERT INTO books (id, name, outline, output_dir, status, created) VALUES (?, ?, ?, ?, 'building', ?)",
+                (book_id, name, outline_text, output_dir, time.time())
+            )
+            conn.executemany(
+                "INSERT INTO tasks (book_id, kind, item, part, rank, status) VALUES (?, 'parts', ?, -1, ?, 'pending')",
+                [(book_id, item_key(coord), TASK_RANKS["parts"]) for coord in outline.item_coords()]
+            )
+            if len(outline) == 0:
+                self._add_assemble(conn, book_id)
+        return book_id, True
+
+    def claim(self, owner: str) -> dict | None:
+        """
+        Leases the next pending task (or one whose lease ran out) to `owner`. A task whose lease
+        ran out on its last allowed attempt is failed, with its book, instead of leased again.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    f"SELECT rowid, * FROM tasks WHERE status = 'pending' AND {self.BUILDING} ORDER BY rank, rowid LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    row = conn.execute(
+                        f"SELECT rowid, * FROM tasks WHERE status = 'leased' AND lease_expires < ? AND {self.BUILDING} ORDER BY rank, rowid LIMIT 1", (now,)
+                    ).fetchone()
+                if row is None:
+                    return None
+                if row["status"] == "pending" or row["attempts"] < self.max_attempts:
+                    break
+                # Its worker died on every attempt, e.g. on a request that crashes the process
+                error = f"lease expired on all {row['attempts']} attempts"
+                conn.execute("UPDATE tasks SET status = 'failed', owner = NULL, error = ? WHERE rowid = ?", (error, row["rowid"]))
+                conn.execute("UPDATE books SET status = 'failed', error = ? WHERE id = ?", (error, row["book_id"]))
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE rowid = ?",
+                (owner, now + self.lease_seconds, row["rowid"])
+            )
+            task = dict(row)
+            task["attempts"] += 1
+            return task
+
+    def _add_assemble(self, conn: sqlite3.Connection, book_id: str) -> None:
+        conn.execute(
+            "INSERT OR IGNORE INTO tasks (book_id, kind, item, part, rank, status) VALUES (?, 'assemble', '', -1, ?, 'pending')",
+            (book_id, TASK_RANKS["assemble"])
+        )
+
+    def _add_content(self, conn: sqlite3.Connection, book_id: str, item: str, part: int, part_titles: list[str]) -> None:
+        if part < len(part_titles):
+            conn.execute(
+                "INSERT OR IGNORE INTO tasks (book_id, kind, item, part, rank, status, title) VALUES (?, 'content', ?, ?, ?, 'pending', ?)",
+                (book_id, item, part, TASK_RANKS["content"], part_titles[part])
+            )
+
+    def renew(self, task: dict, owner: str) -> bool:
+        """Extends `owner`'s lease on a task by `lease_seconds`. Returns False when the lease was lost."""
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE rowid = ? AND status = 'leased' AND owner = ?",
+                (time.time() + self.lease_seconds, task["rowid"], owner)
+            ).rowcount > 0
+
+    def complete(self, task: dict, owner: str, result: str | None = None) -> bool:
+        """
+        Stores a task's result and queues the work it unblocks. Returns False when the lease
+        was lost in the meantime (the task went to another worker); the result is then dropped.
+        """
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, owner = NULL, error = NULL WHERE rowid = ? AND status = 'leased' AND owner = ?",
+                (result, task["rowid"], owner)
+            ).rowcount
+            if not updated:
+                return False
+
+            book_id = task["book_id"]
+            if task["kind"] == "parts":
+                self._add_content(conn, book_id, task["item"], 0, json.loads(result))
+            elif task["kind"] == "content":
+                self._add_content(conn, book_id, task["item"], task["part"] + 1, self.part_titles(book_id, task["item"]))
+            elif task["kind"] == "assemble":
+                conn.execute("UPDATE books SET status = 'done', finished = ? WHERE id = ?", (time.time(), book_id))
+                return True
+
+            unfinished = conn.execute("SELECT COUNT(*) FROM tasks WHERE book_id = ? AND status != 'done'", (book_id,)).fetchone()[0]
+            if unfinished == 0:
+                self._add_assemble(conn, book_id)
+            return True
+
+    def fail(self, task: dict, owner: str, error: str) -> None:
+        """Returns a failed task to the queue, or after `max_attempts` fails it and its book."""
+        with self._transaction() as conn:
+            status = "failed" if task["attempts"] >= self.max_attempts else "pending"
+            updated = conn.execute(
+                "UPDATE tasks SET status = ?, owner = NULL, error = ? WHERE rowid = ? AND status = 'leased' AND owner = ?",
+                (status, error, task["rowid"], owner)
+            ).rowcount
+            if updated and status == "failed":
+                conn.execute("UPDATE books SET status = 'failed', error = ? WHERE id = ?", (error, task["book_id"]))
+
+    def book(self, book_id: str) -> dict:
+        return dict(self._conn().execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone())
+
+    def part_titles(self, book_id: str, item: str) -> list[str]:
+        row = self._conn().execute("SELECT result FROM tasks WHERE book_id = ? AND kind = 'parts' AND item = ?", (book_id, item)).fetchone()
+        return json.loads(row["result"])
+
+    def previous_contents(self, book_id: str, item: str, part: int) -> list[str]:
+        rows = self._conn().execute(
+            "SELECT result FROM tasks WHERE book_id = ? AND kind = 'content' AND item = ? AND part < ? AND status = 'done' ORDER BY part",
+            (book_id, item, part)
+        ).fetchall()
+        return [row["result"] for row in rows]
+
+    def results(self, book_id: str) -> tuple[dict, dict]:
+        """A book's part lists by (c, s, i) and part bodies by (c, s, i, p), as the journal keeps them."""
+        parts, contents = {}, {}
+        rows = self._conn().execute("SELECT kind, item, part, title, result FROM tasks WHERE book_id = ? AND status = 'done' AND kind != 'assemble'", (book_id,))
+        for row in rows:
+            if row["kind"] == "parts":
+                parts[item_coord(row["item"])] = json.loads(row["result"])
+            else:
+                contents[item_coord(row["item"]) + (row["part"],)] = (row["title"], row["result"])
+        return parts, contents
+
+    def progress(self) -> list[dict]:
+        """Per book: status and the number of tasks in each state."""
+        conn = self._conn()
+        books = [dict(row) for row in conn.execute("SELECT id, name, output_dir, status, error FROM books ORDER BY created")]
+        counts = {}
+        for row in conn.execute("SELECT book_id, status, COUNT(*) AS n FROM tasks GROUP BY book_id, status"):
+            counts.setdefault(row["book_id"], {})[row["status"]] = row["n"]
+        for book in books:
+            book["tasks"] = counts.get(book["id"], {})
+        return books
+
+    def drained(self) -> bool:
+        """True once no book is still building: nothing left to claim now or later."""
+        return self._conn().execute("SELECT COUNT(*) FROM books WHERE status = 'building'").fetchone()[0] == 0
+
+
+class _BookContext:
+    """What the workers need of a book to render its prompts, parsed once per process."""
+
+    def __init__(self, book: dict):
+        self.book = book
+        self.outline = parse_outline_lines(book["outline"].splitlines())
+        self.chapters, self.sections, self.items = self.outline.to_lists()
+
+
+def assemble_book(queue: WorkQueue, context: _BookContext, cache_mode: str | None = None) -> None:
+    """
+    Writes a book's queued results into its journal and builds the book from it, the way a
+    batch run does: every part is found in the journal, so no further calls are made.
+    """
+    book, outline = context.book, context.outline
+    output_dir = book["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    outline_path = os.path.join(output_dir, f"{book['name']}.outline.md")
+    with open(outline_path, "w", encoding="utf-8") as f:
+        f.write(book["outline"])
+
+    fingerprint = outline_fingerprint(outline.title, outline.description, outline.audience, context.chapters, context.sections, context.items)
+    with BookJournal(os.path.join(output_dir, f"{outline.title}.journal.jsonl"), fingerprint, snapshot=outline.snapshot()) as journal:
+        journal.carry_over(*queue.results(book["id"]))
+
+    run_generate_contents_and_save_book(output_dir=output_dir, outline_path=outline_path, resume=True, cache_mode=cache_mode)
+
+
+def run_worker(queue: WorkQueue, workers: int = 8, cache_mode: str | None = None, poll_interval: float = 5.0, owner: str | None = None) -> Telemetry:
+    """
+    Works through the queue with `workers` threads until no book is left building, then
+    returns the telemetry of the calls made. Every thread claims one task at a time from any
+    book; all threads share one response cache, one rate limiter and one model router.
+    """
+    load_env()
+    owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+    cache = ResponseCache.from_env(mode=cache_mode)
+    telemetry = Telemetry()
+    limiter = RateLimiter.from_env(max_concurrency=workers)
+    router = ModelRouter.from_env()
+    contexts: dict[str, _BookContext] = {}
+    contexts_lock = threading.Lock()
+
+    def context_for(book_id: str) -> _BookContext:
+        with contexts_lock:
+            if book_id not in contexts:
+                contexts[book_id] = _BookContext(queue.book(book_id))
+            return contexts[book_id]
+
+    def run_task(task: dict) -> str | None:
+        context = context_for(task["book_id"])
+        outline = context.outline
+        if task["kind"] == "assemble":
+            assemble_book(queue, context, cache_mode)
+            return None
+
+        c, s, i = item_coord(task["item"])
+        if task["kind"] == "parts":
+            raw_parts = generate_parts(
+                title=outline.title, description=outline.description, audience=outline.audience,
+                selectedChapter=c, chapters=context.chapters, selectedSection=s, sections=context.sections,
+                selectedItem=i, items=context.items, cache=cache, telemetry=telemetry, limiter=limiter, router=router
+            )
+            return json.dumps(parse_parts(raw_parts), ensure_ascii=False)
+
+        p = task["part"]
+        part_titles = queue.part_titles(task["book_id"], task["item"])
+        return generate_contents(
+            title=outline.title, description=outline.description, audience=outline.audience,
+            selectedChapter=c, selectedSection=s, selectedItem=i, selectedPart=p, part_title=task["title"],
+            previous_parts_titles=part_titles[:p], previous_parts_contents=queue.previous_contents(task["book_id"], task["item"], p),
+            chapters=context.chapters, sections=context.sections, items=context.items,
+            cache=cache, telemetry=telemetry, limiter=limiter, router=router
+        )
+
+    def renew_lease(task: dict, thread_owner: str, finished: threading.Event) -> None:
+        while not finished.wait(queue.lease_seconds / 3):
+            if not queue.renew(task, thread_owner):
+                return
+
+    def work(thread_owner: str) -> None:
+        while True:
+            task = queue.claim(thread_owner)
+            if task is None:
+                if queue.drained():
+                    return
+                time.sleep(poll_interval)
+                continue
+            # A long task (a big chapter, the pandoc export) keeps its lease while it runs
+            finished = threading.Event()
+            heartbeat = threading.Thread(target=renew_lease, args=(task, thread_owner, finished), daemon=True)
+            heartbeat.start()
+            try:
+                result = run_task(task)
+            except Exception as e:
+                print(f"❌ {task['kind']} task {task['item']}:{task['part']} of book {task['book_id']} failed: {e}")
+                queue.fail(task, thread_owner, str(e))
+            else:
+                queue.complete(task, thread_owner, result)
+            finally:
+                finished.set()
+                heartbeat.join()
+
+    threads = [threading.Thread(target=work, args=(f"{owner}-{n}",), daemon=True) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return telemetry
@@ -0,0 +1,92 @@
+import re
+import zipfile
+
+import pytest
+
+pypandoc = pytest.importorskip("pypandoc")
+try:
+    pypandoc.get_pandoc_version()
+except OSError:
+    pytest.skip("pandoc is not installed", allow_module_level=True)
+
+from src.export import export_docx, split_shards  # noqa: E402
+
+FRONT = "Front matter.\n\n"
+
+
+def chapter(n: int) -> str:
+    # Every chapter has the same heading, a link to it, a footnote and a numbered list, so
+    # the shards clash on bookmark names, footnote IDs and list IDs.
+    return (
+        f"# Introduction\n\nChapter {n} text[^note] with a [link back](#introduction).\n\n"
+        f"[^note]: Footnote of chapter {n}.\n\n"
+        f"1. First step of chapter {n}\n2. Second step of chapter {n}\n\n"
+    )
+
+
+def write_book(path, chapters: list[str]) -> list[int]:
+    text = FRONT + "".join(chapters)
+    offsets, at = [], len(FRONT)
+    for body in chapters:
+        offsets.append(at)
+        at += len(body)
+    path.write_text(text, encoding="utf-8")
+    return offsets
+
+
+def read_part(docx_path, name: str) -> str:
+    with zipfile.ZipFile(docx_path) as zf:
+        return zf.read(name).decode("utf-8")
+
+
+def test_split_shards_cuts_at_chapter_offsets():
+    assert split_shards(b"front|one|two", [6, 10]) == [b"front|", b"one|", b"two"]
+    # Offsets at the very start or past the end add no empty shard
+    assert split_shards(b"abc", [0, 3, 9]) == [b"abc"]
+
+
+def test_merged_docx_keeps_ids_unique(tmp_path):
+    book = tmp_path / "book.md"
+    docx = tmp_path / "book.docx"
+    offsets = write_book(book, [chapter(1), chapter(2)])
+
+    stats = export_docx(str(book), str(docx), offsets, str(tmp_path / "cache"))
+    assert stats == {"shards": 3, "converted": 3, "reused": 0}
+
+    document = read_part(docx, "word/document.xml")
+    for text in ("Front matter.", "Chapter 1 text", "Chapter 2 text", "Second step of chapter 2"):
+        assert text in document
+    assert document.count("<w:body>") == 1 and document.count("<w:sectPr") == 1
+
+    # The second chapter's heading is renamed, and its link follows it
+    bookmarks = re.findall(r'<w:bookmarkStart\b[^>]*?w:name="([^"]*)"', document)
+    assert len(bookmarks) == len(set(bookmarks))
+    assert {"introduction", "introduction-1"} <= set(bookmarks)
+    assert re.findall(r'w:anchor="([^"]*)"', document) == ["introduction", "introduction-1"]
+
+    footnotes = read_part(docx, "word/footnotes.xml")
+    assert "Footnote of chapter 1" in footnotes and "Footnote of chapter 2" in footnotes
+    references = re.findall(r'<w:footnoteReference\b[^>]*w:id="(\d+)"', document)
+    assert len(references) == 2 and len(set(references)) == 2
+    for reference in references:
+        assert f'w:id="{reference}"' in footnotes
+
+    numbering = read_part(docx, "word/numbering.xml")
+    num_ids = re.findall(r'<w:num w:numId="(\d+)"', numbering)
+    abstract_ids = re.findall(r'<w:abstractNum w:abstractNumId="(\d+)"', numbering)
+    assert len(num_ids) == len(set(num_ids))
+    assert len(abstract_ids) == len(set(abstract_ids))
+    assert set(re.findall(r'<w:numId w:val="(\d+)"', document)) <= set(num_ids)
+    # List definitions precede list instances, as the schema requires
+    assert numbering.rindex("<w:abstractNum ") < numbering.index("<w:num ")
+
+
+def test_unchanged_chapters_are_reused(tmp_path):
+    book = tmp_path / "book.md"
+    cache_dir = str(tmp_path / "cache")
+    export_docx(str(book), str(tmp_path / "book.docx"), write_book(book, [chapter(1), chapter(2)]), cache_dir)
+
+    offsets = write_book(book, [chapter(1), chapter(2).replace("Second step", "Revised step")])
+    stats = export_docx(str(book), str(tmp_path / "book.docx"), offsets, cache_dir)
+    assert stats == {"shards": 3, "converted": 1, "reused": 2}
+    assert "Revised step of chapter 2" in read_part(tmp_path / "book.docx", "word/document.xml")
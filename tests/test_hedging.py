@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from src.hedging import AttemptCancelled, LatencyTracker, hedged_call
+from src.rate_limit import CallTimeout
+
+
+def racing_attempts(*delays: float):
+    """An attempt function whose n-th call takes delays[n] seconds, unless it is cancelled first."""
+    calls = []
+    cancelled_attempts = []
+    lock = threading.Lock()
+
+    def attempt(cancelled, progress):
+        with lock:
+            index = len(calls)
+            calls.append(index)
+        progress.tick()
+        if cancelled.wait(delays[index]):
+            cancelled_attempts.append(index)
+            raise AttemptCancelled()
+        return f"attempt {index}"
+
+    return attempt, calls, cancelled_attempts
+
+
+def test_fast_call_is_not_hedged():
+    attempt, calls, _ = racing_attempts(0.0)
+    assert hedged_call(attempt, hedge_after=1.0) == ("attempt 0", False, False)
+    assert calls == [0]
+
+
+def test_hedge_completing_first_wins_and_cancels_the_original():
+    attempt, calls, cancelled_attempts = racing_attempts(5.0, 0.0)
+    started = time.monotonic()
+    assert hedged_call(attempt, hedge_after=0.05) == ("attempt 1", True, True)
+    assert time.monotonic() - started < 1.0
+    assert calls == [0, 1]
+
+    deadline = time.monotonic() + 1.0
+    while not cancelled_attempts and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cancelled_attempts == [0]
+
+
+def test_original_completing_first_wins_after_a_hedge():
+    attempt, calls, _ = racing_attempts(0.1, 5.0)
+    assert hedged_call(attempt, hedge_after=0.05) == ("attempt 0", True, False)
+    assert calls == [0, 1]
+
+
+def test_hedge_refused_by_budget_waits_for_the_original():
+    attempt, calls, _ = racing_attempts(0.1, 0.0)
+    assert hedged_call(attempt, hedge_after=0.01, start_hedge=lambda: False) == ("attempt 0", False, False)
+    assert calls == [0]
+
+
+def test_failed_attempt_leaves_the_race_to_the_other():
+    calls = []
+
+    def flaky(cancelled, progress):
+        calls.append(len(calls))
+        if len(calls) == 1:
+            time.sleep(0.1)
+            raise ConnectionError("reset")
+        time.sleep(0.2)
+        return "hedge"
+
+    assert hedged_call(flaky, hedge_after=0.05) == ("hedge", True, True)
+
+    def broken(cancelled, progress):
+        raise ConnectionError("reset")
+
+    with pytest.raises(ConnectionError):
+        hedged_call(broken, hedge_after=1.0)
+
+
+def test_timeout_raises_call_timeout():
+    attempt, _, _ = racing_attempts(5.0)
+    with pytest.raises(CallTimeout):
+        hedged_call(attempt, timeout=0.05)
+
+
+def test_timeout_counts_from_the_latest_piece_of_a_stream():
+    def streaming(cancelled, progress):
+        for _ in range(10):
+            progress.tick()
+            time.sleep(0.02)
+        return "done"
+
+    # The stream outlasts the timeout, yet never goes quiet for that long
+    assert hedged_call(streaming, timeout=0.1) == ("done", False, False)
+
+    def stalling(cancelled, progress):
+        progress.tick()
+        cancelled.wait(5.0)
+        raise AttemptCancelled()
+
+    with pytest.raises(CallTimeout, match="stalled"):
+        hedged_call(stalling, timeout=0.05)
+
+
+def test_first_token_timeout():
+    def silent(cancelled, progress):
+        cancelled.wait(5.0)
+        raise AttemptCancelled()
+
+    with pytest.raises(CallTimeout, match="first token"):
+        hedged_call(silent, first_token_timeout=0.05)
+
+    # A response that has started arriving may take longer than the first-token budget
+    def slow_stream(cancelled, progress):
+        progress.tick()
+        time.sleep(0.15)
+        return "done"
+
+    assert hedged_call(slow_stream, first_token_timeout=0.05) == ("done", False, False)
+
+
+def test_latency_tracker_needs_samples_and_caps_hedges():
+    tracker = LatencyTracker(min_samples=4, max_hedge_ratio=0.25)
+    for latency in (1.0, 2.0, 3.0):
+        tracker.observe(latency)
+    assert tracker.hedge_after(50) is None
+
+    tracker.observe(4.0)
+    assert tracker.hedge_after(50) == 2.5
+
+    assert tracker.try_hedge()
+    assert not tracker.try_hedge()
+    assert tracker.stats()["hedges"] == 1
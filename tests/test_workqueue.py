@@ -0,0 +1,118 @@
+import json
+import time
+
+import pytest
+
+from src.workqueue import WorkQueue
+
+OUTLINE = """## Title: Queue Book
+## Audience: Testers
+## Description: A book to exercise the work queue.
+## Learning Objectives:
+- Lease tasks
+
+### Chapter 1. First
+#### Section 1.1 Only
+##### 1.1.1 Alpha
+##### 1.1.2 Beta
+"""
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def make_queue(tmp_path, **options) -> tuple[WorkQueue, str]:
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), **options)
+    book_id, added = queue.add_book("queue-book", OUTLINE, str(tmp_path / "out"))
+    assert added
+    return queue, book_id
+
+
+def test_claim_leases_each_task_once(tmp_path, clock):
+    queue, book_id = make_queue(tmp_path)
+
+    first = queue.claim("w1")
+    second = queue.claim("w2")
+    assert (first["kind"], first["item"], first["attempts"]) == ("parts", "0.0.0", 1)
+    assert (second["kind"], second["item"]) == ("parts", "0.0.1")
+    assert queue.claim("w3") is None
+
+    # A finished part list unblocks the item's first part body
+    assert queue.complete(first, "w1", json.dumps(["Intro", "Details"]))
+    content = queue.claim("w3")
+    assert (content["kind"], content["item"], content["part"], content["title"]) == ("content", "0.0.0", 0, "Intro")
+
+
+def test_expired_lease_is_claimed_again(tmp_path, clock):
+    queue, book_id = make_queue(tmp_path, lease_seconds=60)
+    task = queue.claim("w1")
+    queue.claim("w1")
+
+    clock[0] += 30
+    assert queue.claim("w2") is None
+
+    clock[0] += 31
+    reclaimed = queue.claim("w2")
+    assert (reclaimed["item"], reclaimed["attempts"]) == (task["item"], 2)
+    # The first worker lost its lease, so its late result is dropped
+    assert not queue.complete(task, "w1", json.dumps(["Late"]))
+    assert queue.complete(reclaimed, "w2", json.dumps(["On time"]))
+    assert queue.part_titles(book_id, task["item"]) == ["On time"]
+
+
+def test_renewed_lease_is_kept(tmp_path, clock):
+    queue, book_id = make_queue(tmp_path, lease_seconds=60)
+    task = queue.claim("w1")
+    other = queue.claim("w1")
+
+    for _ in range(3):
+        clock[0] += 40
+        assert queue.renew(task, "w1") and queue.renew(other, "w1")
+        assert queue.claim("w2") is None
+
+    # Once the lease is lost it cannot be renewed
+    clock[0] += 61
+    reclaimed = queue.claim("w2")
+    assert reclaimed["item"] == task["item"]
+    assert not queue.renew(task, "w1")
+    assert queue.renew(reclaimed, "w2")
+
+
+def test_lease_expiring_on_last_attempt_fails_the_task(tmp_path, clock):
+    queue, book_id = make_queue(tmp_path, lease_seconds=60, max_attempts=2)
+    task = queue.claim("w1")
+    queue.claim("w1")
+
+    clock[0] += 61
+    assert queue.claim("w2")["attempts"] == 2
+    queue.claim("w2")
+
+    clock[0] += 61
+    assert queue.claim("w3") is None
+    book = queue.book(book_id)
+    assert book["status"] == "failed"
+    assert "lease expired" in book["error"]
+    assert queue.progress()[0]["tasks"]["failed"] == 1
+    assert queue.drained()
+
+    # Adding the book again retries the failed task
+    assert queue.add_book("queue-book", OUTLINE, str(tmp_path / "out")) == (book_id, False)
+    retried = queue.claim("w4")
+    assert (retried["item"], retried["attempts"]) == (task["item"], 1)
+
+
+def test_fail_requeues_until_max_attempts(tmp_path, clock):
+    queue, book_id = make_queue(tmp_path, max_attempts=2)
+    task = queue.claim("w1")
+    queue.fail(task, "w1", "boom")
+    assert queue.book(book_id)["status"] == "building"
+
+    task = queue.claim("w1")
+    assert task["attempts"] == 2
+    queue.fail(task, "w1", "boom again")
+    book = queue.book(book_id)
+    assert (book["status"], book["error"]) == ("failed", "boom again")